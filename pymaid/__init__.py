@@ -35,6 +35,12 @@ except Exception as error:
     logger.warning(str(error))
     logger.warning('Error importing pymaid.morpho:\n' + str(error))
 
+try:
+    from .nblast_funcs import *
+except Exception as error:
+    logger.warning(str(error))
+    logger.warning('Error importing pymaid.nblast_funcs:\n' + str(error))
+
 try:
     from .plotting import *
 except Exception as error:
@@ -91,6 +97,12 @@ except Exception as error:
     logger.warning(str(error))
     logger.warning('Error importing pymaid.connectivity:\n' + str(error))
 
+try:
+    from .snapshot import *
+except Exception as error:
+    logger.warning(str(error))
+    logger.warning('Error importing pymaid.snapshot:\n' + str(error))
+
 try:
     from .utils import *
 except Exception as error:
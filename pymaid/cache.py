@@ -16,15 +16,23 @@
 #    along
 
 """ This module contains classes and decorators to set up a basic cache
-for responses from the CATMAID server.
+for responses from the CATMAID server and a persistent, on-disk cache for
+results of per-neuron analyses.
 """
 
+import hashlib
+import inspect
+import os
 import pickle
 import sys
 import datetime
+import uuid
 from functools import wraps
 from collections import OrderedDict
 
+import numpy as np
+import pandas as pd
+
 from . import utils, config
 
 # Set up logging
@@ -325,3 +333,358 @@ def undo_on_error(function):
             raise
         return res
     return wrapper
+
+
+# Persistent store for per-neuron analyses - disabled by default. See
+# setup_analysis_cache()
+analysis_cache = None
+
+
+class AnalysisCache:
+    """On-disk store for results of per-neuron analyses.
+
+    Each result is pickled into a separate file named after its key. If the
+    size limit [mb] is exceeded, the least recently used results are evicted.
+    Can be shared between processes and sessions.
+
+    Parameters
+    ----------
+    path :          str, optional
+                    Directory to store results in. Defaults to
+                    ``~/.pymaid/analysis_cache``.
+    size_limit :    int | float | None, optional
+                    Maximum size [mb] of the store.
+
+    """
+
+    def __init__(self, path=None, size_limit=1000):
+        if isinstance(path, type(None)):
+            path = os.path.join(os.path.expanduser('~'), '.pymaid',
+                                'analysis_cache')
+        self.path = path
+        self.size_limit = size_limit
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self._size = sum([os.path.getsize(f) for f in self._files()])
+        self._check_size_limit()
+
+    def _files(self):
+        return [os.path.join(self.path, f) for f in os.listdir(self.path)
+                if f.endswith('.pickle')]
+
+    def _file(self, key):
+        return os.path.join(self.path, '{}.pickle'.format(key))
+
+    def __getitem__(self, key):
+        f = self._file(key)
+        try:
+            with open(f, 'rb') as fh:
+                value = pickle.load(fh)
+        except FileNotFoundError:
+            raise KeyError(key)
+        except BaseException:
+            # Unreadable (e.g. truncated) results are simply recomputed
+            raise KeyError(key)
+
+        # Mark as recently used
+        try:
+            os.utime(f)
+        except OSError:
+            pass
+
+        return value
+
+    def __setitem__(self, key, value):
+        f = self._file(key)
+        # Write to temporary file first -> other processes never see
+        # partially written results
+        tmp = '{}.{}.tmp'.format(f, uuid.uuid4().hex)
+        with open(tmp, 'wb') as fh:
+            pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        self._size += os.path.getsize(tmp)
+        os.replace(tmp, f)
+
+        self._check_size_limit()
+
+    def __contains__(self, key):
+        return os.path.isfile(self._file(key))
+
+    def __len__(self):
+        return len(self._files())
+
+    def get(self, key, fallback=None):
+        try:
+            return self.__getitem__(key)
+        except KeyError:
+            return fallback
+
+    def clear(self):
+        """Remove all results from the store."""
+        for f in self._files():
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+        self._size = 0
+
+    def _check_size_limit(self):
+        """Evict least recently used results if size limit is exceeded."""
+        if isinstance(self.size_limit, type(None)):
+            return
+        if self._size <= self.size_limit * 1000 ** 2:
+            return
+
+        # Other processes might have added/evicted results
+        stats = []
+        for f in self._files():
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            stats.append((st.st_mtime, st.st_size, f))
+        stats = sorted(stats)
+
+        self._size = sum([s[1] for s in stats])
+        while stats and self._size > self.size_limit * 1000 ** 2:
+            _, size, f = stats.pop(0)
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+            self._size -= size
+
+    @property
+    def size(self):
+        """Size [mb] of stored results."""
+        return round(self._size / 1000 ** 2, 1)
+
+    def __repr__(self):
+        return 'AnalysisCache at {} (size limit: {}mb). {} items ' \
+               '({}mb).'.format(self.path, self.size_limit, len(self),
+                                self.size)
+
+
+def setup_analysis_cache(path=None, size_limit=1000):
+    """Set up persistent memoization of per-neuron analyses.
+
+    Results of e.g. :func:`~pymaid.strahler_index`,
+    :func:`~pymaid.flow_centrality`, :func:`~pymaid.to_dotprops` or
+    :func:`~pymaid.morphometrics` are stored on disk, keyed on a hash of the
+    neuron's nodes, connectors and tags plus the function's parameters.
+    Repeated runs over unchanged neurons will load results instead of
+    recomputing them.
+
+    Parameters
+    ----------
+    path :          str, optional
+                    Directory to store results in. Defaults to
+                    ``~/.pymaid/analysis_cache``.
+    size_limit :    int | float | None, optional
+                    Maximum size [mb] of the store. If exceeded, least
+                    recently used results are evicted.
+
+    Returns
+    -------
+    AnalysisCache
+
+    Examples
+    --------
+    >>> pymaid.cache.setup_analysis_cache('/tmp/pymaid_cache', size_limit=500)
+    >>> nl = pymaid.get_neuron('annotation:glomerulus DA1')
+    >>> # First run computes...
+    >>> m = pymaid.morphometrics(nl)
+    >>> # ... the second run merely loads results
+    >>> m = pymaid.morphometrics(nl)
+    >>> # Disable again
+    >>> pymaid.cache.disable_analysis_cache()
+
+    """
+    global analysis_cache
+    analysis_cache = AnalysisCache(path=path, size_limit=size_limit)
+    return analysis_cache
+
+
+def disable_analysis_cache():
+    """Disable persistent memoization of per-neuron analyses.
+
+    Results already on disk are kept. Use ``AnalysisCache.clear()`` to
+    remove them.
+
+    """
+    global analysis_cache
+    analysis_cache = None
+
+
+def _neuron_hash(x):
+    """Hash content of a neuron: nodes, connectors and tags."""
+    h = hashlib.sha1()
+
+    nodes = x.nodes
+    h.update(nodes.treenode_id.values.astype(np.int64).tobytes())
+    parents = nodes.parent_id.values
+    parents = np.where(pd.isnull(parents), -1, parents).astype(np.int64)
+    h.update(parents.tobytes())
+    for c in ['x', 'y', 'z', 'radius', 'confidence']:
+        if c in nodes.columns:
+            h.update(nodes[c].values.astype(np.float64).tobytes())
+
+    cn = x.connectors
+    for c in ['connector_id', 'treenode_id', 'relation']:
+        if c in cn.columns:
+            h.update(cn[c].values.astype(np.int64).tobytes())
+    for c in ['x', 'y', 'z']:
+        if c in cn.columns:
+            h.update(cn[c].values.astype(np.float64).tobytes())
+
+    tags = sorted([(str(k), sorted([int(t) for t in v]))
+                   for k, v in x.tags.items()])
+    h.update(repr(tags).encode())
+
+    return h.hexdigest()
+
+
+def memoize(kind='value', columns=None, attrs=None, ignore=None):
+    """Decorator for persistent, content-hashed memoization of per-neuron
+    analyses.
+
+    Only active if :func:`~pymaid.cache.setup_analysis_cache` was called.
+    The decorated function's first argument must be a CatmaidNeuron or a
+    CatmaidNeuronList. For neuronlists, results are looked up per neuron and
+    only the missing neurons are passed on to the function - in one batch.
+
+    Parameters
+    ----------
+    kind :      'value' | 'rows' | 'nodes'
+                What the function produces:
+
+                  - ``'value'``: returns a result per neuron (or a list of
+                    results for neuronlists)
+                  - ``'rows'``: returns a DataFrame with one row per neuron,
+                    indexed by skeleton ID
+                  - ``'nodes'``: adds ``columns`` to the node table and sets
+                    ``attrs`` in place. If the function has an ``inplace``
+                    parameter, it is respected.
+
+    columns :   list of str, optional
+                Node table columns generated by the function. Only for
+                ``kind='nodes'``.
+    attrs :     list of str, optional
+                Neuron attributes set by the function. Only for
+                ``kind='nodes'``.
+    ignore :    list of str, optional
+                Parameters that do not affect the results (e.g. number of
+                cores) and are hence not part of the key.
+
+    """
+    if kind not in ['value', 'rows', 'nodes']:
+        raise ValueError('Unknown kind "{}"'.format(kind))
+
+    if isinstance(columns, type(None)):
+        columns = []
+    if isinstance(attrs, type(None)):
+        attrs = []
+    if isinstance(ignore, type(None)):
+        ignore = []
+
+    def decorator(function):
+        sig = inspect.signature(function)
+        first = list(sig.parameters)[0]
+        has_inplace = 'inplace' in sig.parameters
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if isinstance(analysis_cache, type(None)):
+                return function(*args, **kwargs)
+
+            from . import core, __version__
+
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = OrderedDict(bound.arguments)
+            x = params.pop(first)
+            inplace = params.pop('inplace', True)
+
+            if not isinstance(x, (core.CatmaidNeuron, core.CatmaidNeuronList)):
+                return function(*args, **kwargs)
+
+            if kind == 'nodes' and not inplace:
+                x = x.copy()
+
+            neurons = [x] if isinstance(x, core.CatmaidNeuron) else list(x)
+
+            # Key is made from function, neuron content and parameters
+            params_str = repr(sorted([(k, v) for k, v in params.items()
+                                      if k not in ignore]))
+            prefix = '{}|{}.{}|{}'.format(__version__, function.__module__,
+                                          function.__qualname__, params_str)
+            keys = ['{}|{}'.format(prefix, _neuron_hash(n)) for n in neurons]
+            keys = [hashlib.sha1(k.encode()).hexdigest() for k in keys]
+
+            results = {}
+            for i, k in enumerate(keys):
+                try:
+                    results[i] = analysis_cache[k]
+                except KeyError:
+                    pass
+
+            miss = [i for i in range(len(neurons)) if i not in results]
+            logger.debug('Analysis cache: {} of {} neurons found for '
+                         '{}'.format(len(results), len(neurons),
+                                     function.__name__))
+
+            if miss:
+                if len(miss) == 1:
+                    to_calc = neurons[miss[0]]
+                else:
+                    to_calc = core.CatmaidNeuronList([neurons[i]
+                                                      for i in miss])
+                    # Keep parallel processing settings
+                    if isinstance(x, core.CatmaidNeuronList):
+                        to_calc._use_parallel = x._use_parallel
+                        to_calc.n_cores = x.n_cores
+
+                call_params = OrderedDict(params)
+                call_params[first] = to_calc
+                if has_inplace:
+                    call_params['inplace'] = True
+                res = function(**call_params)
+
+                if kind == 'value':
+                    res = [res] if len(miss) == 1 else list(res)
+                elif kind == 'rows':
+                    res = [res.iloc[[j]] for j in range(len(miss))]
+                else:
+                    res = [{'columns': {c: neurons[i].nodes[c].values
+                                        for c in columns},
+                            'attrs': {a: getattr(neurons[i], a, None)
+                                      for a in attrs}}
+                           for i in miss]
+
+                for i, r in zip(miss, res):
+                    analysis_cache[keys[i]] = r
+                    results[i] = r
+
+            results = [results[i] for i in range(len(neurons))]
+
+            if kind == 'value':
+                if isinstance(x, core.CatmaidNeuron):
+                    return results[0]
+                return results
+            elif kind == 'rows':
+                df = pd.concat(results, axis=0)
+                df.index = pd.Index([n.skeleton_id for n in neurons],
+                                    name=df.index.name)
+                return df
+
+            for n, r in zip(neurons, results):
+                for c, v in r['columns'].items():
+                    n.nodes[c] = v
+                for a, v in r['attrs'].items():
+                    setattr(n, a, v)
+
+            if has_inplace and not inplace:
+                return x
+
+        return wrapper
+    return decorator
@@ -17,15 +17,14 @@
 import os
 import json
 import colorsys
-import math
+import multiprocessing as mp
 
 import numpy as np
 import pandas as pd
 import scipy.cluster.hierarchy
+import scipy.sparse
 import scipy.spatial
 
-from concurrent.futures import ThreadPoolExecutor
-
 from . import fetch, core, plotting, utils, config
 
 # Set up logging
@@ -124,6 +123,17 @@ def cluster_by_connectivity(x, similarity='vertex_normalized',
                          :func:`~pymaid.get_partners`. If provided, will use
                          this instead of querying CATMAID server. Filters
                          still apply!
+    cluster_kws :        dict, optional
+                         Parameters for the similarity calculation:
+
+                         - ``C1`` and ``C2`` for vertex similarities (see
+                           above)
+                         - ``block_size``: max number of (partner, neuron,
+                           neuron) combinations processed at once when
+                           calculating vertex similarities (default 2**22).
+                           Lower this if you run out of memory.
+
+                         Other keys are ignored.
     skip_missing :       bool, optional
                          If True, neurons that don't have connectivity data
                          (i.e. no up-/ and/or downstream partners after
@@ -191,20 +201,29 @@ def cluster_by_connectivity(x, similarity='vertex_normalized',
 
         logger.info('{} entries after filtering'.format(connectivity.shape[0]))
 
+    # Partner x neuron matrices of synapse counts - one per direction
+    matrices = {}
+    for d in directions:
+        this_cn = connectivity[connectivity.relation == d]
+        if this_cn.shape[0] == 0:
+            logger.warning('No {} partners found: filtered?'.format(d))
+        matrices[d] = this_cn[neurons].values.astype(float)
+
     # Calc number of partners used for calculating matching score (i.e. ratio of input to outputs)!
     # This is AFTER filtering! Total number of partners can be altered!
-    n_partners = {n: {r: connectivity[(connectivity[str(n)] > 0) & (connectivity.relation == r)].shape[0]
-                      for r in directions}
-                  for n in neurons}
+    n_partners = {d: (matrices[d] > 0).sum(axis=0) for d in directions}
 
     # Make sure all neurons have connectivity data to calculate similarity
-    no_data = [n for n in neurons if sum(n_partners[n].values()) == 0]
+    has_data = sum(n_partners.values()) > 0
+    no_data = [n for n, h in zip(neurons, has_data) if not h]
 
     if no_data:
         w = '{} neuron(s) without connectivity data found.'.format(len(no_data))
         if skip_missing:
             w += ' Skipped: {}'.format(', '.join(no_data))
-            neurons = list(set(neurons) - set(no_data))
+            neurons = [n for n, h in zip(neurons, has_data) if h]
+            matrices = {d: m[:, has_data] for d, m in matrices.items()}
+            n_partners = {d: n[has_data] for d, n in n_partners.items()}
         else:
             w += ' These neurons might have "NaN" similarities.'
         logger.warning(w)
@@ -214,41 +233,13 @@ def cluster_by_connectivity(x, similarity='vertex_normalized',
     neuron_names = fetch.get_names(list(set(neurons + connectivity.skeleton_id.tolist())),
                                    remote_instance=remote_instance)
 
-    matching_scores = {}
-
-    if similarity in ['vertex_normalized', 'vertex']:
-        vertex_score = True
-    else:
-        vertex_score = False
-
     # Calculate connectivity similarity by direction
+    matching_scores = {}
     for d in directions:
-        this_cn = connectivity[connectivity.relation == d]
-
-        # Prepare connectivity subsets:
-        cn_subsets = {n: this_cn[n] > 0 for n in neurons}
-
         logger.info('Calculating {} similarity scores'.format(d))
-        matching_scores[d] = pd.DataFrame(np.zeros((len(neurons), len(neurons))),
-                                          index=neurons, columns=neurons)
-        if this_cn.shape[0] == 0:
-            logger.warning('No {} partners found: filtered?'.format(d))
-
-        combinations = [(nA, nB, this_cn, vertex_score, cn_subsets[nA],
-                         cn_subsets[nB], cluster_kws) for nA in neurons for nB in neurons]
-
-        with ThreadPoolExecutor(max_workers=max(1, os.cpu_count())) as e:
-            futures = e.map(_unpack_connectivity_helper, combinations)
-
-            matching_indices = [n for n in config.tqdm(futures,
-                                                       total=len(combinations),
-                                                       desc=d,
-                                                       disable=config.pbar_hide,
-                                                       leave=config.pbar_leave)]
-
-        for i, v in enumerate(combinations):
-            matching_scores[d].loc[v[0], v[1]
-                                   ] = matching_indices[i][similarity]
+        matching_scores[d] = _connectivity_similarity(matrices[d],
+                                                      similarity=similarity,
+                                                      **cluster_kws)
 
     # Attention! Averaging over incoming and outgoing pairing scores will
     # give weird results with - for example - sensory/motor neurons
@@ -258,27 +249,24 @@ def cluster_by_connectivity(x, similarity='vertex_normalized',
     # Ratio is applied to neuronA of A-B comparison -> will be reversed at B-A
     # comparison
     logger.info('Finalizing scores')
-    dist_matrix = pd.DataFrame(
-        np.zeros((len(neurons), len(neurons))), index=neurons, columns=neurons)
-    for neuronA in neurons:
-        for neuronB in neurons:
-            if len(directions) == 1:
-                dist_matrix[neuronA][neuronB] = matching_scores[
-                    directions[0]][neuronA][neuronB]
-            else:
-                try:
-                    r_inputs = n_partners[neuronA][
-                        'upstream'] / (n_partners[neuronA]['upstream'] + n_partners[neuronA]['downstream'])
-                    r_outputs = 1 - r_inputs
-                except BaseException():
-                    logger.warning('Failed to calculate input/output ratio '
-                                   'for skeleton ID #{} assuming 50/50 '
-                                   '(probably "division-by-0" error)'.format(neuronA))
-                    r_inputs = 0.5
-                    r_outputs = 0.5
-
-                dist_matrix[neuronA][neuronB] = matching_scores['upstream'][neuronA][
-                    neuronB] * r_inputs + matching_scores['downstream'][neuronA][neuronB] * r_outputs
+    if len(directions) == 1:
+        scores = matching_scores[directions[0]]
+    else:
+        n_total = n_partners['upstream'] + n_partners['downstream']
+        if any(n_total == 0):
+            logger.warning('Failed to calculate input/output ratio for '
+                           'skeleton ID(s) {} - assuming 50/50'.format(
+                            ', '.join(np.array(neurons)[n_total == 0])))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r_inputs = np.where(n_total > 0,
+                                n_partners['upstream'] / n_total,
+                                0.5)
+        r_outputs = 1 - r_inputs
+
+        scores = matching_scores['upstream'] * r_inputs[np.newaxis, :] \
+            + matching_scores['downstream'] * r_outputs[np.newaxis, :]
+
+    dist_matrix = pd.DataFrame(scores, index=neurons, columns=neurons)
 
     logger.info('All done.')
 
@@ -295,166 +283,172 @@ def cluster_by_connectivity(x, similarity='vertex_normalized',
     return results
 
 
-def _unpack_connectivity_helper(x):
-    """Helper function to unpack values from pool."""
-    return _calc_connectivity_matching_index(x[0], x[1], x[2], vertex_score=x[3], nA_cn=x[4], nB_cn=x[5], **x[6])
-
-
-def _calc_connectivity_matching_index(neuronA, neuronB, connectivity,
-                                      syn_threshold=1, min_nodes=1, **kwargs):
-    """Calculate various connectivity similarity metrics.
+def _connectivity_similarity(mat, similarity='vertex_normalized', C1=0.5,
+                             C2=1, block_size=2**22, **kwargs):
+    """Calculate connectivity similarity between all pairs of neurons.
 
     Parameters
     ----------
-    neuronA :         skeleton ID
-    neuronB :         skeleton ID
-    connectivity :    pandas DataFrame
-                      Connectivity data as provided by :func:`pymaid.get_partners`.
-    syn_threshold :   int, optional
-                      Min number of synapses for a connection to be considered.
-                      Default = 1
-    min_nodes :       int, optional
-                      Min number of nodes for a partner to be considered use
-                      this to filter fragments. Default = 1
-    vertex_score :    bool, optional
-                      If False, no vertex score is returned (much faster!).
-                      Default = True
-    nA_cn/nB_cn :     list of bools
-                      Subsets of the connectivity that connect to either
-                      neuronA or neuronB -> if not provided, will be calculated
-                      -> time consuming
+    mat :           numpy array
+                    (N_partners, N_neurons) matrix of synapse counts between
+                    partners (rows) and neurons (columns).
+    similarity :    'matching_index' | 'matching_index_synapses' | 'matching_index_weighted_synapses' | 'vertex' | 'vertex_normalized'
+                    Metric to calculate. See
+                    :func:`~pymaid.cluster_by_connectivity` for details.
+    C1,C2 :         int | float, optional
+                    Parameters for vertex similarity.
+    block_size :    int, optional
+                    Max number of (partner, neuron, neuron) combinations
+                    processed at once when calculating vertex similarities.
+                    Lower this if you run out of memory.
+    **kwargs
+                    Other keyword arguments are ignored.
 
     Returns
     -------
-    dict
-                      Containing all initially described matching indices
+    numpy array
+                    (N_neurons, N_neurons) similarity matrix.
 
     Notes
     -----
-    |matching_index =           Number of shared partners divided by total
-    |                           number of partners
-
-    |matching_index_synapses =  Number of shared synapses divided by total number
-    |                           of synapses. Attention! matching_index_synapses
-    |                           is tricky, because if neuronA has lots of
-    |                           connections and neuronB only little, they will
-    |                           still get a high matching index.
-    |                           E.g. 100 of 200 / 1 of 50 = 101/250
-    |                           -> ``matching index = 0.404``
-
-    |matching_index_weighted_synapses = Similar to matching_index_synapses but
-    |                           slightly less prone to above mentioned error:
-    |                           % of shared synapses A * % of shared synapses
-    |                           B * 2 / (% of shared synapses A + % of shared
-    |                           synapses B)
-    |                           -> value will be between 0 and 1; if one neuronB
-    |                           has only few connections (percentage) to a shared
-    |                           partner, the final value will also be small
-
-    |vertex_normalized =        Matching index that rewards shared and punishes
-    |                           non-shared partners. Vertex similarity based on
-    |                           Jarrell et al., 2012:
-    |                           f(x,y) = min(x,y) - C1 * max(x,y) * e^(-C2 * min(x,y))
-    |                           x,y = edge weights to compare
-    |                           vertex_similarity is the sum of f over all vertices
-    |                           C1 determines how negatively a case where one edge
-    |                           is much stronger than another is punished
-    |                           C2 determines the point where the similarity
-    |                           switches from negative to positive
+    Shared partner and synapse counts are calculated as sparse matrix
+    products. Vertex similarities are non-linear in the edge weights and are
+    instead summed over all pairs of neurons sharing a given partner.
 
     """
-    if min_nodes > 1:
-        connectivity = connectivity[connectivity.num_nodes > min_nodes]
+    mat = np.asarray(mat, dtype=float)
+    n_neurons = mat.shape[1]
+
+    # Total synapses per neuron
+    syn_total = mat.sum(axis=0)
+
+    if similarity in ['matching_index', 'matching_index_synapses',
+                      'matching_index_weighted_synapses']:
+        cn = scipy.sparse.csr_matrix(mat)
+        binary = (cn > 0).astype(float)
+
+        # Number of shared partners for each pair
+        n_shared = (binary.T @ binary).toarray()
+        n_partners = np.asarray(binary.sum(axis=0)).ravel()
+        n_total = n_partners[:, np.newaxis] + n_partners[np.newaxis, :] - n_shared
+
+        # syn_shared[a, b] = synapses of A onto partners shared with B
+        syn_shared = (cn.T @ binary).toarray()
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if similarity == 'matching_index':
+                score = n_shared / n_total
+            elif similarity == 'matching_index_synapses':
+                score = (syn_shared + syn_shared.T) \
+                    / (syn_total[:, np.newaxis] + syn_total[np.newaxis, :])
+            else:
+                frac_shared = syn_shared / syn_total[:, np.newaxis]
+                score = frac_shared * frac_shared.T
 
-    vertex_score = kwargs.get('vertex_score', True)
-    nA_cn = kwargs.get('nA_cn', connectivity[neuronA] >= syn_threshold)
-    nB_cn = kwargs.get('nB_cn', connectivity[neuronB] >= syn_threshold)
+        return np.where(n_total > 0, np.nan_to_num(score), 0)
+    elif similarity not in ['vertex', 'vertex_normalized']:
+        raise ValueError('Unknown similarity metric "{}"'.format(similarity))
 
-    total = connectivity[nA_cn | nB_cn]
-    n_total = total.shape[0]
+    # Vertex similarity based on Jarrell et al., 2012
+    # f(x,y) = min(x,y) - C1 * max(x,y) * e^(-C2 * min(x,y))
+    # For non-shared partners (min = 0) this collapses to -C1 * (x + y), so
+    # the sum over all partners is -C1 * (total_A + total_B) plus a
+    # correction that only needs to be evaluated for shared partners:
+    # h(x,y) = f(x,y) + C1 * (x + y)
+    #        = (1 + C1) * min(x,y) + C1 * max(x,y) * (1 - e^(-C2 * min(x,y)))
+    # Likewise, the max possible score is the sum of
+    # q(m) = m - C1 * m * e^(-C2 * m) over max(x,y) which - because
+    # q(max) + q(min) = q(x) + q(y) - equals q_A + q_B - sum(q(min(x,y)))
+    def q(m):
+        return m - C1 * m * np.exp(-C2 * m)
+
+    h_shared = np.zeros((n_neurons, n_neurons))
+    min_shared = np.zeros((n_neurons, n_neurons))
+    q_shared = np.zeros((n_neurons, n_neurons))
+
+    # Each partner contributes to all pairs of neurons it connects to: walk
+    # the partners in chunks of at most block_size (partner, A, B) triplets
+    cn = scipy.sparse.csr_matrix(mat)
+    n_per_partner = np.diff(cn.indptr)
+    n_triplets = n_per_partner.astype(np.int64) ** 2
+    chunk_ix = np.cumsum(n_triplets) // max(1, block_size)
+    chunks = np.split(np.arange(mat.shape[0]),
+                      np.where(np.diff(chunk_ix))[0] + 1)
+
+    for rows in config.tqdm(chunks, desc='Vertex sim.',
+                            disable=config.pbar_hide or len(chunks) == 1,
+                            leave=config.pbar_leave):
+        if not n_triplets[rows].sum():
+            continue
+        # Index of each triplet's partner (within this chunk)
+        this_p = np.repeat(np.arange(rows.shape[0]), n_triplets[rows])
+        # Position of each triplet within its partner's block
+        offset = np.repeat(np.cumsum(n_triplets[rows]) - n_triplets[rows],
+                           n_triplets[rows])
+        pos = np.arange(this_p.shape[0]) - offset
 
-    shared = connectivity[nA_cn & nB_cn]
-    n_shared = shared.shape[0]
+        n = n_per_partner[rows][this_p]
+        start = cn.indptr[rows][this_p]
+        ixA = start + pos // n
+        ixB = start + pos % n
 
-    shared_sum = shared.sum()
-    n_synapses_sharedA = shared_sum[neuronA]
-    n_synapses_sharedB = shared_sum[neuronB]
-    n_synapses_shared = n_synapses_sharedA + n_synapses_sharedB
+        x, y = cn.data[ixA], cn.data[ixB]
+        this_min = np.minimum(x, y)
+        this_max = np.maximum(x, y)
 
-    total_sum = total.sum()
-    n_synapses_totalA = total_sum[neuronA]
-    n_synapses_totalB = total_sum[neuronB]
-    n_synapses_total = n_synapses_totalA + n_synapses_totalB
+        pairs = cn.indices[ixA].astype(np.int64) * n_neurons + cn.indices[ixB]
+        np.add.at(h_shared.ravel(), pairs,
+                  (1 + C1) * this_min + C1 * this_max * (1 - np.exp(-C2 * this_min)))
+        np.add.at(min_shared.ravel(), pairs, this_min)
+        np.add.at(q_shared.ravel(), pairs, q(this_min))
 
-    # Vertex similarity based on Jarrell et al., 2012
-    # f(x,y) = min(x,y) - C1 * max(x,y) * e^(-C2 * min(x,y))
-    # x,y = edge weights to compare
-    # vertex_similarity is the sum of f over all vertices
-    # C1 determines how negatively a case where one edge is much stronger than
-    #    another is punished
-    # C2 determines the point where the similarity switches from negative to
-    # positive
-    C1 = kwargs.get('C1', 0.5)
-    C2 = kwargs.get('C2', 1)
-    vertex_similarity = 0
-    max_score = 0
-    similarity_indices = {}
-
-    if vertex_score:
-        # We only need the columns for neuronA and neuronB
-        this_cn = total[[neuronA, neuronB]]
-
-        # Get min and max between both neurons
-        this_max = np.max(this_cn, axis=1)
-        this_min = np.min(this_cn, axis=1)
-
-        # The max possible score is when both synapse counts are the same:
-        # in which case score = max(x,y) - C1 * max(x,y) * e^(-C2 * max(x,y))
-        max_score = this_max - C1 * this_max * np.exp(- C2 * this_max)
-
-        # The smallest possible score is when either synapse count is 0:
-        # in which case score = -C1 * max(a,b)
-        min_score = -C1 * this_max
-
-        # Implement: f(x,y) = min(x,y) - C1 * max(x,y) * e^(-C2 * min(x,y))
-        v_sim = this_min - C1 * this_max * np.exp(- C2 * this_min)
-
-        # Sum over all partners
-        vertex_similarity = v_sim.sum()
-
-        similarity_indices['vertex'] = vertex_similarity
+    pair_total = syn_total[:, np.newaxis] + syn_total[np.newaxis, :]
+    vertex_similarity = h_shared - C1 * pair_total
 
-        try:
-            similarity_indices['vertex_normalized'] = (
-                vertex_similarity - min_score.sum()) / (max_score.sum() - min_score.sum())
-        except BaseException:
-            similarity_indices['vertex_normalized'] = 0
-
-    if n_total != 0:
-        similarity_indices['matching_index'] = n_shared / n_total
-        similarity_indices[
-            'matching_index_synapses'] = n_synapses_shared / n_synapses_total
-        if n_synapses_sharedA != 0 and n_synapses_sharedB != 0:
-            similarity_indices['matching_index_weighted_synapses'] = (
-                n_synapses_sharedA / n_synapses_totalA) * (n_synapses_sharedB / n_synapses_totalB)
-        else:
-            # If no shared synapses at all:
-            similarity_indices['matching_index_weighted_synapses'] = 0
-    else:
-        similarity_indices['matching_index'] = 0
-        similarity_indices['matching_index_synapses'] = 0
-        similarity_indices['matching_index_weighted_synapses'] = 0
+    if similarity == 'vertex':
+        return vertex_similarity
+
+    q_total = q(mat).sum(axis=0)
+    max_score = q_total[:, np.newaxis] + q_total[np.newaxis, :] - q_shared
+    min_score = -C1 * (pair_total - min_shared)
 
-    return similarity_indices
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (vertex_similarity - min_score) / (max_score - min_score)
 
 
-def _unpack_synapse_helper(x):
-    """Helper function to unpack values from pool."""
-    return _calc_synapse_similarity(x[0], x[1], x[2], x[3], x[4])
+def _synapse_trees(cn, omega, restrict_cn=None):
+    """Prepare a neuron's connectors for synapse similarity scoring.
 
+    Parameters
+    ----------
+    cn :            pandas.DataFrame
+                    CatmaidNeuron connector table.
+    omega :         int
+                    Radius in nanometer over which to calculate synapse
+                    density.
+    restrict_cn :   list, optional
+                    Connector types to use. If None, will use all.
+
+    Returns
+    -------
+    dict
+                    ``{relation: (coords, cKDTree, density)}`` where density
+                    is the number of same-type connectors within ``omega``
+                    of each connector (counting itself).
 
-def _calc_synapse_similarity(cnA, cnB, sigma=2000, omega=2000,
-                             restrict_cn=None):
+    """
+    trees = {}
+    for r, this_cn in cn.groupby('relation'):
+        if not isinstance(restrict_cn, type(None)) and r not in restrict_cn:
+            continue
+        coords = this_cn[['x', 'y', 'z']].values.astype(float)
+        tree = scipy.spatial.cKDTree(coords)
+        density = tree.query_ball_point(coords, omega, return_length=True)
+        trees[r] = (coords, tree, density)
+    return trees
+
+
+def _synapse_similarity(treesA, treesB, sigma=2000):
     """Calculate synapses similarity score.
 
     Synapse similarity score is calculated by calculating for each synapse of
@@ -465,71 +459,69 @@ def _calc_synapse_similarity(cnA, cnB, sigma=2000, omega=2000,
 
     Parameters
     ----------
-    (cnA, cnB) :    CatmaidNeuron connector tables
-    sigma :         int, optional
-                    Distance in nanometer that is considered to be "close".
-    omega :         int, optional
-                    Radius in nanometer over which to calculate
-                    synapse density.
+    (treesA, treesB) :  dict
+                        Connectors of neuron A and B as returned by
+                        :func:`~pymaid.cluster._synapse_trees`.
+    sigma :             int, optional
+                        Distance in nanometer that is considered to be
+                        "close".
 
     Returns
     -------
     synapse_similarity_score
 
     """
+    total = 0
+    n_synapses = 0
+    for r, (coordsA, _, densityA) in treesA.items():
+        n_synapses += coordsA.shape[0]
 
-    all_values = []
-
-    # Get the connector types that we want to compare between neuron A and B
-    if isinstance(restrict_cn, type(None)):
-        # If no restrictions, get all cn types in neuron A
-        cn_to_check = cnA.relation.unique()
-    else:
-        # Intersect restricted connectors and actually available types
-        cn_to_check = set(cnA.relation.unique()) & set(restrict_cn)
-
-    # Iterate over all types of connectors
-    for r in cn_to_check:
-        # Skip if either neuronA or neuronB don't have this synapse type
-        if cnB[cnB.relation == r].empty:
-            all_values += [0] * cnA[cnA.relation == r].shape[0]
+        # Synapses without same-type counterpart in neuron B score 0
+        if r not in treesB:
             continue
 
-        # Get inter-neuron matrix
-        dist_mat = scipy.spatial.distance.cdist(cnA[cnA.relation == r][['x', 'y', 'z']],
-                                                cnB[cnB.relation == r][['x', 'y', 'z']])
+        _, treeB, densityB = treesB[r]
+
+        # Get distance to and index of closest synapse in neuron B
+        closest_dist, closest_ix = treeB.query(coordsA)
+        closeB = densityB[closest_ix]
+
+        total += (np.exp(-np.fabs(densityA - closeB) / (densityA + closeB))
+                  * np.exp(-closest_dist**2 / (2 * sigma**2))).sum()
 
-        # Get index of closest synapse in neuron B
-        closest_ix = np.argmin(dist_mat, axis=1)
+    if not n_synapses:
+        return 0
 
-        # Get closest distances
-        closest_dist = dist_mat.min(axis=1)
+    return total / n_synapses
 
-        # Get intra-neuron matrices for synapse density checking
-        distA = scipy.spatial.distance.pdist(
-            cnA[cnA.relation == r][['x', 'y', 'z']])
-        distA = scipy.spatial.distance.squareform(distA)
-        distB = scipy.spatial.distance.pdist(
-            cnB[cnB.relation == r][['x', 'y', 'z']])
-        distB = scipy.spatial.distance.squareform(distB)
 
-        # Calculate number of synapses closer than OMEGA. This does count itself!
-        closeA = (distA <= omega).sum(axis=1)
-        closeB = (distB <= omega).sum(axis=1)
+def _synapse_similarity_helper(args):
+    """Calculate synapse similarity of a batch of neurons to all neurons.
+
+    Parameters
+    ----------
+    args :      tuple
+                ``(rows, trees, sigma)``. ``rows`` are indices into ``trees``
+                (see :func:`~pymaid.cluster._synapse_trees`). Packed into a
+                single argument so that it can be used with
+                ``multiprocessing.Pool.imap``.
 
-        # Now calculate the scores over all synapses
-        for a in range(distA.shape[0]):
-            this_synapse_value = math.exp(-1 * math.fabs(closeA[a] - closeB[closest_ix[a]]) / (
-                closeA[a] + closeB[closest_ix[a]])) * math.exp(-1 * (closest_dist[a]**2) / (2 * sigma**2))
-            all_values.append(this_synapse_value)
+    Returns
+    -------
+    numpy.ndarray
+                (len(rows), len(trees)) matrix of similarity scores.
 
-    score = sum(all_values) / len(all_values)
+    """
+    rows, trees, sigma = args
 
-    return score
+    return np.array([[_synapse_similarity(trees[a], b, sigma=sigma)
+                      for b in trees] for a in rows]).reshape(len(rows),
+                                                              len(trees))
 
 
 def cluster_by_synapse_placement(x, sigma=2000, omega=2000, mu_score=True,
-                                 restrict_cn=None, remote_instance=None):
+                                 restrict_cn=None, parallel=None,
+                                 n_cores=None, remote_instance=None):
     """Cluster neurons based on their synapse placement.
 
     Distances score is calculated by calculating for each synapse of
@@ -583,6 +575,11 @@ def cluster_by_synapse_placement(x, sigma=2000, omega=2000, mu_score=True,
                         If None, will use all connectors. Use either single
                         integer or list. E.g. ``restrict_cn=[0, 1]`` to use
                         only pre- and postsynapses.
+    parallel :          bool, optional
+                        If True, will distribute neurons across ``n_cores``
+                        worker processes. Defaults to ``x._use_parallel``.
+    n_cores :           int, optional
+                        Number of worker processes. Defaults to ``x.n_cores``.
     remote_instance :   CatmaidInstance, optional
                         If not passed, will try using globally defined.
                         Need to provide if neurons are only skids or
@@ -605,26 +602,38 @@ def cluster_by_synapse_placement(x, sigma=2000, omega=2000, mu_score=True,
     if not isinstance(restrict_cn, (type(None), list, set, np.ndarray)):
         restrict_cn = [restrict_cn]
 
-    sim_matrix = pd.DataFrame(np.zeros((len(neurons), len(neurons))),
+    if isinstance(parallel, type(None)):
+        parallel = neurons._use_parallel
+    if isinstance(n_cores, type(None)):
+        n_cores = neurons.n_cores
+
+    # KD-trees and synapse densities only need to be calculated once per
+    # neuron - not once per pair
+    trees = [_synapse_trees(n.connectors, omega, restrict_cn=restrict_cn)
+             for n in config.tqdm(neurons, desc='Prep. synapses',
+                                  disable=config.pbar_hide,
+                                  leave=config.pbar_leave)]
+
+    if parallel and n_cores > 1 and len(trees) > 1:
+        chunks = np.array_split(np.arange(len(trees)),
+                                min(len(trees), n_cores * 4))
+        with mp.Pool(n_cores) as pool:
+            scores = list(config.tqdm(pool.imap(_synapse_similarity_helper,
+                                                [(c, trees, sigma) for c in chunks]),
+                                      total=len(chunks),
+                                      desc='Processing',
+                                      disable=config.pbar_hide,
+                                      leave=config.pbar_leave))
+    else:
+        scores = [_synapse_similarity_helper(([i], trees, sigma))
+                  for i in config.tqdm(range(len(trees)), desc='Processing',
+                                       disable=config.pbar_hide,
+                                       leave=config.pbar_leave)]
+
+    sim_matrix = pd.DataFrame(np.vstack(scores),
                               index=neurons.skeleton_id,
                               columns=neurons.skeleton_id)
 
-    combinations = [(nA.connectors, nB.connectors, sigma, omega, restrict_cn)
-                    for nA in neurons for nB in neurons]
-    comb_skids = [(nA.skeleton_id, nB.skeleton_id)
-                  for nA in neurons for nB in neurons]
-
-    with ThreadPoolExecutor(max_workers=max(1, os.cpu_count())) as e:
-        futures = e.map(_unpack_synapse_helper, combinations)
-
-        scores = [n for n in config.tqdm(futures, total=len(combinations),
-                                         desc='Processing',
-                                         disable=config.pbar_hide,
-                                         leave=config.pbar_leave)]
-
-    for i, v in enumerate(combinations):
-        sim_matrix.loc[comb_skids[i][0], comb_skids[i][1]] = scores[i]
-
     if mu_score:
         sim_matrix = (sim_matrix + sim_matrix.T) / 2
 
@@ -693,6 +702,13 @@ class ClustResults:
                 to generate linkage. By default, WARD's algorithm is used.
     leafs :     list of skids
 
+    Only the matrix passed at initialization is kept in memory. The other
+    matrix type is generated on first access. Clustering works off a
+    condensed distance matrix that is assembled block by block straight from
+    the input matrix - so you can pass e.g. a float32/float16
+    ``numpy.memmap`` or a condensed matrix for very large data sets and never
+    access ``dist_mat``/``sim_mat`` at all.
+
     Examples
     --------
     >>> import matplotlib.pyplot as plt
@@ -714,8 +730,11 @@ class ClustResults:
 
         Parameters
         ----------
-        mat :       numpy.array | pandas.DataFrame
-                    Distance or similarity matrix.
+        mat :       numpy.array | numpy.memmap | pandas.DataFrame | str
+                    Distance or similarity matrix. Either square or in
+                    condensed form (see ``scipy.spatial.distance.squareform``).
+                    Strings are interpreted as filename of a ``.npy`` file
+                    which will be memory-mapped. The matrix is not copied.
         labels :    list, optional
                     Labels for matrix.
         mat_type :  'distance' | 'similarity', default = 'distance'
@@ -723,19 +742,33 @@ class ClustResults:
                       - 'similarity' = high values are more similar
                       - 'distance' = low values are more similar
 
-                    The "missing" matrix type will be computed. For clustering,
-                    plotting, etc. distance matrices are used.
+                    The "missing" matrix type will be computed when first
+                    accessed. For clustering, plotting, etc. distance
+                    matrices are used. Similarities are inverted by
+                    subtracting them from the max similarity. Note that
+                    condensed matrices have no diagonal (self-similarity).
 
         """
         if mat_type not in ClustResults._PERM_MAT_TYPES:
             raise ValueError('Matrix type "{0}" unkown.'.format(mat_type))
 
-        if mat_type == 'similarity':
-            self.dist_mat = self._invert_mat(mat)
-            self.sim_mat = mat
+        if isinstance(mat, str):
+            mat = np.load(mat, mmap_mode='r')
+
+        self._mat = mat
+        self._is_condensed = mat.ndim == 1
+
+        if self._is_condensed:
+            # Number of observations from length of condensed matrix
+            self._n_obs = int(np.ceil(np.sqrt(mat.shape[0] * 2)))
+            if self._n_obs * (self._n_obs - 1) // 2 != mat.shape[0]:
+                raise ValueError('Condensed matrix has wrong size.')
         else:
-            self.dist_mat = mat
-            self.sim_mat = self._invert_mat(mat)
+            self._n_obs = mat.shape[0]
+            if mat_type == 'similarity':
+                self.sim_mat = mat
+            else:
+                self.dist_mat = mat
 
         self.labels = labels
         self.mat_type = mat_type
@@ -744,12 +777,28 @@ class ClustResults:
             self.labels = mat.columns.tolist()
 
     def __getattr__(self, key):
-        if key == 'linkage':
+        if key.startswith('_'):
+            raise AttributeError(key)
+        elif key == 'linkage':
             self.cluster()
             return self.linkage
+        elif key in ['dist_mat', 'sim_mat']:
+            if self._is_condensed:
+                mat = scipy.spatial.distance.squareform(self._mat,
+                                                        checks=False)
+                if self.mat_type == 'similarity':
+                    # Self-similarity is assumed to be the max similarity
+                    np.fill_diagonal(mat, self._mat_max())
+            else:
+                mat = self._mat
+
+            if (key == 'sim_mat') != (self.mat_type == 'similarity'):
+                mat = self._invert_mat(mat)
+
+            self.__dict__[key] = mat
+            return mat
         elif key == 'condensed_dist_mat':
-            return scipy.spatial.distance.squareform(self.dist_mat,
-                                                     checks=False)
+            return self.get_condensed_dist_mat()
         elif key in ['leafs', 'leaves']:
             return self.get_leafs()
         elif key == 'cophenet':
@@ -761,7 +810,7 @@ class ClustResults:
         return self.__repr__()
 
     def __repr__(self):
-        return 'ClustResults of {} items at {}'.format(self.sim_mat.shape[0],
+        return 'ClustResults of {} items at {}'.format(self._n_obs,
                                                        hex(id(self)))
 
     def get_leafs(self, use_labels=False):
@@ -775,11 +824,11 @@ class ClustResults:
                         or indices (if matrix is np.ndarray)
 
         """
-        if isinstance(self.dist_mat, pd.DataFrame):
+        if isinstance(self._mat, pd.DataFrame):
             if use_labels:
                 return [self.labels[i] for i in scipy.cluster.hierarchy.leaves_list(self.linkage)]
             else:
-                return [self.dist_mat.columns.tolist()[i] for i in scipy.cluster.hierarchy.leaves_list(self.linkage)]
+                return [self._mat.columns.tolist()[i] for i in scipy.cluster.hierarchy.leaves_list(self.linkage)]
         else:
             return scipy.cluster.hierarchy.leaves_list(self.linkage)
 
@@ -823,12 +872,72 @@ class ClustResults:
 
         return coeff
 
+    def _mat_max(self):
+        """Max value of input matrix."""
+        if '_max' not in self.__dict__:
+            if isinstance(self._mat, pd.DataFrame):
+                self._max = self._mat.max().max()
+            else:
+                self._max = self._mat.max()
+        return self._max
+
     def _invert_mat(self, sim_mat):
         """ Inverts matrix."""
-        if isinstance(sim_mat, pd.DataFrame):
-            return (sim_mat - sim_mat.max().max()) * -1
-        else:
-            return (sim_mat - sim_mat.max()) * -1
+        return (sim_mat - self._mat_max()) * -1
+
+    def get_condensed_dist_mat(self, dtype=np.float64, block_size=1000):
+        """Generate condensed distance matrix.
+
+        The condensed matrix is filled block by block from the input matrix.
+        Neither a square distance matrix nor full copies of the input matrix
+        are generated.
+
+        Parameters
+        ----------
+        dtype :         numpy dtype, optional
+                        Data type of the condensed matrix. Note that
+                        ``scipy.cluster.hierarchy.linkage`` works on float64.
+        block_size :    int, optional
+                        Number of rows (or values if input matrix is already
+                        condensed) to process at a time.
+
+        Returns
+        -------
+        numpy.ndarray
+                        Condensed distance matrix.
+
+        """
+        mat = self._mat
+        if isinstance(mat, pd.DataFrame):
+            mat = mat.values
+
+        invert = self.mat_type == 'similarity'
+        if invert:
+            mx = self._mat_max()
+
+        if self._is_condensed:
+            if not invert:
+                return np.asarray(mat, dtype=dtype)
+            condensed = np.empty(mat.shape[0], dtype=dtype)
+            for i in range(0, mat.shape[0], block_size):
+                condensed[i: i + block_size] = mx - np.asarray(mat[i: i + block_size],
+                                                               dtype=dtype)
+            return condensed
+
+        n = self._n_obs
+        condensed = np.empty(n * (n - 1) // 2, dtype=dtype)
+        for i in range(0, n, block_size):
+            block = np.asarray(mat[i: i + block_size], dtype=dtype)
+            for k, row in enumerate(block):
+                j = i + k
+                # Offset of row j in condensed matrix
+                offset = j * n - j * (j + 1) // 2
+                if invert:
+                    condensed[offset: offset + n - j - 1] = mx - row[j + 1:]
+                else:
+                    condensed[offset: offset + n - j - 1] = row[j + 1:]
+
+        return condensed
 
     def cluster(self, method='ward'):
         """Cluster distance matrix.
@@ -1095,7 +1204,12 @@ class ClustResults:
         """
         cl = self.get_clusters(k, criterion, return_type='indices')
 
-        cl = [[self.dist_mat.index.tolist()[i] for i in l] for l in cl]
+        if isinstance(self._mat, pd.DataFrame):
+            index = self._mat.index.tolist()
+        else:
+            index = list(range(self._n_obs))
+
+        cl = [[index[i] for i in l] for l in cl]
 
         colors = [colorsys.hsv_to_rgb(1 / len(cl) * i, 1, 1)
                   for i in range(len(cl) + 1)]
@@ -1132,9 +1246,9 @@ class ClustResults:
         if self.labels and return_type.lower() == 'labels':
             return [[self.labels[j] for j in range(len(cl)) if cl[j] == i] for i in range(min(cl), max(cl) + 1)]
         elif return_type.lower() == 'rows':
-            return [[self.dist_mat.columns.tolist()[j] for j in range(len(cl)) if cl[j] == i] for i in range(min(cl), max(cl) + 1)]
+            return [[self._mat.columns.tolist()[j] for j in range(len(cl)) if cl[j] == i] for i in range(min(cl), max(cl) + 1)]
         elif return_type.lower() == 'columns':
-            return [[self.dist_mat.index.tolist()[j] for j in range(len(cl)) if cl[j] == i] for i in range(min(cl), max(cl) + 1)]
+            return [[self._mat.index.tolist()[j] for j in range(len(cl)) if cl[j] == i] for i in range(min(cl), max(cl) + 1)]
         else:
             return [[j for j in range(len(cl)) if cl[j] == i] for i in range(min(cl), max(cl) + 1)]
 
@@ -1158,7 +1272,7 @@ class ClustResults:
                 'Please install ete3 package to use this function.')
 
         max_dist = self.linkage[-1][2]
-        n_original_obs = self.dist_mat.shape[0]
+        n_original_obs = self._n_obs
 
         list_of_childs = {n_original_obs + i: e[:2]
                           for i, e in enumerate(self.linkage)}
@@ -1173,7 +1287,7 @@ class ClustResults:
         dist_to_parent = {
             n: max_dist - total_dist[list_of_parents[n]] for n in list_of_parents}
 
-        names = {i: n for i, n in enumerate(self.dist_mat.columns.tolist())}
+        names = {i: n for i, n in enumerate(self._mat.columns.tolist())}
 
         # Create empty tree
         tree = ete3.Tree()
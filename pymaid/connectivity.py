@@ -18,10 +18,11 @@
 """ This module contains functions to analyse connectivity.
 """
 
-from itertools import combinations
+import multiprocessing as mp
 
 import pandas as pd
 import numpy as np
+import scipy.sparse
 import scipy.spatial
 import scipy.stats
 
@@ -33,7 +34,8 @@ logger = config.logger
 __all__ = sorted(['filter_connectivity', 'cable_overlap',
                   'predict_connectivity', 'adjacency_matrix', 'group_matrix',
                   'adjacency_from_connectors', 'cn_table_from_connectors',
-                  'connection_density', 'sparseness', 'shared_partners'])
+                  'connection_density', 'connection_density_matrix',
+                  'sparseness', 'shared_partners'])
 
 
 def filter_connectivity(x, restrict_to, remote_instance=None):
@@ -56,6 +58,7 @@ def filter_connectivity(x, restrict_to, remote_instance=None):
                         Currently accepts either:
                          (1) Connectivity table from :func:`~pymaid.get_partners`
                          (2) Adjacency matrix from :func:`~pymaid.adjacency_matrix`
+                         (3) :class:`~pymaid.SparseConnectome`
     restrict_to :       str | pymaid.Volume | CatmaidNeuronList
                         Volume or neurons to restrict connectivity to. Strings
                         will be interpreted as volumes.
@@ -65,6 +68,7 @@ def filter_connectivity(x, restrict_to, remote_instance=None):
     Returns
     -------
     Restricted connectivity data
+                        Same type as input.
 
     See Also
     --------
@@ -82,9 +86,9 @@ def filter_connectivity(x, restrict_to, remote_instance=None):
         restrict_to = fetch.get_volume(
             restrict_to, remote_instance=remote_instance)
 
-    if not isinstance(x, pd.DataFrame):
-        raise TypeError('Input must be pandas DataFrame, got '
-                        ' "{}"'.format(type(x)))
+    if not isinstance(x, (pd.DataFrame, core.SparseConnectome)):
+        raise TypeError('Input must be pandas DataFrame or SparseConnectome, '
+                        'got "{}"'.format(type(x)))
 
     datatype = getattr(x, 'datatype', None)
 
@@ -153,8 +157,13 @@ def filter_connectivity(x, restrict_to, remote_instance=None):
             raise TypeError('Adjacency matrix appears to be grouped. Unable '
                             'to process that.')
 
-        cn_data = fetch.get_connectors_between(x.index.values,
-                                               x.columns.values,
+        if isinstance(x, core.SparseConnectome):
+            row_skids, col_skids = x.sources, x.targets
+        else:
+            row_skids, col_skids = x.index.values, x.columns.values
+
+        cn_data = fetch.get_connectors_between(row_skids,
+                                               col_skids,
                                                directional=True,
                                                remote_instance=remote_instance)
 
@@ -174,60 +183,68 @@ def filter_connectivity(x, restrict_to, remote_instance=None):
         # return
 
     # Reconstruct connectivity data:
-    # Collect edges
-    edges = cn_data[['source_neuron', 'target_neuron']].values
-
-    if edges.shape[0] > 0:
-        # Turn individual edges into synaptic connections
-        unique_edges, counts = np.unique(edges, return_counts=True, axis=0)
-        unique_skids = np.unique(edges).astype(str)
-        unique_edges = unique_edges.astype(str)
-    else:
-        unique_edges = []
-        counts = []
-        unique_skids = []
-
-    # Create empty adj_mat
-    adj_mat = pd.DataFrame(np.zeros((len(unique_skids), len(unique_skids))),
-                           columns=unique_skids, index=unique_skids)
-
-    # Fill in values
-    for i, e in enumerate(config.tqdm(unique_edges,
-                                      disable=config.pbar_hide,
-                                      desc='Regenerating',
-                                      leave=config.pbar_leave)):
-        # using df.at here speeds things up tremendously!
-        adj_mat.at[str(e[0]), str(e[1])] = counts[i]
+    # Collect edges and turn skeleton IDs into integer codes
+    edges = cn_data[['source_neuron', 'target_neuron']].values.astype(np.int64)
+    edges = edges.reshape(-1, 2)
+    unique_skids, codes = np.unique(edges, return_inverse=True)
+    codes = codes.reshape(-1, 2)
+    unique_skids = unique_skids.astype(str)
 
     if datatype == 'adjacency_matrix':
-        return adj_mat.reindex(index=x.index.astype(str),
-                               columns=x.columns.astype(str)).fillna(0)
-
-    # Generate connectivity table by subsetting adjacency matrix to our
-    # neurons of interest
-    us_neurons = [n for n in neurons if n in adj_mat.columns]
-    all_upstream = adj_mat[adj_mat[us_neurons].sum(axis=1) > 0][us_neurons]
-    all_upstream['skeleton_id'] = all_upstream.index
-    all_upstream['relation'] = 'upstream'
-
-    ds_neurons = [n for n in neurons if n in adj_mat.T.columns]
-    all_downstream = adj_mat.T[adj_mat.T[ds_neurons].sum(
-        axis=1) > 0][ds_neurons]
-    all_downstream['skeleton_id'] = all_downstream.index
-    all_downstream['relation'] = 'downstream'
-
-    # Merge tables
-    df = pd.concat([all_upstream, all_downstream], axis=0, ignore_index=True)
-    remaining_neurons = [n for n in neurons if n in df.columns]
+        # Individual edges are summed up to synaptic connections
+        adj = scipy.sparse.coo_matrix((np.ones(codes.shape[0]),
+                                       (codes[:, 0], codes[:, 1])),
+                                      shape=(unique_skids.shape[0],
+                                             unique_skids.shape[0]))
+        adj = core.SparseConnectome(adj, unique_skids, unique_skids)
+        adj = adj.subset(sources=np.asarray(row_skids).astype(str),
+                         targets=np.asarray(col_skids).astype(str),
+                         fill_missing=True)
+        if isinstance(x, core.SparseConnectome):
+            return adj
+        adj_mat = adj.to_dataframe()
+        adj_mat.index.name = x.index.name
+        adj_mat.columns.name = x.columns.name
+        return adj_mat
+
+    # Generate connectivity table: query neurons are columns, partners
+    # (separately for up- and downstream) are rows
+    neurons = np.array(neurons, dtype=str)
+    query = pd.Index(unique_skids).get_indexer(neurons)
+    remaining_neurons = neurons[query >= 0].tolist()
+    col_code = np.full(unique_skids.shape[0], -1)
+    col_code[query[query >= 0]] = np.arange(len(remaining_neurons))
+
+    # Upstream: partner = source, query neuron = target
+    # Downstream: partner = target, query neuron = source
+    is_us = col_code[codes[:, 1]] >= 0
+    is_ds = col_code[codes[:, 0]] >= 0
+    partner = np.append(codes[is_us, 0], codes[is_ds, 1])
+    col = np.append(col_code[codes[is_us, 1]], col_code[codes[is_ds, 0]])
+    relation = np.append(np.zeros(is_us.sum(), dtype=int),
+                         np.ones(is_ds.sum(), dtype=int))
+
+    # Rows are unique (relation, partner) combinations
+    row_key = relation * unique_skids.shape[0] + partner
+    row_key, row = np.unique(row_key, return_inverse=True)
+    table = scipy.sparse.coo_matrix((np.ones(row.shape[0]), (row, col)),
+                                    shape=(row_key.shape[0],
+                                           len(remaining_neurons))).toarray()
+
+    df = pd.DataFrame(table, columns=remaining_neurons)
+    df['skeleton_id'] = unique_skids[row_key % unique_skids.shape[0]]
+    df['relation'] = np.array(['upstream', 'downstream'])[row_key // unique_skids.shape[0]]
 
     # Remove neurons that were not in the original data - under certain
     # circumstances, neurons can sneak back in
-    df = df[df.skeleton_id.isin(x.skeleton_id)]
+    df = df[df.skeleton_id.isin(x.skeleton_id.astype(str))]
 
     # Use original connectivity table to populate data
-    aux = x.set_index('skeleton_id')[['neuron_name', 'num_nodes']].to_dict()
-    df['num_nodes'] = [aux['num_nodes'][s] for s in df.skeleton_id.values]
-    df['neuron_name'] = [aux['neuron_name'][s] for s in df.skeleton_id.values]
+    aux = x.drop_duplicates('skeleton_id', keep='last')
+    aux = aux.set_index(aux.skeleton_id.astype(str))
+    aux = aux.reindex(df.skeleton_id.values)
+    df['num_nodes'] = aux.num_nodes.values
+    df['neuron_name'] = aux.neuron_name.values
     df['total'] = df[remaining_neurons].sum(axis=1)
 
     # Reorder columns
@@ -241,10 +258,12 @@ def filter_connectivity(x, restrict_to, remote_instance=None):
     return df
 
 
-def cable_overlap(a, b, dist=2, method='min'):
+def cable_overlap(a, b, dist=2, method='min', sparse=False, parallel=None,
+                  n_cores=None):
     """Calculate the amount of cable of neuron A within distance of neuron B.
 
-    Uses dotproduct representation of a neuron!
+    Uses dotproduct representation of a neuron! Pairs of neurons whose
+    bounding boxes are further apart than ``dist`` are skipped.
 
     Parameters
     ----------
@@ -259,10 +278,19 @@ def cable_overlap(a, b, dist=2, method='min'):
                     1. 'min' returns 150
                     2. 'max' returns 300
                     3. 'avg' returns 225
+    sparse :    bool, optional
+                If True, will return a :class:`~pymaid.SparseConnectome`
+                instead of a dense DataFrame. Use this if most pairs of
+                neurons don't overlap.
+    parallel :  bool, optional
+                If True, will distribute neurons across ``n_cores`` worker
+                processes. Defaults to ``a._use_parallel``.
+    n_cores :   int, optional
+                Number of worker processes. Defaults to ``a.n_cores``.
 
     Returns
     -------
-    pandas.DataFrame
+    pandas.DataFrame | SparseConnectome
             Matrix in which neurons A are rows, neurons B are columns. Cable
             within distance is given in microns::
 
@@ -290,68 +318,166 @@ def cable_overlap(a, b, dist=2, method='min'):
         raise ValueError('Unknown method "{0}". Allowed methods: "{0}"'.format(
             method, ','.join(allowed_methods)))
 
-    matrix = pd.DataFrame(np.zeros((a.shape[0], b.shape[0])),
-                          index=a.skeleton_id, columns=b.skeleton_id)
-
-    with config.tqdm(total=len(a), desc='Calc. overlap',
-                     disable=config.pbar_hide,
-                     leave=config.pbar_leave) as pbar:
-        # Keep track of KDtrees
-        trees = {}
-        for nA in a:
-            # Get cKDTree for nA
-            tA = trees.get(nA.skeleton_id, None)
-            if not tA:
-                trees[nA.skeleton_id] = tA = scipy.spatial.cKDTree(
-                    np.vstack(nA.dps.point), leafsize=10)
-
-            for nB in b:
-                # Get cKDTree for nB
-                tB = trees.get(nB.skeleton_id, None)
-                if not tB:
-                    trees[nB.skeleton_id] = tB = scipy.spatial.cKDTree(
-                        np.vstack(nB.dps.point), leafsize=10)
-
-                # Query nB -> nA
-                distA, ixA = tA.query(np.vstack(nB.dps.point),
-                                      k=1,
-                                      distance_upper_bound=dist,
-                                      n_jobs=-1
-                                      )
-                # Query nA -> nB
-                distB, ixB = tB.query(np.vstack(nA.dps.point),
-                                      k=1,
-                                      distance_upper_bound=dist,
-                                      n_jobs=-1
-                                      )
-
-                nA_in_dist = nA.dps.loc[ixA[distA != float('inf')]]
-                nB_in_dist = nB.dps.loc[ixB[distB != float('inf')]]
-
-                if nA_in_dist.empty:
-                    overlap = 0
-                elif method == 'avg':
-                    overlap = (nA_in_dist.vec_length.sum() +
-                               nB_in_dist.vec_length.sum()) / 2
-                elif method == 'max':
-                    overlap = max(nA_in_dist.vec_length.sum(),
-                                  nB_in_dist.vec_length.sum())
-                elif method == 'min':
-                    overlap = min(nA_in_dist.vec_length.sum(),
-                                  nB_in_dist.vec_length.sum())
-
-                matrix.at[nA.skeleton_id, nB.skeleton_id] = overlap
-
-            pbar.update(1)
+    if isinstance(parallel, type(None)):
+        parallel = a._use_parallel
+    if isinstance(n_cores, type(None)):
+        n_cores = a.n_cores
+
+    # Precompute dotprops once
+    dps_a = [(n.dps.points, n.dps.vec_length) for n in a]
+    dps_b = [(n.dps.points, n.dps.vec_length) for n in b]
+
+    # Only pairs with overlapping bounding boxes can have overlapping cable
+    ia, ib = _bbox_pairs([p for p, v in dps_a], [p for p, v in dps_b], dist)
+
+    # Cable of A close to B: query each A's tree with points of its B
+    # candidates and vice versa
+    jobs = [(dps_a[i], ib[ix], ix) for i, ix in _group_indices(ia)]
+    jobs_b = [(dps_b[j], ia[ix], ix) for j, ix in _group_indices(ib)]
+
+    in_dist_a = _run_overlap_jobs(jobs, [p for p, v in dps_b], dist,
+                                  ia.shape[0], parallel, n_cores)
+    in_dist_b = _run_overlap_jobs(jobs_b, [p for p, v in dps_a], dist,
+                                  ia.shape[0], parallel, n_cores)
+
+    if method == 'avg':
+        overlap = (in_dist_a + in_dist_b) / 2
+    elif method == 'max':
+        overlap = np.maximum(in_dist_a, in_dist_b)
+    elif method == 'min':
+        overlap = np.minimum(in_dist_a, in_dist_b)
 
     # Convert to um
-    matrix /= 1000
+    overlap = overlap / 1000
+
+    keep = overlap > 0
+    matrix = scipy.sparse.coo_matrix((overlap[keep], (ia[keep], ib[keep])),
+                                     shape=(len(a), len(b)))
 
-    return matrix
+    if sparse:
+        return core.SparseConnectome(matrix,
+                                     sources=a.skeleton_id,
+                                     targets=b.skeleton_id)
+
+    return pd.DataFrame(matrix.toarray(),
+                        index=a.skeleton_id, columns=b.skeleton_id)
+
+
+def _bbox_pairs(pts_a, pts_b, dist, chunk_size=1000):
+    """Find pairs of point clouds whose bounding boxes are within distance.
+
+    Returns
+    -------
+    ia, ib :    numpy.ndarray
+                Indices into ``pts_a`` and ``pts_b``.
+
+    """
+    def _bbox(pts):
+        bbox = np.full((len(pts), 2, 3), np.nan)
+        for i, p in enumerate(pts):
+            if p.shape[0]:
+                bbox[i] = [p.min(axis=0), p.max(axis=0)]
+        return bbox
+
+    bbox_a = _bbox(pts_a)
+    bbox_b = _bbox(pts_b)
+
+    ia, ib = [], []
+    for i in range(0, bbox_a.shape[0], chunk_size):
+        this = bbox_a[i: i + chunk_size]
+        # NaNs (neurons without points) compare False
+        close = np.all((this[:, None, 0] - dist <= bbox_b[None, :, 1])
+                       & (this[:, None, 1] + dist >= bbox_b[None, :, 0]),
+                       axis=2)
+        r, c = np.nonzero(close)
+        ia.append(r + i)
+        ib.append(c)
+
+    if not ia:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    return np.concatenate(ia), np.concatenate(ib)
+
+
+def _group_indices(x):
+    """Yield (value, indices) for each unique value in x."""
+    order = np.argsort(x, kind='stable')
+    uniq, start = np.unique(x[order], return_index=True)
+    return zip(uniq, np.split(order, start[1:]))
+
+
+def _run_overlap_jobs(jobs, others, dist, n_pairs, parallel, n_cores):
+    """Run overlap jobs (see :func:`~pymaid.cable_overlap`) and collect
+    cable within distance per pair."""
+    res = np.zeros(n_pairs)
+
+    # Pack jobs with the points of their partners
+    packed = [(pts, vl, [others[p] for p in partners])
+              for (pts, vl), partners, _ in jobs]
+
+    if parallel and n_cores > 1 and len(packed) > 1:
+        chunks = [packed[c[0]:c[-1] + 1]
+                  for c in np.array_split(np.arange(len(packed)),
+                                          min(n_cores, len(packed)))]
+        with mp.Pool(n_cores) as pool:
+            sums = list(config.tqdm(pool.imap(_overlap_helper,
+                                              [(c, dist) for c in chunks]),
+                                    total=len(chunks),
+                                    desc='Calc. overlap',
+                                    disable=config.pbar_hide,
+                                    leave=config.pbar_leave))
+        sums = [s for c in sums for s in c]
+    else:
+        sums = [_overlap_helper(([j], dist))[0]
+                for j in config.tqdm(packed, desc='Calc. overlap',
+                                     disable=config.pbar_hide,
+                                     leave=config.pbar_leave)]
+
+    for (_, _, pair_ix), s in zip(jobs, sums):
+        res[pair_ix] = s
+
+    return res
+
+
+def _overlap_helper(args):
+    """Calculate cable within distance for a batch of neurons.
+
+    Parameters
+    ----------
+    args :      tuple
+                ``(jobs, dist)``. Each job is ``(points, vec_length,
+                partner_points)``. Packed into a single argument so that
+                it can be used with ``multiprocessing.Pool.imap``.
+
+    Returns
+    -------
+    list of numpy.ndarray
+                For each job: sum of ``vec_length`` of this neuron's
+                nearest points to each partner's points within distance.
+
+    """
+    jobs, dist = args
+
+    res = []
+    for pts, vl, partners in jobs:
+        tree = scipy.spatial.cKDTree(pts)
+
+        # Query points of all partners at once
+        owner = np.repeat(np.arange(len(partners)),
+                          [p.shape[0] for p in partners])
+        d, ix = tree.query(np.vstack(partners), k=1,
+                           distance_upper_bound=dist)
+        is_close = d != float('inf')
+
+        res.append(np.bincount(owner[is_close],
+                               weights=vl[ix[is_close]],
+                               minlength=len(partners)))
+
+    return res
 
 
 def predict_connectivity(source, target, method='possible_contacts',
-                         remote_instance=None, **kwargs):
+                         sparse=False, remote_instance=None, **kwargs):
     """Calculate potential synapses from source onto target neurons.
 
     Based on a concept by `Alexander Bates <https://github.com/alexanderbates/catnat>`_.
@@ -363,6 +489,9 @@ def predict_connectivity(source, target, method='possible_contacts',
                     This is unidirectional: source -> target.
     method :        'possible_contacts'
                     Method to use for calculations. See Notes.
+    sparse :        bool, optional
+                    If True, will return a :class:`~pymaid.SparseConnectome`
+                    instead of a dense DataFrame.
     **kwargs
                     1. For method 'possible_contacts':
                         - ``dist`` to set distance between connectors and
@@ -382,10 +511,13 @@ def predict_connectivity(source, target, method='possible_contacts',
     Neurons without cable or presynapses will be assigned a predicted
     connectivity of 0.
 
+    Treenodes of all target neurons are combined into a single KD-tree which
+    is then queried with the presynapses of all source neurons at once.
+
 
     Returns
     -------
-    pandas.DataFrame
+    pandas.DataFrame | SparseConnectome
             Matrix holding possible synaptic contacts. Sources are rows,
             targets are columns::
 
@@ -420,10 +552,6 @@ def predict_connectivity(source, target, method='possible_contacts',
         raise ValueError('Unknown method "{0}". Allowed methods: "{0}"'.format(
             method, ','.join(allowed_methods)))
 
-    matrix = pd.DataFrame(np.zeros((source.shape[0], target.shape[0])),
-                          index=source.skeleton_id,
-                          columns=target.skeleton_id)
-
     if kwargs.get('dist', None):
         dist_threshold = kwargs.get('dist')
     else:
@@ -452,39 +580,59 @@ def predict_connectivity(source, target, method='possible_contacts',
         # distances can massively skew the average
         dist_threshold = scipy.stats.hmean(distances) + n_irq * scipy.stats.iqr(distances)
 
-    with config.tqdm(total=len(target), desc='Predicting',
-                     disable=config.pbar_hide,
-                     leave=config.pbar_leave) as pbar:
-        for t in target:
-            # If no nodes, predict 0 connectivity and skip
-            if t.nodes.empty:
-                matrix.loc[t.skeleton_id, source.skeleton_id] = 0
+    # Combine treenodes of all targets into a single tree
+    tn_locs = [t.nodes[['x', 'y', 'z']].values for t in target]
+    tn_owner = np.repeat(np.arange(len(target)), [len(l) for l in tn_locs])
+    tn_locs = np.vstack(tn_locs) if tn_locs else np.zeros((0, 3))
+
+    # Combine presynapses of all sources
+    pre_locs = [s.presynapses[['x', 'y', 'z']].values for s in source]
+    pre_owner = np.repeat(np.arange(len(source)), [len(l) for l in pre_locs])
+    pre_locs = np.vstack(pre_locs) if pre_locs else np.zeros((0, 3))
+
+    rows, cols = [], []
+    if tn_locs.shape[0] and pre_locs.shape[0]:
+        tree = scipy.spatial.cKDTree(tn_locs, leafsize=10)
+
+        n_targets = len(target)
+        chunk_size = 10000
+        for i in config.trange(0, pre_locs.shape[0], chunk_size,
+                               desc='Predicting',
+                               disable=config.pbar_hide,
+                               leave=config.pbar_leave):
+            # Get all treenodes within distance of each presynapse. Distances
+            # must be strictly smaller than the threshold
+            hits = tree.query_ball_point(pre_locs[i: i + chunk_size],
+                                         r=np.nextafter(dist_threshold, 0))
+            n_hits = np.array([len(h) for h in hits], dtype=int)
+            if not n_hits.sum():
                 continue
 
-            # Create cKDTree for target
-            tree = scipy.spatial.cKDTree(
-                t.nodes[['x', 'y', 'z']].values, leafsize=10)
-            for s in source:
-                # If not synapses, predict 0 connectivity and skip
-                if s.presynapses.empty:
-                    matrix.at[s.skeleton_id, t.skeleton_id] = 0
-                    continue
+            # Each presynapse counts once per target neuron it is close to
+            pre_ix = np.repeat(np.arange(i, i + n_hits.shape[0]), n_hits)
+            tn_ix = np.fromiter((ix for h in hits for ix in h),
+                                dtype=int, count=n_hits.sum())
+            pairs = np.unique(pre_ix * n_targets + tn_owner[tn_ix])
 
-                # Query against presynapses
-                dist, ix = tree.query(s.presynapses[['x', 'y', 'z']].values,
-                                      k=1,
-                                      distance_upper_bound=dist_threshold,
-                                      n_jobs=-1
-                                      )
+            rows.append(pre_owner[pairs // n_targets])
+            cols.append(pairs % n_targets)
 
-                # Calculate possible contacts
-                possible_contacts = sum(dist != float('inf'))
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=int)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=int)
 
-                matrix.at[s.skeleton_id, t.skeleton_id] = possible_contacts
+    # Duplicate (source, target) entries are summed up
+    matrix = scipy.sparse.coo_matrix((np.ones(rows.shape[0], dtype=int),
+                                      (rows, cols)),
+                                     shape=(len(source), len(target)))
 
-            pbar.update(1)
+    if sparse:
+        return core.SparseConnectome(matrix,
+                                     sources=source.skeleton_id,
+                                     targets=target.skeleton_id)
 
-    return matrix.astype(int)
+    return pd.DataFrame(matrix.toarray(),
+                        index=source.skeleton_id,
+                        columns=target.skeleton_id)
 
 
 def cn_table_from_connectors(x, remote_instance=None):
@@ -548,107 +696,161 @@ def cn_table_from_connectors(x, remote_instance=None):
     if isinstance(x, core.CatmaidNeuron):
         x = core.CatmaidNeuronList(x)
 
-    # Get connector details for all neurons
-    all_cn = x.connectors.connector_id.values
-    cn_details = fetch.get_connector_details(all_cn, remote_instance=remote_instance)
-
-    # Remove connectors for which there are either no pre- or no postsynaptic
-    # neurons
-    cn_details = cn_details[cn_details.postsynaptic_to.apply(len) != 0]
-    cn_details = cn_details[~cn_details.presynaptic_to.isnull()]
-
-    # We need to map treenode ID to skeleton ID in cases where there are more
-    # links (postsynaptic_to_node) than targets (postsynaptic_to)
-    multi_links = cn_details[cn_details.postsynaptic_to.apply(len) < cn_details.postsynaptic_to_node.apply(len)]
-    if not multi_links.empty:
-        tn_to_fetch = [tn for l in multi_links.postsynaptic_to_node for tn in l]
-        tn_to_skid = fetch.get_skid_from_treenode(tn_to_fetch,
-                                                  remote_instance=remote_instance)
-    else:
-        tn_to_skid = {}
-
-    # Collect all pre and postsynaptic neurons
-    all_pre = cn_details[~cn_details.presynaptic_to.isin(x.skeleton_id.astype(int))]
-    all_post = cn_details[cn_details.presynaptic_to.isin(x.skeleton_id.astype(int))]
-
-    all_partners = np.append(all_pre.presynaptic_to.values,
-                             [n for l in all_post.postsynaptic_to.values for n in l])
-
-    us_dict = {}
-    ds_dict = {}
-    # Go over over all neurons and process connectivity
-    for i, n in enumerate(config.tqdm(x, desc='Processing',
-                          disable=config.pbar_hide, leave=config.pbar_leave)):
-
-        # First prepare upstream partners:
-        # Get all treenodes
-        this_tn = set(n.nodes.treenode_id.values)
-        # Prepare upstream partners
-        this_us = all_pre[all_pre.connector_id.isin(n.connectors.connector_id.values)].copy()
-        # Get the number of all links per connector
-        this_us['n_links'] = [len(this_tn & set(r.postsynaptic_to_node))
-                                           for r in this_us.itertuples()]
-        # Group by input and store as dict. Attention: we NEED to index by
-        # neuron as skeleton IDs might not be unique!
-        us_dict[n] = this_us.groupby('presynaptic_to').n_links.sum().to_dict()
-        this_us = this_us.groupby('presynaptic_to').n_links.sum()
-
-        # Now prepare downstream partners:
-        # Get all downstream connectors
-        this_ds = all_post[all_post.presynaptic_to == int(n.skeleton_id)]
-        # Prepare dict
-        ds_dict[n] = {p: 0 for p in all_partners}
-        # Easy cases first (single link to target per connector)
-        is_single = this_ds.postsynaptic_to.apply(len) >= this_ds.postsynaptic_to_node.apply(len)
-        for r in this_ds[is_single].itertuples():
-            for s in r.postsynaptic_to:
-                ds_dict[n][s] += 1
-        # Now hard cases - will have to look up skeleton ID via treenode ID
-        for r in this_ds[~is_single].itertuples():
-            for s in r.postsynaptic_to_node:
-                ds_dict[n][tn_to_skid[s]] += 1
-
-    # Now that we have all data, let's generate the table
-    us_table = pd.DataFrame.from_dict(us_dict)
-    ds_table = pd.DataFrame.from_dict(ds_dict)
-
-    # Make sure we keep the order of the original neuronlist
-    us_table = us_table[[n for n in x]]
-    us_table.columns=[n.skeleton_id for n in us_table.columns]
-    ds_table = ds_table[[n for n in x]]
-    ds_table.columns=[n.skeleton_id for n in ds_table.columns]
-
-    ds_table['relation'] = 'downstream'
-    us_table['relation'] = 'upstream'
-
-    # Generate table
-    cn_table = pd.concat([us_table, ds_table], axis=0)
-
-    # Replace NaN with 0
-    cn_table = cn_table.fillna(0)
-
-    # Make skeleton ID a column
-    cn_table = cn_table.reset_index(drop=False)
-    cn_table.columns = ['skeleton_id'] + list(cn_table.columns[1:])
+    # Get connector details for all neurons and explode into links
+    links = _links_from_connectors(x.connectors.connector_id.unique(),
+                                   remote_instance=remote_instance)
+
+    # Map connectors to fragments
+    frag_cn = _fragment_table(x, 'connectors')
+
+    # Upstream partners: postsynaptic links on this fragment's nodes. Note
+    # that connectors with a presynaptic neuron in ``x`` are ignored here
+    us = links[~links.pre_skid.isin(x.skeleton_id.astype(int))]
+    us = us.merge(_fragment_table(x, 'nodes').drop('skeleton_id', axis=1),
+                  left_on='post_node', right_on='treenode_id')
+    us = us.merge(frag_cn, on=['connector_id', 'fragment'])
+    us = us.groupby(['pre_skid', 'fragment']).size()
+
+    # Downstream partners: all postsynaptic links on connectors for which
+    # this fragment's nodes are presynaptic
+    ds = links.merge(_fragment_table(x, 'nodes').drop('skeleton_id', axis=1),
+                     left_on='pre_node', right_on='treenode_id')
+    ds = ds.merge(frag_cn, on=['connector_id', 'fragment'])
+    ds = ds.groupby(['post_skid', 'fragment']).size()
+
+    # Pivot into tables: partners are rows, fragments are columns
+    tables = []
+    for counts, rel in zip([us, ds], ['upstream', 'downstream']):
+        counts = counts.unstack(fill_value=0).reindex(columns=range(len(x)),
+                                                      fill_value=0)
+        counts.columns = x.skeleton_id
+        counts.insert(0, 'relation', rel)
+        counts.insert(0, 'skeleton_id', counts.index.values.astype(int))
+        tables.append(counts.reset_index(drop=True))
+
+    cn_table = pd.concat(tables, axis=0, ignore_index=True)
 
     # Add names
     names = fetch.get_names(cn_table.skeleton_id.values,
                             remote_instance=remote_instance)
-    cn_table['neuron_name'] = [names[str(s)] for s in cn_table.skeleton_id.values]
-    cn_table['total'] = cn_table[x.skeleton_id].sum(axis=1)
+    cn_table.insert(0, 'neuron_name',
+                    [names[str(s)] for s in cn_table.skeleton_id.values])
+    cn_table.insert(3, 'total', cn_table.iloc[:, 3:].sum(axis=1).values)
 
-    # Drop rows with 0 synapses (e.g. if neuron is only up- but not downstream)
+    # Drop rows with 0 synapses
     cn_table = cn_table[cn_table.total > 0]
 
     # Sort by number of synapses
-    cn_table = cn_table.sort_values(['relation', 'total'], ascending=False).reset_index()
-
-    # Sort columnes
-    cn_table = cn_table[['neuron_name', 'skeleton_id', 'relation', 'total'] + list(set(x.skeleton_id))]
+    cn_table = cn_table.sort_values(['relation', 'total'], ascending=False)
+    cn_table = cn_table.reset_index(drop=True)
 
     return cn_table
 
 
+def _links_from_connectors(x, remote_instance=None):
+    """Explode connector details into flat table of synaptic links.
+
+    Parameters
+    ----------
+    x :                 list of connector IDs
+                        Connectors to fetch details for.
+    remote_instance :   CatmaidInstance, optional
+
+    Returns
+    -------
+    pandas.DataFrame
+            One row per postsynaptic link::
+
+               connector_id  pre_skid  pre_node  post_skid  post_node
+             0
+             1
+
+            ``post_node`` is -1 if a link could not be mapped to a node.
+
+    """
+    cn_details = fetch.get_connector_details(x,
+                                             remote_instance=remote_instance)
+
+    # Remove connectors for which there are either no pre- or no postsynaptic
+    # neurons
+    cn_details = cn_details[~cn_details.presynaptic_to.isnull()]
+    n_post = cn_details.postsynaptic_to.apply(len).values
+    n_nodes = cn_details.postsynaptic_to_node.apply(len).values
+    keep = n_post > 0
+    cn_details, n_post, n_nodes = cn_details[keep], n_post[keep], n_nodes[keep]
+
+    # If there are as many targets as links, they are aligned
+    aligned = n_post == n_nodes
+    # If there are more links (postsynaptic_to_node) than targets
+    # (postsynaptic_to), we need to map treenode ID to skeleton ID
+    multi = n_nodes > n_post
+    # If there are more targets than links, we can't map targets to nodes
+    orphan = n_post > n_nodes
+
+    # Order: aligned, then multi-link, then orphaned connectors
+    ix = np.concatenate([np.where(aligned)[0], np.where(multi)[0],
+                         np.where(orphan)[0]])
+    n_links = np.where(orphan, n_post, n_nodes)[ix]
+
+    def _cat(lists):
+        return np.array([e for l in lists for e in l], dtype=np.int64)
+
+    to_nodes = cn_details.postsynaptic_to_node.values
+    to_skids = cn_details.postsynaptic_to.values
+    post_node = np.concatenate([_cat(to_nodes[aligned]),
+                                _cat(to_nodes[multi]),
+                                np.full(n_post[orphan].sum(), -1, dtype=np.int64)])
+    post_skid = np.concatenate([_cat(to_skids[aligned]),
+                                np.zeros(n_nodes[multi].sum(), dtype=np.int64),
+                                _cat(to_skids[orphan])])
+    row = np.repeat(ix, n_links)
+
+    links = pd.DataFrame({'connector_id': cn_details.connector_id.values[row].astype(np.int64),
+                          'pre_skid': cn_details.presynaptic_to.values[row].astype(np.int64),
+                          'pre_node': cn_details.presynaptic_to_node.values[row].astype(np.int64),
+                          'post_skid': post_skid,
+                          'post_node': post_node},
+                         columns=['connector_id', 'pre_skid', 'pre_node',
+                                  'post_skid', 'post_node'])
+
+    # Look up skeleton IDs for links that can't be mapped directly
+    is_multi = np.repeat(multi[ix], n_links)
+    if any(is_multi):
+        tn_to_skid = fetch.get_skid_from_treenode(links.post_node.values[is_multi].tolist(),
+                                                  remote_instance=remote_instance)
+        links.loc[is_multi, 'post_skid'] = [int(tn_to_skid[tn]) for tn in links.post_node.values[is_multi]]
+
+    return links
+
+
+def _fragment_table(x, what='nodes'):
+    """Map nodes or connectors to fragments (= index in neuronlist).
+
+    Parameters
+    ----------
+    x :         CatmaidNeuronList
+    what :      "nodes" | "connectors" | "postsynapses"
+
+    Returns
+    -------
+    pandas.DataFrame
+                ``treenode_id`` or ``connector_id``, ``fragment`` and
+                ``skeleton_id`` (int). Nodes/connectors can map to multiple
+                fragments.
+
+    """
+    col = 'treenode_id' if what == 'nodes' else 'connector_id'
+    ids = [getattr(n, what)[col].values for n in x]
+    n_ids = [len(i) for i in ids]
+
+    table = pd.DataFrame({col: np.concatenate(ids).astype(np.int64) if ids else [],
+                          'fragment': np.repeat(np.arange(len(x)), n_ids),
+                          'skeleton_id': np.repeat(x.skeleton_id.astype(int), n_ids)})
+
+    # Connectors with multiple links to the same fragment show up repeatedly
+    return table.drop_duplicates()
+
+
 def adjacency_from_connectors(source, target=None, remote_instance=None):
     """Regenerate adjacency matrices from neurons' connectors.
 
@@ -719,38 +921,31 @@ def adjacency_from_connectors(source, target=None, remote_instance=None):
     if isinstance(target, core.CatmaidNeuron):
         target = core.CatmaidNeuronList(target)
 
-    # Generate empty adjacency matrix
-    adj = np.zeros((len(source), len(target)))
-
-    # Get connector details for all neurons
-    all_cn = list(set(np.append(source.connectors.connector_id.values,
-                                target.connectors.connector_id.values)))
-    cn_details = fetch.get_connector_details(all_cn,
-                                             remote_instance=remote_instance)
-
-    # Now go over all source neurons and process connections
-    for i, s in enumerate(config.tqdm(source, desc='Processing',
-                          disable=config.pbar_hide, leave=config.pbar_leave)):
-
-        # Get all connectors presynaptic for this source
-        this_cn = cn_details[(cn_details.presynaptic_to == int(s.skeleton_id)) &
-                             (cn_details.connector_id.isin(s.connectors.connector_id))
-                             ]
-
-        # Go over all target neurons
-        for k, t in enumerate(target):
-            t_tn = set(t.nodes.treenode_id.values)
-            t_post = t.postsynapses.connector_id.values
-
-            # Extract number of connections from source to this target
-            this_t = this_cn[this_cn.connector_id.isin(t_post)]
-
-            # Now figure out how many links are between this connector and
-            # the target
-            n_links = sum([len(t_tn & set(r.postsynaptic_to_node))
-                           for r in this_t.itertuples()])
-
-            adj[i][k] = n_links
+    # Get connector details for all neurons and explode into links
+    all_cn = np.append(source.connectors.connector_id.values,
+                       target.connectors.connector_id.values)
+    links = _links_from_connectors(np.unique(all_cn),
+                                   remote_instance=remote_instance)
+
+    # Map links to source fragments via nodes and connectors
+    links = links.merge(_fragment_table(source, 'nodes').drop('skeleton_id', axis=1),
+                        left_on='pre_node', right_on='treenode_id')
+    links = links.merge(_fragment_table(source, 'connectors').drop('skeleton_id', axis=1),
+                        on=['connector_id', 'fragment'])
+    links = links.drop('treenode_id', axis=1)
+
+    # Map links to target fragments via nodes and postsynapses
+    links = links.merge(_fragment_table(target, 'nodes').drop('skeleton_id', axis=1),
+                        left_on='post_node', right_on='treenode_id',
+                        suffixes=('_source', '_target'))
+    post = _fragment_table(target, 'postsynapses').drop('skeleton_id', axis=1)
+    links = links.merge(post.rename(columns={'fragment': 'fragment_target'}),
+                        on=['connector_id', 'fragment_target'])
+
+    adj = scipy.sparse.coo_matrix((np.ones(links.shape[0]),
+                                   (links.fragment_source.values,
+                                    links.fragment_target.values)),
+                                  shape=(len(source), len(target))).toarray()
 
     return pd.DataFrame(adj,
                         index=source.skeleton_id,
@@ -800,7 +995,8 @@ def _edges_from_connectors(a, b=None, remote_instance=None):
 
 def adjacency_matrix(sources, targets=None, source_grp={}, target_grp={},
                      fractions=False, syn_threshold=None, syn_cutoff=None,
-                     use_connectors=False, volume_filter=None, remote_instance=None):
+                     use_connectors=False, volume_filter=None, sparse=False,
+                     remote_instance=None):
     """Generate adjacency matrix between source and target neurons.
 
     Directional: sources = rows, targets = columns.
@@ -847,12 +1043,16 @@ def adjacency_matrix(sources, targets=None, source_grp={}, target_grp={},
                         Volume(s) to restrict connections to. Can be a
                         pymaid.Volume, the name of a CATMAID volume or a
                         list thereof.
+    sparse :            bool, optional
+                        If True, will return a :class:`~pymaid.SparseConnectome`
+                        instead of a dense DataFrame. Use this for large
+                        numbers of neurons.
     remote_instance :   CatmaidInstance, optional
                         If not passed, will try using globally defined.
 
     Returns
     -------
-    matrix :          pandas.Dataframe
+    matrix :          pandas.Dataframe | SparseConnectome
 
     See Also
     --------
@@ -984,20 +1184,22 @@ def adjacency_matrix(sources, targets=None, source_grp={}, target_grp={},
     else:
         records = data
 
-    # Parse data into adjacency matrix
-    matrix = pd.DataFrame.from_records(records).fillna(0).T
-
-    # Make sure Skids are integers
-    matrix.index = matrix.index.astype(int)
-    matrix.columns = matrix.columns.astype(int)
+    # Parse data into edge list
+    edges = [(int(s), int(t), v['count'] if isinstance(v, dict) else v)
+             for s in records for t, v in records[s].items()]
+    edges = np.array(edges, dtype=float).reshape(-1, 3)
 
-    # Filter and sort to actual sources and targets
-    matrix = matrix.reindex(index=source_skids, columns=target_skids, fill_value=0)
+    # Generate sparse matrix - this also filters and sorts to actual sources
+    # and targets
+    matrix = core.SparseConnectome.from_edges(edges[:, 0].astype(int),
+                                              edges[:, 1].astype(int),
+                                              edges[:, 2],
+                                              sources=source_skids,
+                                              targets=target_skids)
 
     # Apply cutoff and threshold
-    matrix = matrix.clip(upper=syn_cutoff)
-    if syn_threshold:
-        matrix[matrix < syn_threshold] = 0
+    matrix = matrix.threshold(syn_threshold=syn_threshold,
+                              syn_cutoff=syn_cutoff)
 
     # Convert to fractions
     if fractions:
@@ -1007,11 +1209,11 @@ def adjacency_matrix(sources, targets=None, source_grp={}, target_grp={},
                                                   remote_instance=remote_instance)
         cn_counts = cn_counts['connectivity']
 
-        div = [list(cn_counts.get(s).values())[0] for s in matrix.columns.astype(str)]
+        div = [list(cn_counts.get(s).values())[0] for s in matrix.targets.astype(str)]
 
-        matrix = matrix / div
-
-    matrix.datatype = 'adjacency_matrix'
+        # Scale columns
+        scale = scipy.sparse.diags(1 / np.array(div, dtype=float))
+        matrix.matrix = matrix.matrix.dot(scale).tocsr()
 
     if source_grp or target_grp:
         matrix = group_matrix(matrix,
@@ -1019,11 +1221,10 @@ def adjacency_matrix(sources, targets=None, source_grp={}, target_grp={},
                               target_grp,
                               drop_ungrouped=False)
 
-    # Make pretty
-    matrix.columns.name = 'targets'
-    matrix.index.name = 'sources'
+    if sparse:
+        return matrix
 
-    return matrix
+    return matrix.to_dataframe()
 
 
 def group_matrix(mat, row_groups={}, col_groups={}, drop_ungrouped=False,
@@ -1032,7 +1233,7 @@ def group_matrix(mat, row_groups={}, col_groups={}, drop_ungrouped=False,
 
     Parameters
     ----------
-    mat :               pandas.DataFrame | numpy.array
+    mat :               pandas.DataFrame | numpy.array | SparseConnectome
                         Matrix to group.
     row_groups :        dict, optional
                         Row groups to be formed. Can be either:
@@ -1052,7 +1253,9 @@ def group_matrix(mat, row_groups={}, col_groups={}, drop_ungrouped=False,
 
     Returns
     -------
-    pandas.DataFrame
+    pandas.DataFrame | SparseConnectome
+                        Same type as input (numpy arrays are returned as
+                        DataFrame).
 
     """
     remote_instance = utils._eval_remote_instance(remote_instance,
@@ -1068,14 +1271,17 @@ def group_matrix(mat, row_groups={}, col_groups={}, drop_ungrouped=False,
         return mat
 
     # Convert numpy array to DataFrame
-    if isinstance(mat, np.ndarray):
+    if isinstance(mat, core.SparseConnectome):
+        pass
+    elif isinstance(mat, np.ndarray):
         mat = pd.DataFrame(mat)
     # Make copy of original DataFrame
     elif isinstance(mat, pd.DataFrame):
         mat = mat.copy()
     else:
-        raise TypeError('Can only work with numpy arrays or pandas '
-                        'DataFrames, got "{}"'.format(type(mat)))
+        raise TypeError('Can only work with numpy arrays, pandas '
+                        'DataFrames or SparseConnectome, got '
+                        '"{}"'.format(type(mat)))
 
     # Convert to neuron->group format if necessary
     if col_groups and utils._is_iterable(list(col_groups.values())[0]):
@@ -1083,6 +1289,12 @@ def group_matrix(mat, row_groups={}, col_groups={}, drop_ungrouped=False,
     if row_groups and utils._is_iterable(list(row_groups.values())[0]):
         row_groups = {n: g for g in row_groups for n in utils.eval_skids(row_groups[g], remote_instance=remote_instance)}
 
+    # Sparse matrices are grouped without ever becoming dense
+    if isinstance(mat, core.SparseConnectome):
+        return mat.group(row_groups, col_groups,
+                         drop_ungrouped=drop_ungrouped,
+                         method=method)
+
     # Make sure everything is string
     mat.index = mat.index.astype(str)
     mat.columns = mat.columns.astype(str)
@@ -1208,55 +1420,201 @@ def connection_density(s, t, method='MEDIAN', normalize='DENSITY',
     if isinstance(t, core.CatmaidNeuronList):
         t = t[0]
 
-    # If no connections, return 0
-    if not any(post_tn):
-        return None
-    # If there is only one connection, we won't be able to calculate a density
-    elif post_tn.shape[0] == 1:
-        return None
+    return _density_helper((t.nodes, [post_tn], t.postsynapses.treenode_id.values,
+                            t.cable_length, method, normalize))[0]
 
-    # If we are normalizing to density, include all synapses in geodesic
-    # calculations
-    if normalize == 'DENSITY':
-        to_calc = t.postsynapses.treenode_id.values
+
+def connection_density_matrix(s, t, method='MEDIAN', normalize='DENSITY',
+                              parallel=None, n_cores=None,
+                              remote_instance=None):
+    """Calculate connection densities between many sources and targets.
+
+    Batch version of :func:`~pymaid.connection_density`: calculates the
+    density for each individual source -> target pair.
+
+    Parameters
+    ----------
+    s :                 skeleton IDs | CatmaidNeuron | CatmaidNeuronList
+                        Source neurons.
+    t :                 skeleton IDs | CatmaidNeuron | CatmaidNeuronList
+                        Target neurons. If CatmaidNeuron/List, will use
+                        connectors and total cable of these neurons. Use to
+                        subset density calculations to e.g. the dendrites.
+    method :            'SUM' | 'AVERAGE' | 'MEDIAN', optional
+                        Arithmetic method used to collapse pairwise geodesic
+                        distances. See :func:`~pymaid.connection_density`.
+    normalize :         'DENSITY' | 'CABLE' | False
+                        Normalization method. See
+                        :func:`~pymaid.connection_density`.
+    parallel :          bool, optional
+                        If True, will distribute targets across ``n_cores``
+                        worker processes. Defaults to ``t._use_parallel``.
+    n_cores :           int, optional
+                        Number of worker processes. Defaults to ``t.n_cores``.
+    remote_instance :   CatmaidInstance, optional
+
+    Returns
+    -------
+    pandas.DataFrame
+                        Sources (rows) x targets (columns). ``NaN`` where
+                        there is no or only a single connection.
+
+    Examples
+    --------
+    >>> dens = pymaid.connection_density_matrix('annotation:PN right',
+    ...                                         'annotation:LHN right',
+    ...                                         method='MEDIAN')
+
+    """
+    remote_instance = utils._eval_remote_instance(remote_instance)
+
+    if method not in ['SUM', 'AVERAGE', 'MEDIAN']:
+        raise ValueError('Unknown method "{}"'.format(method))
+
+    if normalize not in [False, 'DENSITY', 'CABLE']:
+        raise ValueError('Unknown normalization method "{}"'.format(normalize))
+
+    source_skids = utils.eval_skids(s, remote_instance=remote_instance)
+    target_skids = utils.eval_skids(t, remote_instance=remote_instance)
+
+    # Get connectors between all sources and targets in one go
+    cn_between = fetch.get_connectors_between(source_skids, target_skids,
+                                              directional=True,
+                                              remote_instance=remote_instance)
+    cn_between['source_neuron'] = cn_between.source_neuron.astype(str)
+    cn_between['target_neuron'] = cn_between.target_neuron.astype(str)
+    post_tn = {k: v.values for k, v in cn_between.groupby(['target_neuron',
+                                                           'source_neuron']).treenode2_id}
+
+    # Make sure we have neurons to work with
+    restrict = isinstance(t, (core.CatmaidNeuron, core.CatmaidNeuronList))
+    if not restrict:
+        t = fetch.get_neuron(target_skids, remote_instance=remote_instance)
+    if isinstance(t, core.CatmaidNeuron):
+        t = core.CatmaidNeuronList(t)
+
+    if isinstance(parallel, type(None)):
+        parallel = t._use_parallel
+    if isinstance(n_cores, type(None)):
+        n_cores = t.n_cores
+
+    jobs = []
+    for n in t:
+        this_post = [post_tn.get((n.skeleton_id, s), np.array([], dtype=int))
+                     for s in source_skids]
+        # If t already is a neuron, subset connectors to those that actually
+        # exist
+        if restrict:
+            this_post = [np.intersect1d(p, n.nodes.treenode_id.values)
+                         for p in this_post]
+        jobs.append((n.nodes[['treenode_id', 'parent_id', 'x', 'y', 'z']],
+                     this_post, n.postsynapses.treenode_id.values,
+                     n.cable_length, method, normalize))
+
+    if parallel and n_cores > 1 and len(jobs) > 1:
+        with mp.Pool(min(n_cores, len(jobs))) as pool:
+            res = list(config.tqdm(pool.imap(_density_helper, jobs),
+                                   total=len(jobs),
+                                   desc='Calc. density',
+                                   disable=config.pbar_hide,
+                                   leave=config.pbar_leave))
     else:
-        to_calc = post_tn
+        res = [_density_helper(j) for j in config.tqdm(jobs,
+                                                       desc='Calc. density',
+                                                       disable=config.pbar_hide,
+                                                       leave=config.pbar_leave)]
 
-    # Get geodesic distances
-    m = graph_utils.geodesic_matrix(t,
-                                    tn_ids=to_calc,
-                                    directed=False,
-                                    weight='weight')
+    dens = pd.DataFrame(np.array(res, dtype=float).T.reshape(len(source_skids),
+                                                             len(jobs)),
+                        index=[str(s) for s in source_skids],
+                        columns=[n.skeleton_id for n in t])
+    dens.index.name = 'sources'
+    dens.columns.name = 'targets'
 
-    # Get distances from matrix and convert to microns
-    dist = np.array([m.loc[i, j] for i, j in combinations(post_tn, 2)]) / 1000
+    return dens
 
-    # Prepare normalization
-    if normalize is None:
-        norm = [1]
-    elif normalize == 'DENSITY':
-        all_post = t.postsynapses.treenode_id.values
-        norm = np.array([m.loc[i, j] for i, j in combinations(all_post, 2)]) / 1000
-    elif normalize == 'CABLE':
-        norm = [t.cable_length]
 
-    # Combine distances and turn distance into density (1/dist)
+def _density_helper(args):
+    """Calculate connection densities onto a single target neuron.
+
+    Pairwise geodesic distances between synapses are calculated from the
+    distances to root of each synapse and their lowest common ancestor.
+
+    Parameters
+    ----------
+    args :      tuple
+                ``(nodes, post_tn, all_post, cable, method, normalize)``:
+                node table of the target, list of postsynaptic treenode IDs
+                (one array per source), treenode IDs of all postsynapses
+                (used for ``normalize='DENSITY'``), cable length (used for
+                ``normalize='CABLE'``) and parameters as in
+                :func:`~pymaid.connection_density`. Packed into a single
+                argument so that it can be used with
+                ``multiprocessing.Pool.imap``.
+
+    Returns
+    -------
+    list
+                Connection density for each source. ``None`` if it can't be
+                calculated.
+
+    """
+    nodes, post_tn, all_post, cable, method, normalize = args
+
     if method == 'SUM':
-        dist = np.sum(norm) / np.sum(dist)
+        func = np.sum
     elif method == 'AVERAGE':
-        dist = np.average(norm) / np.average(dist)
+        func = np.average
     elif method == 'MEDIAN':
-        dist = np.median(norm) / np.median(dist)
+        func = np.median
     else:
         raise ValueError('Unknown method "{}"'.format(method))
 
-    # It's possible that all connections are onto the same treenode in which
-    # case average/sum/median distance would be 0 -> we will return this as
-    # None
-    if dist == 0:
-        return None
+    res = [None] * len(post_tn)
+
+    # If there is only one connection, we won't be able to calculate a density
+    to_calc = [i for i, tn in enumerate(post_tn) if tn.shape[0] > 1]
+    if not to_calc:
+        return res
+
+    # Distance to root and ancestors of each node
+    parents = graph_utils._parent_index(nodes)
+    locs = nodes[['x', 'y', 'z']].values.astype(float)
+    has_parent = parents >= 0
+    weights = np.zeros(parents.shape[0])
+    weights[has_parent] = np.sqrt(np.sum((locs[has_parent] - locs[parents[has_parent]]) ** 2,
+                                         axis=1))
+    dist_root = graph_utils._dist_to_root(parents, weights)
+    up, depth = graph_utils._ancestor_table(parents)
+    tn_index = pd.Index(nodes.treenode_id.values)
+
+    def pairwise_dist(tn):
+        """Pairwise geodesic distances in microns."""
+        ix = tn_index.get_indexer(tn)
+        return graph_utils._pairwise_geodesic(ix[ix >= 0], dist_root,
+                                              up, depth) / 1000
+
+    # Prepare normalization
+    if normalize == 'DENSITY':
+        norm = func(pairwise_dist(all_post))
+    elif normalize == 'CABLE':
+        norm = func([cable])
+    else:
+        norm = func([1])
+
+    for i in to_calc:
+        # Combine distances and turn distance into density (1/dist)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dens = norm / func(pairwise_dist(post_tn[i]))
+
+        # It's possible that all connections are onto the same treenode in
+        # which case average/sum/median distance would be 0 -> we will return
+        # this as None. Same for connections onto disconnected fragments
+        # (infinite distance).
+        if dens != 0 and np.isfinite(dens):
+            res[i] = dens
 
-    return dist
+    return res
 
 
 def sparseness(x, which='LTS'):
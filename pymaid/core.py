@@ -82,6 +82,7 @@ import networkx as nx
 import numpy as np
 import pandas as pd
 import scipy.spatial
+import scipy.sparse
 import scipy.cluster.hierarchy
 
 from . import (graph, morpho, fetch, graph_utils, resample, intersect,
@@ -92,7 +93,8 @@ try:
 except ImportError:
     trimesh = None
 
-__all__ = ['CatmaidNeuron', 'CatmaidNeuronList', 'Dotprops', 'Volume']
+__all__ = ['CatmaidNeuron', 'CatmaidNeuronList', 'CatmaidDotprops', 'Dotprops',
+           'Volume', 'SparseConnectome']
 
 # Set up logging
 logger = config.logger
@@ -143,7 +145,7 @@ class CatmaidNeuron:
     igraph :            ``igraph.Graph``
                         iGraph representation of this neuron. Returns ``None``
                         if igraph library not installed.
-    dps :               ``pandas.DataFrame``
+    dps :               :class:`~pymaid.CatmaidDotprops`
                         Dotproduct representation of this neuron.
     review_status :     int
                         This neuron's review status.
@@ -1896,31 +1898,12 @@ class CatmaidNeuronList:
         if not inplace:
             x = x.copy(deepcopy=False)
 
-        if x._use_parallel:
-            pool = mp.Pool(x.n_cores)
-            combinations = [(n, resample_to) for i, n in enumerate(x.neurons)]
-            x.neurons = list(config.tqdm(pool.imap(x._resample_helper, combinations,
-                                            chunksize=10),
-                                  total=len(combinations),
-                                  desc='Downsampling',
-                                  disable=config.pbar_hide,
-                                  leave=config.pbar_leave))
-
-            pool.close()
-            pool.join()
-        else:
-            for n in config.tqdm(x.neurons, desc='Resampling',
-                          disable=config.pbar_hide, leave=config.pbar_leave):
-                n.resample(resample_to=resample_to, inplace=True)
+        # All neurons are resampled in one batch
+        resample.resample_neuron(x, resample_to, inplace=True)
 
         if not inplace:
             return x
 
-    def _resample_helper(self, x):
-        """ Helper function to parallelise basic operations."""
-        x[0].resample(resample_to=x[1], inplace=True)
-        return x[0]
-
     def downsample(self, factor=5, inplace=True, **kwargs):
         """Downsamples (simplifies) all neurons by given factor.
 
@@ -1947,30 +1930,43 @@ class CatmaidNeuronList:
         if not inplace:
             x = x.copy(deepcopy=False)
 
-        if x._use_parallel:
-            pool = mp.Pool(x.n_cores)
-            combinations = [(n, factor, kwargs)
-                            for i, n in enumerate(x.neurons)]
-            x.neurons = list(config.tqdm(pool.imap(x._downsample_helper, combinations,
-                                            chunksize=10),
-                                  desc='Downsampling',
-                                  disable=config.pbar_hide,
-                                  leave=config.pbar_leave))
-
-            pool.close()
-            pool.join()
-        else:
-            for n in config.tqdm(x.neurons, desc='Downsampling',
-                          disable=config.pbar_hide, leave=config.pbar_leave):
-                n.downsample(factor=factor, inplace=True, **kwargs)
+        # Downsampling is cheap enough to not bother with multiprocessing
+        resample.downsample_neuron(x, factor, inplace=True, **kwargs)
 
         if not inplace:
             return x
 
-    def _downsample_helper(self, x):
-        """ Helper function to parallelise basic operations."""
-        x[0].downsample(factor=x[1], inplace=True, **x[2])
-        return x[0]
+    def morphometrics(self, metrics=None, seg_length=10):
+        """ Calculate morphometrics for all neurons in a single table.
+
+        Uses multiple processes if ``_use_parallel`` is True.
+
+        Parameters
+        ----------
+        metrics :       str | list of str, optional
+                        Metrics to calculate. If None, will calculate all
+                        but ``segregation_index``.
+        seg_length :    int | float, optional
+                        Segment length [um] for tortuosity.
+
+        Returns
+        -------
+        pandas.DataFrame
+
+        See Also
+        --------
+        :func:`~pymaid.morphometrics`
+                    Base function. See for details and available metrics.
+
+        Examples
+        --------
+        >>> nl = pymaid.get_neuron('annotation:glomerulus DA1')
+        >>> m = nl.morphometrics(['cable_length', 'max_strahler'])
+        """
+        return morpho.morphometrics(self, metrics=metrics,
+                                    seg_length=seg_length,
+                                    parallel=self._use_parallel,
+                                    n_cores=self.n_cores)
 
     def reroot(self, new_root, inplace=True):
         """ Reroot neuron to treenode ID or node tag.
@@ -2817,6 +2813,553 @@ class Dotprops(pd.DataFrame):
     """
 
 
+class CatmaidDotprops:
+    """ Dotprops (points + tangent vectors) of a single neuron.
+
+    Unlike :class:`~pymaid.Dotprops`, this is backed by contiguous numpy
+    arrays and is what :func:`~pymaid.to_dotprops` and
+    :attr:`CatmaidNeuron.dps` return.
+
+    Parameters
+    ----------
+    points :        array-like
+                    ``(N, 3)`` array of x/y/z coordinates.
+    vect :          array-like
+                    ``(N, 3)`` array of unit tangent vectors.
+    alpha :         array-like, optional
+                    ``(N, )`` array of alpha values (i.e. how linear the
+                    local neighbourhood of each point is).
+    vec_length :    array-like, optional
+                    ``(N, )`` array of lengths of the segments the tangent
+                    vectors were derived from.
+    k :             int, optional
+                    Number of nearest neighbours used to calculate tangent
+                    vectors. ``None`` if vectors were derived from
+                    child -> parent segments.
+    skeleton_id :   str, optional
+    neuron_name :   str, optional
+
+    Attributes
+    ----------
+    kdtree :        scipy.spatial.cKDTree
+                    KD-tree of ``points``. Generated on first access.
+
+    See Also
+    --------
+    :func:`~pymaid.to_dotprops`
+                    Generates dotprops from neurons.
+
+    """
+
+    def __init__(self, points, vect, alpha=None, vec_length=None, k=None,
+                 skeleton_id=None, neuron_name=None):
+        self.points = np.ascontiguousarray(points, dtype=np.float32).reshape(-1, 3)
+        self.vect = np.ascontiguousarray(vect, dtype=np.float32).reshape(-1, 3)
+
+        if self.points.shape != self.vect.shape:
+            raise ValueError('Points and vectors must have the same shape: '
+                             '{} vs {}'.format(self.points.shape,
+                                               self.vect.shape))
+
+        if not isinstance(alpha, type(None)):
+            alpha = np.ascontiguousarray(alpha, dtype=np.float32)
+        self.alpha = alpha
+
+        if not isinstance(vec_length, type(None)):
+            vec_length = np.ascontiguousarray(vec_length, dtype=np.float32)
+        self.vec_length = vec_length
+
+        self.k = k
+        self.skeleton_id = skeleton_id
+        self.neuron_name = neuron_name
+
+    def __getattr__(self, key):
+        if key == 'kdtree':
+            self.kdtree = scipy.spatial.cKDTree(self.points)
+            return self.kdtree
+        raise AttributeError('Attribute "{}" not found'.format(key))
+
+    def __len__(self):
+        return self.points.shape[0]
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __repr__(self):
+        return '{} of neuron {} ({} points) at {}'.format(type(self),
+                                                          self.skeleton_id,
+                                                          len(self),
+                                                          hex(id(self)))
+
+    def copy(self):
+        """Return a copy of the dotprops."""
+        x = CatmaidDotprops(self.points.copy(),
+                            self.vect.copy(),
+                            alpha=None if isinstance(self.alpha, type(None)) else self.alpha.copy(),
+                            vec_length=None if isinstance(self.vec_length, type(None)) else self.vec_length.copy(),
+                            k=self.k,
+                            skeleton_id=self.skeleton_id,
+                            neuron_name=self.neuron_name)
+        return x
+
+    def to_dataframe(self):
+        """Return dotprops as pandas DataFrame.
+
+        Returns
+        -------
+        pandas.DataFrame
+                    DataFrame with columns ``x``, ``y``, ``z``, ``x_vec``,
+                    ``y_vec``, ``z_vec`` and - if available - ``alpha`` and
+                    ``vec_length``.
+
+        """
+        df = pd.DataFrame(np.hstack([self.points, self.vect]),
+                          columns=['x', 'y', 'z', 'x_vec', 'y_vec', 'z_vec'])
+        if not isinstance(self.alpha, type(None)):
+            df['alpha'] = self.alpha
+        if not isinstance(self.vec_length, type(None)):
+            df['vec_length'] = self.vec_length
+        return df
+
+
+class SparseConnectome:
+    """ Sparse adjacency matrix between source and target neurons.
+
+    Backed by a ``scipy.sparse.csr_matrix`` with sources as rows and targets
+    as columns. Use this instead of dense pandas DataFrames for large numbers
+    of neurons: memory scales with the number of edges, not with the number
+    of neuron pairs.
+
+    Parameters
+    ----------
+    matrix :        scipy.sparse matrix | numpy.ndarray | pandas.DataFrame
+                    ``(N, M)`` matrix of source -> target synapse counts.
+                    If DataFrame, ``sources`` and ``targets`` default to its
+                    index and columns, respectively.
+    sources :       array-like, optional
+                    ``(N, )`` skeleton IDs (or group names) of rows.
+    targets :       array-like, optional
+                    ``(M, )`` skeleton IDs (or group names) of columns. If
+                    not provided, ``targets = sources``.
+    is_grouped :    bool, optional
+                    Whether rows/columns represent groups of neurons.
+
+    Attributes
+    ----------
+    matrix :        scipy.sparse.csr_matrix
+    sources :       numpy.ndarray
+    targets :       numpy.ndarray
+
+    Examples
+    --------
+    >>> nl = pymaid.get_neurons('annotation:glomerulus DA1')
+    >>> adj = pymaid.adjacency_matrix(nl, sparse=True)
+    >>> # Subset to some sources and drop weak edges
+    >>> sub = adj.subset(sources=nl.skeleton_id[:5]).threshold(3)
+    >>> # Export as edge list or as dense pandas DataFrame
+    >>> edges = sub.to_edges()
+    >>> df = sub.to_dataframe()
+
+    See Also
+    --------
+    :func:`~pymaid.adjacency_matrix`
+                    Use ``sparse=True`` to get a SparseConnectome.
+
+    """
+
+    datatype = 'adjacency_matrix'
+
+    def __init__(self, matrix, sources=None, targets=None, is_grouped=False):
+        if isinstance(matrix, pd.DataFrame):
+            if isinstance(sources, type(None)):
+                sources = matrix.index.values
+            if isinstance(targets, type(None)):
+                targets = matrix.columns.values
+            is_grouped = is_grouped or getattr(matrix, 'is_grouped', False)
+            matrix = matrix.values
+
+        self.matrix = scipy.sparse.csr_matrix(matrix)
+        self.matrix.sum_duplicates()
+
+        if isinstance(sources, type(None)):
+            sources = np.arange(self.matrix.shape[0])
+        if isinstance(targets, type(None)):
+            targets = sources
+
+        self.sources = np.asarray(sources)
+        self.targets = np.asarray(targets)
+        self.is_grouped = is_grouped
+
+        if self.matrix.shape != (self.sources.shape[0], self.targets.shape[0]):
+            raise ValueError('Matrix of shape {} does not match number of '
+                             'sources ({}) and targets '
+                             '({})'.format(self.matrix.shape,
+                                           self.sources.shape[0],
+                                           self.targets.shape[0]))
+
+    @classmethod
+    def from_edges(cls, source, target, weight=None, sources=None,
+                   targets=None):
+        """ Generate sparse connectome from an edge list.
+
+        Parameters
+        ----------
+        source,target : array-like
+                        Skeleton IDs of source and target of each edge.
+        weight :        array-like, optional
+                        Weight of each edge. Defaults to 1, i.e. each edge
+                        represents a single connection. Duplicate edges are
+                        summed up.
+        sources :       array-like, optional
+                        Skeleton IDs (and their order) to use as rows. Edges
+                        from other sources are dropped. Defaults to all
+                        sources in edge list (sorted).
+        targets :       array-like, optional
+                        Same as ``sources`` for columns.
+
+        Returns
+        -------
+        SparseConnectome
+
+        """
+        source = np.asarray(source)
+        target = np.asarray(target)
+
+        if isinstance(weight, type(None)):
+            weight = np.ones(source.shape[0])
+        weight = np.asarray(weight)
+
+        if isinstance(sources, type(None)):
+            sources = np.unique(source)
+        if isinstance(targets, type(None)):
+            targets = np.unique(target)
+        sources = np.asarray(sources)
+        targets = np.asarray(targets)
+
+        rows = _label_index(sources).get_indexer(source.astype(str))
+        cols = _label_index(targets).get_indexer(target.astype(str))
+        keep = (rows >= 0) & (cols >= 0)
+
+        matrix = scipy.sparse.coo_matrix((weight[keep],
+                                          (rows[keep], cols[keep])),
+                                         shape=(sources.shape[0],
+                                                targets.shape[0]))
+
+        return cls(matrix, sources, targets)
+
+    @classmethod
+    def from_partners(cls, x):
+        """ Generate sparse connectome from a connectivity table.
+
+        Parameters
+        ----------
+        x :         pandas.DataFrame
+                    Connectivity table as returned by
+                    :func:`~pymaid.get_partners`.
+
+        Returns
+        -------
+        SparseConnectome
+                    Square matrix between all neurons in the table: query
+                    neurons first, then partners.
+
+        """
+        neurons = [c for c in x.columns if str(c).isnumeric()]
+
+        source, target, weight = [], [], []
+        for rel, flip in [('upstream', False), ('downstream', True)]:
+            this = x[x.relation == rel]
+            w = this[neurons].values
+            r, c = np.nonzero(w)
+            partner = this.skeleton_id.values.astype(str)[r]
+            neuron = np.array(neurons, dtype=str)[c]
+            source.append(neuron if flip else partner)
+            target.append(partner if flip else neuron)
+            weight.append(w[r, c])
+
+        skids = np.array(neurons, dtype=str)
+        skids = np.append(skids, x.skeleton_id.values.astype(str))
+        skids = pd.unique(skids)
+
+        return cls.from_edges(np.concatenate(source), np.concatenate(target),
+                              np.concatenate(weight), sources=skids,
+                              targets=skids)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def nnz(self):
+        """Number of non-zero edges."""
+        return self.matrix.nnz
+
+    @property
+    def T(self):
+        """Transposed connectome (targets -> sources)."""
+        return SparseConnectome(self.matrix.T, self.targets, self.sources,
+                                is_grouped=self.is_grouped)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __repr__(self):
+        return '{} of {} sources x {} targets ({} edges) at {}'.format(type(self),
+                                                                       self.shape[0],
+                                                                       self.shape[1],
+                                                                       self.nnz,
+                                                                       hex(id(self)))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        rows, cols = key
+        rows = None if isinstance(rows, slice) and rows == slice(None) else rows
+        cols = None if isinstance(cols, slice) and cols == slice(None) else cols
+        return self.subset(sources=rows, targets=cols)
+
+    def copy(self):
+        """Return a copy of the connectome."""
+        return SparseConnectome(self.matrix.copy(), self.sources.copy(),
+                                self.targets.copy(),
+                                is_grouped=self.is_grouped)
+
+    def subset(self, sources=None, targets=None, fill_missing=False):
+        """ Subset to given sources and/or targets.
+
+        Parameters
+        ----------
+        sources,targets :   array-like, optional
+                            Skeleton IDs (or group names). Order is
+                            preserved. If None, will keep all.
+        fill_missing :      bool, optional
+                            If True, sources/targets not in the connectome
+                            are added as empty rows/columns. If False, will
+                            raise ValueError.
+
+        Returns
+        -------
+        SparseConnectome
+
+        """
+        matrix = self.matrix
+        new_sources, new_targets = self.sources, self.targets
+
+        if not isinstance(sources, type(None)):
+            new_sources = utils._make_iterable(sources)
+            ix = self._indexer(self.sources, new_sources, fill_missing)
+            matrix = _take_rows(matrix, ix)
+
+        if not isinstance(targets, type(None)):
+            new_targets = utils._make_iterable(targets)
+            ix = self._indexer(self.targets, new_targets, fill_missing)
+            matrix = _take_rows(matrix.T.tocsr(), ix).T
+
+        return SparseConnectome(matrix, new_sources, new_targets,
+                                is_grouped=self.is_grouped)
+
+    def _indexer(self, labels, to_find, fill_missing):
+        ix = _label_index(labels).get_indexer(np.asarray(to_find).astype(str))
+        if not fill_missing and any(ix < 0):
+            raise ValueError('{} skeleton ID(s) not found: '
+                             '{}'.format(sum(ix < 0),
+                                         ', '.join(np.asarray(to_find)[ix < 0][:10].astype(str))))
+        return ix
+
+    def threshold(self, syn_threshold=None, syn_cutoff=None):
+        """ Remove weak and/or cap strong connections.
+
+        Parameters
+        ----------
+        syn_threshold :     int | float, optional
+                            Connections with LESS synapses are removed.
+        syn_cutoff :        int | float, optional
+                            Connections with MORE synapses are set to
+                            ``syn_cutoff``.
+
+        Returns
+        -------
+        SparseConnectome
+
+        """
+        x = self.copy()
+        if not isinstance(syn_cutoff, type(None)):
+            x.matrix.data = np.minimum(x.matrix.data, syn_cutoff)
+        if syn_threshold:
+            x.matrix.data[x.matrix.data < syn_threshold] = 0
+        x.matrix.eliminate_zeros()
+        return x
+
+    def group(self, row_groups={}, col_groups={}, drop_ungrouped=False,
+              method='SUM'):
+        """ Group rows and/or columns.
+
+        Works like :func:`~pymaid.group_matrix` but without converting to a
+        dense matrix.
+
+        Parameters
+        ----------
+        row_groups :        dict, optional
+                            ``{neuron1: group1, neuron2: group2, ...}``.
+                            Neurons not in the dict are kept as is unless
+                            ``drop_ungrouped=True``.
+        col_groups :        dict, optional
+                            Same as ``row_groups`` for columns.
+        drop_ungrouped :    bool, optional
+                            If True, neurons without a group are dropped.
+        method :            'AVERAGE' | 'MAX' | 'MIN' | 'SUM', optional
+                            Method by which values are collapsed into groups.
+
+        Returns
+        -------
+        SparseConnectome
+                            Groups are sorted by name.
+
+        """
+        if method not in ['AVERAGE', 'MIN', 'MAX', 'SUM']:
+            raise ValueError('Unknown method "{}"'.format(method))
+
+        matrix = self.matrix.tocoo()
+        # Labels are strings after grouping (same as pymaid.group_matrix)
+        sources, targets = self.sources.astype(str), self.targets.astype(str)
+        n_rows = np.ones(self.shape[0], dtype=int)
+        n_cols = np.ones(self.shape[1], dtype=int)
+        row_code = np.arange(self.shape[0])
+        col_code = np.arange(self.shape[1])
+
+        if row_groups:
+            keep, row_code, sources, n_rows = _group_labels(self.sources,
+                                                            row_groups,
+                                                            drop_ungrouped)
+        else:
+            keep = np.ones(self.shape[0], dtype=bool)
+        ok = keep[matrix.row]
+
+        if col_groups:
+            keep, col_code, targets, n_cols = _group_labels(self.targets,
+                                                            col_groups,
+                                                            drop_ungrouped)
+            ok &= keep[matrix.col]
+
+        rows = row_code[matrix.row[ok]]
+        cols = col_code[matrix.col[ok]]
+        data = matrix.data[ok]
+        shape = (sources.shape[0], targets.shape[0])
+
+        if method in ['SUM', 'AVERAGE']:
+            grouped = scipy.sparse.coo_matrix((data, (rows, cols)),
+                                              shape=shape).tocsr()
+            if method == 'AVERAGE':
+                grouped = grouped.tocoo()
+                grouped.data = grouped.data / (n_rows[grouped.row]
+                                               * n_cols[grouped.col])
+        else:
+            agg = pd.DataFrame({'row': rows, 'col': cols, 'data': data})
+            agg = agg.groupby(['row', 'col']).data.agg([method.lower(),
+                                                        'count'])
+            r = agg.index.get_level_values(0).values
+            c = agg.index.get_level_values(1).values
+            val = agg[method.lower()].values
+            # Blocks that are not completely filled contain (implicit) zeros
+            has_zeros = agg['count'].values < n_rows[r] * n_cols[c]
+            if method == 'MAX':
+                val = np.where(has_zeros, np.maximum(val, 0), val)
+            else:
+                val = np.where(has_zeros, np.minimum(val, 0), val)
+            grouped = scipy.sparse.coo_matrix((val, (r, c)), shape=shape)
+
+        x = SparseConnectome(grouped, sources, targets, is_grouped=True)
+        x.matrix.eliminate_zeros()
+        return x
+
+    def sum(self, axis=None):
+        """Sum of connections: total, per source (axis=1) or per target
+        (axis=0)."""
+        if isinstance(axis, type(None)):
+            return self.matrix.sum()
+        return np.asarray(self.matrix.sum(axis=axis)).flatten()
+
+    def to_dataframe(self):
+        """ Convert to dense pandas DataFrame.
+
+        Returns
+        -------
+        pandas.DataFrame
+                    Sources are rows, targets are columns - same format
+                    as :func:`~pymaid.adjacency_matrix`.
+
+        """
+        df = pd.DataFrame(self.matrix.toarray(), index=self.sources,
+                          columns=self.targets)
+        df.index.name = 'sources'
+        df.columns.name = 'targets'
+        df.datatype = 'adjacency_matrix'
+        if self.is_grouped:
+            df.is_grouped = True
+        return df
+
+    def to_edges(self):
+        """ Convert to edge list.
+
+        Returns
+        -------
+        pandas.DataFrame
+                    ``source_skid``, ``target_skid``, ``weight`` for each
+                    non-zero edge.
+
+        """
+        m = self.matrix.tocoo()
+        return pd.DataFrame({'source_skid': self.sources[m.row],
+                             'target_skid': self.targets[m.col],
+                             'weight': m.data})
+
+
+def _label_index(labels):
+    """Turn skeleton IDs (or group names) into index of strings."""
+    return pd.Index(np.asarray(labels).astype(str))
+
+
+def _take_rows(matrix, ix):
+    """Take rows from sparse matrix. Negative indices produce empty rows."""
+    sel = scipy.sparse.coo_matrix((np.ones((ix >= 0).sum()),
+                                   (np.where(ix >= 0)[0], ix[ix >= 0])),
+                                  shape=(ix.shape[0], matrix.shape[0]))
+    return sel.tocsr().dot(matrix)
+
+
+def _group_labels(labels, groups, drop_ungrouped):
+    """Map labels to groups.
+
+    Returns
+    -------
+    keep :      numpy.ndarray
+                Boolean mask of labels to keep.
+    codes :     numpy.ndarray
+                Group index for each label (-1 if dropped).
+    uniq :      numpy.ndarray
+                Sorted group names.
+    size :      numpy.ndarray
+                Number of labels per group.
+
+    """
+    groups = {str(k): str(v) for k, v in groups.items()}
+    labels = np.asarray(labels).astype(str)
+
+    keep = np.ones(labels.shape[0], dtype=bool)
+    if drop_ungrouped:
+        keep = np.isin(labels, list(groups.keys()))
+
+    grp = np.array([groups.get(l, l) for l in labels[keep]], dtype=str)
+    uniq, inv = np.unique(grp, return_inverse=True)
+    codes = np.full(labels.shape[0], -1, dtype=int)
+    codes[keep] = inv
+
+    return keep, codes, uniq, np.bincount(inv, minlength=uniq.shape[0])
+
+
 class Volume:
     """ Class representing CATMAID meshes.
 
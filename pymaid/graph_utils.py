@@ -27,7 +27,7 @@ import networkx as nx
 
 from scipy.sparse import csgraph, csr_matrix
 
-from . import graph, core, utils, config, morpho
+from . import graph, core, utils, config, morpho, cache
 
 # Set up logging
 logger = config.logger
@@ -40,6 +40,7 @@ __all__ = sorted(['classify_nodes', 'cut_neuron', 'longest_neurite',
                   'segment_length', 'find_first_branchpoint'])
 
 
+@cache.memoize('value')
 def _generate_segments(x, weight=None):
     """Generate segments maximizing segment lengths.
 
@@ -66,7 +67,12 @@ def _generate_segments(x, weight=None):
         logger.error('Unexpected datatype: %s' % str(type(x)))
         raise ValueError
 
-    if weight == 'weight':
+    if not weight:
+        nodes, offsets = _long_segment_array(_parent_index(x))
+        ids = x.nodes.treenode_id.values[nodes]
+
+        return [ids[s:e].tolist() for s, e in zip(offsets[:-1], offsets[1:])]
+    elif weight == 'weight':
         # Get distances from end nodes to root
         m = geodesic_matrix(x,
                             directed=True,
@@ -75,10 +81,6 @@ def _generate_segments(x, weight=None):
 
         # Sort by distance to root
         endNodeIDs = m.sort_values(x.root[0], ascending=False).index.values
-    elif not weight:
-        d = _edge_count_to_root(x)
-        endNodeIDs = x.nodes[x.nodes.type == 'end'].treenode_id.values
-        endNodeIDs = sorted(endNodeIDs, key=d.get, reverse=True)
     else:
         raise ValueError('Unable to use weight "{}"'.format(weight))
 
@@ -115,16 +117,13 @@ def _generate_segments(x, weight=None):
         sequences = [[ix2id[ix] for ix in s] for s in sequences]
 
     # Sort sequences by length
-    if weight == 'weight':
-        sequences = sorted(
-            sequences, key=lambda x: m.loc[x[0], x[-1]], reverse=True)
-    else:
-        sequences = sorted(
-            sequences, key=lambda x: d[x[0]] - d[x[-1]], reverse=True)
+    sequences = sorted(
+        sequences, key=lambda x: m.loc[x[0], x[-1]], reverse=True)
 
     return sequences
 
 
+@cache.memoize('value')
 def _break_segments(x):
     """Break neuron into small segments connecting ends, branches and root.
 
@@ -147,47 +146,10 @@ def _break_segments(x):
         logger.error('Unexpected datatype: %s' % str(type(x)))
         raise ValueError
 
-    if x.igraph and config.use_igraph:
-        g = x.igraph
-        end = g.vs.select(_indegree=0).indices
-        branch = g.vs.select(_indegree_gt=1, _outdegree=1).indices
-        root = g.vs.select(_outdegree=0).indices
-
-        # Get seeds
-        seeds = branch + end
-        # Remove seeds that are also roots (=disconnected single nodes)
-        seeds = set(seeds) - set(root)
-
-        # Converting to set speeds up the "parent in stops" check
-        stops = set(branch + root)
-        seg_list = []
-        for s in seeds:
-            parent = g.successors(s)[0]
-            seg = [s, parent]
-            while parent not in stops:
-                parent = g.successors(parent)[0]
-                seg.append(parent)
-            seg_list.append(seg)
-        # Translate indices to treenode IDs
-        ix_id = {v: n for v, n in zip(g.vs.indices,
-                                      g.vs.get_attribute_values('node_id'))}
-        seg_list = [[ix_id[n] for n in s] for s in seg_list]
-    else:
-        seeds = x.nodes[x.nodes.type.isin(['branch', 'end'])].treenode_id.values
-        stops = x.nodes[x.nodes.type.isin(['branch', 'root'])].treenode_id.values
-        # Converting to set speeds up the "parent in stops" check
-        stops = set(stops)
-        g = x.graph
-        seg_list = []
-        for s in seeds:
-            parent = next(g.successors(s), None)
-            seg = [s, parent]
-            while parent not in stops:
-                parent = next(g.successors(parent), None)
-                seg.append(parent)
-            seg_list.append(seg)
+    nodes, offsets = _segment_array(_parent_index(x))
+    ids = x.nodes.treenode_id.values[nodes]
 
-    return seg_list
+    return [ids[s:e].tolist() for s, e in zip(offsets[:-1], offsets[1:])]
 
 
 def _edge_count_to_root(x):
@@ -223,6 +185,475 @@ def _edge_count_to_root(x):
     return dist
 
 
+def _parent_index(x):
+    """Return parent of each node as row index into ``x.nodes``.
+
+    Parameters
+    ----------
+    x :         CatmaidNeuron | pandas.DataFrame
+                Neuron or its node table.
+
+    Returns
+    -------
+    numpy.ndarray
+                Array of ``len(x.nodes)`` with the row index of each node's
+                parent. Root nodes (or nodes whose parent is missing) have
+                ``-1``.
+
+    """
+    nodes = x.nodes if isinstance(x, core.CatmaidNeuron) else x
+
+    tn_ids = nodes.treenode_id.values
+    parents = nodes.parent_id.values
+
+    ix = np.full(len(tn_ids), -1, dtype=int)
+    has_parent = pd.notnull(parents)
+    if not np.any(has_parent):
+        return ix
+
+    # Treenode IDs are not necessarily sorted -> use searchsorted on argsort
+    srt = np.argsort(tn_ids, kind='stable')
+    pids = parents[has_parent].astype(tn_ids.dtype)
+    pos = np.searchsorted(tn_ids[srt], pids)
+    pos = srt[np.clip(pos, 0, len(tn_ids) - 1)]
+
+    # Parents that are not in the node table are treated like roots
+    ix[has_parent] = np.where(tn_ids[pos] == pids, pos, -1)
+
+    return ix
+
+
+def _jump_to(ptr, stop, max_iter=None):
+    """Follow pointers until a stop node is reached.
+
+    Uses pointer jumping, i.e. the number of (vectorized) iterations grows
+    only with the logarithm of the longest path.
+
+    Parameters
+    ----------
+    ptr :       numpy.ndarray
+                Index of the next node for each node (e.g. parent index as
+                returned by :func:`~pymaid.graph_utils._parent_index`). ``-1``
+                terminates a path.
+    stop :      numpy.ndarray of bool
+                Nodes at which to stop.
+
+    Returns
+    -------
+    target :    numpy.ndarray
+                For each node, the index of the first node along its path
+                (excluding itself) that is a stop node. ``-1`` if the path
+                ends without hitting a stop node.
+    hops :      numpy.ndarray
+                Number of steps taken to get to ``target``. If no stop node
+                was hit, this is the number of steps to the end of the path
+                (e.g. the distance to the root in edges).
+
+    """
+    target = np.asarray(ptr, dtype=int).copy()
+    hops = (target >= 0).astype(int)
+
+    active = target >= 0
+    active[active] = ~stop[target[active]]
+    while np.any(active):
+        ix = np.where(active)[0]
+        nxt = target[ix]
+        # Synchronous update: read everything before writing
+        new_target = target[nxt]
+        new_hops = hops[ix] + hops[nxt]
+        target[ix] = new_target
+        hops[ix] = new_hops
+
+        active[ix] = new_target >= 0
+        active[ix[new_target >= 0]] = ~stop[new_target[new_target >= 0]]
+
+    return target, hops
+
+
+def _dist_to_root(parents, weights):
+    """Sum edge weights from each node to its root.
+
+    Parameters
+    ----------
+    parents :   numpy.ndarray
+                Parent index for each node, ``-1`` for roots. See
+                :func:`~pymaid.graph_utils._parent_index`.
+    weights :   numpy.ndarray
+                Weight of the edge between each node and its parent (e.g.
+                its length). Ignored for roots.
+
+    Returns
+    -------
+    numpy.ndarray
+
+    """
+    dist = np.where(parents >= 0, weights, 0).astype(float)
+    ptr = np.asarray(parents, dtype=int).copy()
+
+    # Pointer jumping: each iteration doubles the covered path length
+    active = ptr >= 0
+    while np.any(active):
+        ix = np.where(active)[0]
+        nxt = ptr[ix]
+        dist[ix] = dist[ix] + dist[nxt]
+        ptr[ix] = ptr[nxt]
+        active[ix] = ptr[ix] >= 0
+
+    return dist
+
+
+def _ancestor_table(parents):
+    """Generate binary lifting table for lowest common ancestor queries.
+
+    Parameters
+    ----------
+    parents :   numpy.ndarray
+                Parent index for each node, ``-1`` for roots. See
+                :func:`~pymaid.graph_utils._parent_index`. May contain
+                multiple trees.
+
+    Returns
+    -------
+    up :        list of numpy.ndarray
+                ``up[k][i]`` is the 2^k-th ancestor of node ``i``. Roots are
+                their own ancestors.
+    depth :     numpy.ndarray
+                Number of edges between each node and its root.
+
+    """
+    n = parents.shape[0]
+    _, depth = _jump_to(parents, np.zeros(n, dtype=bool))
+
+    up = [np.where(parents >= 0, parents, np.arange(n))]
+    max_depth = int(depth.max()) if n else 0
+    for _ in range(1, max(1, max_depth.bit_length())):
+        up.append(up[-1][up[-1]])
+
+    return up, depth
+
+
+def _lca(up, depth, a, b):
+    """Find lowest common ancestors for pairs of nodes.
+
+    Parameters
+    ----------
+    up, depth : numpy.ndarray
+                Ancestor table as returned by
+                :func:`~pymaid.graph_utils._ancestor_table`.
+    a, b :      numpy.ndarray
+                Node indices. Pairs ``(a[i], b[i])`` are processed.
+
+    Returns
+    -------
+    numpy.ndarray
+                Index of lowest common ancestor for each pair. ``-1`` if
+                nodes are not in the same tree.
+
+    """
+    # Make sure that ``a`` is the deeper node
+    swap = depth[a] < depth[b]
+    a, b = np.where(swap, b, a), np.where(swap, a, b)
+
+    # Lift ``a`` to the depth of ``b``
+    diff = depth[a] - depth[b]
+    for k, anc in enumerate(up):
+        lift = (diff >> k) & 1 == 1
+        a[lift] = anc[a[lift]]
+
+    # Lift both as long as they don't converge
+    for anc in up[::-1]:
+        lift = anc[a] != anc[b]
+        a[lift] = anc[a[lift]]
+        b[lift] = anc[b[lift]]
+
+    lca = np.where(a == b, a, up[0][a])
+    lca[(a != b) & (up[0][a] != up[0][b])] = -1
+
+    return lca
+
+
+def _pairwise_geodesic(ix, dist, up, depth, chunk_size=1000000):
+    """Calculate geodesic distances between all pairs of given nodes.
+
+    Parameters
+    ----------
+    ix :            numpy.ndarray
+                    Node indices.
+    dist :          numpy.ndarray
+                    Distance from each node to its root. See
+                    :func:`~pymaid.graph_utils._dist_to_root`.
+    up, depth :     numpy.ndarray
+                    Ancestor table as returned by
+                    :func:`~pymaid.graph_utils._ancestor_table`.
+    chunk_size :    int, optional
+                    Number of pairs to process at a time.
+
+    Returns
+    -------
+    numpy.ndarray
+                    Distances in order of ``itertools.combinations(ix, 2)``.
+                    Nodes in different trees are ``inf`` apart.
+
+    """
+    ix = np.asarray(ix, dtype=int)
+    n = ix.shape[0]
+    res = np.empty(n * (n - 1) // 2)
+
+    # Number of pairs in each row of the upper triangle
+    row_pairs = np.arange(n - 1, 0, -1)
+    row_offsets = np.append(0, np.cumsum(row_pairs))
+    row_chunk = row_offsets[:-1] // max(1, chunk_size)
+    for rows in np.split(np.arange(n - 1),
+                         np.where(np.diff(row_chunk))[0] + 1):
+        if not rows.shape[0]:
+            continue
+        i = np.repeat(rows, row_pairs[rows])
+        # Column index: runs from i + 1 to n - 1 for each row
+        j = np.arange(i.shape[0]) - np.repeat(row_offsets[rows] - row_offsets[rows[0]],
+                                              row_pairs[rows]) + i + 1
+        a, b = ix[i], ix[j]
+        lca = _lca(up, depth, a, b)
+        d = dist[a] + dist[b] - 2 * dist[lca]
+        d[lca < 0] = float('inf')
+        res[row_offsets[rows[0]]: row_offsets[rows[-1] + 1]] = d
+
+    return res
+
+
+def _group_by_depth(depth):
+    """Group node indices by depth, starting with the deepest level.
+
+    Nodes with negative depth are ignored.
+
+    """
+    ix = np.where(depth >= 0)[0]
+    ix = ix[np.argsort(-depth[ix], kind='stable')]
+    splits = np.where(np.diff(depth[ix]) != 0)[0] + 1
+    return np.split(ix, splits)
+
+
+def _subtree_sums(parents, weights):
+    """Sum weights over each node's subtree (including the node itself).
+
+    Parameters
+    ----------
+    parents :   numpy.ndarray
+                Parent index for each node, ``-1`` for roots. See
+                :func:`~pymaid.graph_utils._parent_index`. May contain
+                multiple trees.
+    weights :   numpy.ndarray
+                ``(N, )`` or ``(N, M)`` array of weights.
+
+    Returns
+    -------
+    numpy.ndarray
+                Sums over all nodes distal to and including each node. Same
+                shape as ``weights``.
+
+    """
+    return _subtree_reduce(parents, weights, np.add, 0)
+
+
+def _subtree_reduce(parents, values, ufunc, identity):
+    """Reduce values over each node's subtree (including the node itself).
+
+    Parameters
+    ----------
+    parents :   numpy.ndarray
+                Parent index for each node, ``-1`` for roots. See
+                :func:`~pymaid.graph_utils._parent_index`. May contain
+                multiple trees.
+    values :    numpy.ndarray
+                ``(N, )`` or ``(N, M)`` array of values.
+    ufunc :     numpy.ufunc
+                Function used for reduction, e.g. ``numpy.add`` or
+                ``numpy.minimum``.
+    identity :  int | float
+                Identity of ``ufunc``, e.g. ``0`` for ``numpy.add`` or
+                ``numpy.inf`` for ``numpy.minimum``.
+
+    Returns
+    -------
+    numpy.ndarray
+                Same shape as ``values``.
+
+    """
+    values = np.asarray(values, dtype=float)
+    n = parents.shape[0]
+    res = values.reshape(n, -1).copy()
+
+    if not n:
+        return res.reshape(values.shape)
+
+    has_parent = parents >= 0
+    n_childs = np.bincount(parents[has_parent], minlength=n)
+
+    # Only branch points, leafs and nodes with values change the result ->
+    # collapse everything else
+    is_key = (n_childs != 1) | (res != identity).any(axis=1)
+    key_parent, _ = _jump_to(parents, is_key)
+    key_parent[~is_key] = -1
+    _, depth = _jump_to(key_parent, np.zeros(n, dtype=bool))
+    depth[~is_key | (key_parent < 0)] = -1
+
+    # Bottom-up: all key childs of a node are one level deeper
+    for this in _group_by_depth(depth):
+        ufunc.at(res, key_parent[this], res[this])
+
+    # Collapsed nodes get the value of the next key node distal to them
+    child = np.full(n, -1, dtype=int)
+    child[parents[has_parent]] = np.where(has_parent)[0]
+    child[is_key] = -1
+    head, _ = _jump_to(child, is_key)
+    res[~is_key] = res[head[~is_key]]
+
+    return res.reshape(values.shape)
+
+
+def _concat_parents(x):
+    """Concatenate parent indices of multiple neurons.
+
+    Parameters
+    ----------
+    x :         CatmaidNeuronList | list of CatmaidNeuron
+
+    Returns
+    -------
+    parents :   numpy.ndarray
+                Parent index for each node (see
+                :func:`~pymaid.graph_utils._parent_index`) with each neuron
+                being a separate tree.
+    offsets :   numpy.ndarray
+                ``(N_neurons + 1, )`` array such that the nodes of the i-th
+                neuron are ``offsets[i]:offsets[i + 1]``.
+
+    """
+    parents = [_parent_index(n) for n in x]
+    offsets = np.cumsum([0] + [p.shape[0] for p in parents])
+    parents = [np.where(p >= 0, p + o, -1) for p, o in zip(parents, offsets)]
+
+    return np.concatenate(parents + [[]]).astype(int), offsets.astype(int)
+
+
+def _segment_array(parents):
+    """Break tree(s) into linear segments as flat array plus offsets.
+
+    Segments are the same as in ``CatmaidNeuron.small_segments``: each starts
+    at a leaf or branch point and runs proximally up to (and including) the
+    next branch point or root.
+
+    Parameters
+    ----------
+    parents :   numpy.ndarray
+                Parent index for each node, ``-1`` for roots. See
+                :func:`~pymaid.graph_utils._parent_index`. May contain
+                multiple trees.
+
+    Returns
+    -------
+    nodes :     numpy.ndarray
+                Row indices of nodes in segment order.
+    offsets :   numpy.ndarray
+                ``(N_segments + 1, )`` array such that
+                ``nodes[offsets[i]:offsets[i + 1]]`` is the i-th segment.
+
+    """
+    n = parents.shape[0]
+    has_parent = parents >= 0
+    n_childs = np.bincount(parents[has_parent], minlength=n)
+
+    is_stop = (n_childs > 1) | ~has_parent
+    is_head = (n_childs != 1) & has_parent
+    is_inner = (n_childs == 1) & has_parent
+
+    # Each inner node belongs to the segment of the next head distal to it
+    child = np.full(n, -1, dtype=int)
+    child[parents[has_parent]] = np.where(has_parent)[0]
+    child[n_childs != 1] = -1
+    head, pos = _jump_to(child, n_childs != 1)
+
+    # Each segment ends at the next branch point or root proximal to its head
+    stop, length = _jump_to(parents, is_stop)
+
+    heads = np.where(is_head)[0]
+    inner = np.where(is_inner)[0]
+
+    seg = np.concatenate([heads, head[inner], heads])
+    pos = np.concatenate([np.zeros(len(heads), dtype=int), pos[inner],
+                          length[heads]])
+    nodes = np.concatenate([heads, inner, stop[heads]])
+
+    srt = np.lexsort((pos, seg))
+    nodes, seg = nodes[srt], seg[srt]
+
+    offsets = np.concatenate([[0], np.where(np.diff(seg) != 0)[0] + 1,
+                              [len(seg)]]) if len(seg) else np.zeros(1, int)
+
+    return nodes, offsets.astype(int)
+
+
+def _long_segment_array(parents):
+    """Break tree(s) into segments maximizing segment length.
+
+    Same segments and order as ``CatmaidNeuron.segments`` (see
+    :func:`~pymaid.graph_utils._generate_segments`): starting from the leaf
+    furthest from the root (in number of nodes), each leaf's segment runs
+    proximally until it hits a node that belongs to a previous segment.
+
+    Parameters
+    ----------
+    parents :   numpy.ndarray
+                Parent index for each node, ``-1`` for roots. See
+                :func:`~pymaid.graph_utils._parent_index`. May contain
+                multiple trees.
+
+    Returns
+    -------
+    nodes :     numpy.ndarray
+                Row indices of nodes in segment order.
+    offsets :   numpy.ndarray
+                ``(N_segments + 1, )`` array such that
+                ``nodes[offsets[i]:offsets[i + 1]]`` is the i-th segment.
+
+    """
+    n = parents.shape[0]
+    has_parent = parents >= 0
+    n_childs = np.bincount(parents[has_parent], minlength=n)
+    _, depth = _jump_to(parents, np.zeros(n, dtype=bool))
+
+    # Leafs are walked in order of decreasing depth
+    leafs = np.where((n_childs == 0) & has_parent)[0]
+    leafs = leafs[np.lexsort((leafs, -depth[leafs]))]
+    rank = np.full(n, np.inf)
+    rank[leafs] = np.arange(leafs.shape[0])
+
+    # Each node belongs to the segment of the first leaf distal to it
+    owner = _subtree_reduce(parents, rank, np.minimum, np.inf)
+    has_owner = np.isfinite(owner)
+    owner = np.where(has_owner, owner, -1).astype(int)
+
+    # Segments end with the first node that belongs to another segment
+    is_top = has_owner & (~has_parent
+                          | (owner[np.maximum(parents, 0)] != owner))
+    stops = np.where(is_top & has_parent)[0]
+
+    own = np.where(has_owner)[0]
+    seg = np.concatenate([owner[own], owner[stops]])
+    nodes = np.concatenate([own, parents[stops]])
+    leaf_depth = depth[leafs[seg]]
+    pos = leaf_depth - depth[nodes]
+
+    # Sort segments by length, then by walk order
+    size = np.bincount(seg, minlength=leafs.shape[0])
+    srt = np.lexsort((pos, seg, -size[seg]))
+    nodes, seg = nodes[srt], seg[srt]
+
+    offsets = np.concatenate([[0], np.where(np.diff(seg) != 0)[0] + 1,
+                              [len(seg)]]) if len(seg) else np.zeros(1, int)
+
+    return nodes, offsets.astype(int)
+
+
 def classify_nodes(x, inplace=True):
     """Classify neuron's treenodes into end nodes, branches, slabs or root.
 
@@ -252,31 +683,17 @@ def classify_nodes(x, inplace=True):
     elif isinstance(x, (pd.Series, core.CatmaidNeuron)):
         # Make sure there are nodes to classify
         if x.nodes.shape[0] != 0:
-            if config.use_igraph and x.igraph:
-                # Get graph representation of neuron
-                vs = x.igraph.vs
-                # Get branch/end nodes based on their degree of connectivity
-                ends = vs.select(_indegree=0).get_attribute_values('node_id')
-                branches = vs.select(
-                    _indegree_gt=1).get_attribute_values('node_id')
-            else:
-                # Get graph representation of neuron
-                g = x.graph
-                # Get branch/end nodes based on their degree of connectivity
-                deg = pd.DataFrame.from_dict(dict(g.degree()), orient='index')
-                # [ n for n in g.nodes if g.degree(n) == 1 ]
-                ends = deg[deg.iloc[:, 0] == 1].index.values
-                # [ n for n in g.nodes if g.degree(n) > 2 ]
-                branches = deg[deg.iloc[:, 0] > 2].index.values
-
-            if 'type' not in x.nodes:
-                x.nodes['type'] = 'slab'
-            else:
-                x.nodes.loc[:, 'type'] = 'slab'
-
-            x.nodes.loc[x.nodes.treenode_id.isin(ends), 'type'] = 'end'
-            x.nodes.loc[x.nodes.treenode_id.isin(branches), 'type'] = 'branch'
-            x.nodes.loc[x.nodes.parent_id.isnull(), 'type'] = 'root'
+            # Get branch/end nodes based on their number of childs
+            parents = _parent_index(x.nodes)
+            n_childs = np.bincount(parents[parents >= 0],
+                                   minlength=parents.shape[0])
+
+            types = np.full(parents.shape[0], 'slab', dtype=object)
+            types[n_childs == 0] = 'end'
+            types[n_childs > 1] = 'branch'
+            types[x.nodes.parent_id.isnull().values] = 'root'
+
+            x.nodes['type'] = types
     else:
         raise TypeError('Unknown neuron type "%s"' % str(type(x)))
 
@@ -19,14 +19,19 @@
 """
 
 import math
-import itertools
+import multiprocessing as mp
+import os
+
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import numpy as np
 import scipy.spatial.distance
 import networkx as nx
 
-from . import fetch, core, graph_utils, graph, utils, config, resample
+from scipy.sparse import csgraph, csr_matrix
+
+from . import fetch, core, graph_utils, utils, config, cache
 
 # Set up logging
 logger = config.logger
@@ -38,7 +43,7 @@ __all__ = sorted(['calc_cable', 'strahler_index', 'prune_by_strahler',
                   'remove_tagged_branches', 'despike_neuron', 'guess_radius',
                   'smooth_neuron', 'time_machine', 'heal_fragmented_neuron',
                   'break_fragments', 'union_neurons', 'prune_twigs',
-                  'prune_by_length'])
+                  'prune_by_length', 'morphometrics'])
 
 
 def arbor_confidence(x, confidences=(1, 0.9, 0.6, 0.4, 0.2), inplace=True):
@@ -64,48 +69,33 @@ def arbor_confidence(x, confidences=(1, 0.9, 0.6, 0.4, 0.2), inplace=True):
     Adds ``arbor_confidence`` column in ``neuron.nodes``.
 
     """
-    def walk_to_leafs(this_node, this_confidence=1):
-        pbar.update(1)
-        while True:
-            this_confidence *= confidences[5 - nodes.loc[this_node].confidence]
-            nodes.loc[this_node, 'arbor_confidence'] = this_confidence
-
-            if len(loc[this_node]) > 1:
-                for c in loc[this_node]:
-                    walk_to_leafs(c, this_confidence)
-                break
-            elif len(loc[this_node]) == 0:
-                break
-
-            this_node = loc[this_node][0]
-
     if not isinstance(x, (core.CatmaidNeuron, core.CatmaidNeuronList)):
         raise TypeError('Unable to process data of type %s' % str(type(x)))
 
-    if isinstance(x, core.CatmaidNeuronList):
-        if not inplace:
-            res = [arbor_confidence(n,
-                                    confidences=confidences,
-                                    inplace=inplace) for n in x]
-        else:
-            return core.CatmaidNeuronList([arbor_confidence(n, confidence=confidence, inplace=inplace) for n in x])
+    if len(confidences) != 5:
+        raise ValueError('Need exactly five confidences, got '
+                         '{}'.format(len(confidences)))
 
     if not inplace:
         x = x.copy()
 
-    loc = graph_utils.generate_list_of_childs(x)
-
-    x.nodes['arbor_confidence'] = [None] * x.nodes.shape[0]
+    neurons = x if isinstance(x, core.CatmaidNeuronList) else [x]
 
-    nodes = x.nodes.set_index('treenode_id')
-    nodes.loc[x.root, 'arbor_confidence'] = 1
+    # Process all neurons in one go
+    parents, offsets = graph_utils._concat_parents(neurons)
+    conf = np.concatenate([n.nodes.confidence.values.astype(int)
+                           for n in neurons] + [np.zeros(0, dtype=int)])
 
-    with config.tqdm(total=len(x.segments), desc='Calc confidence', disable=config.pbar_hide, leave=config.pbar_leave) as pbar:
-        for r in x.root:
-            for c in loc[r]:
-                walk_to_leafs(c)
+    # Each edge reduces the confidence of everything downstream of it ->
+    # confidence is the cumulative product of factors along the path to
+    # the root, i.e. a cumulative sum in log space
+    factors = np.asarray(confidences, dtype=float)[5 - np.clip(conf, 1, 5)]
+    with np.errstate(divide='ignore'):
+        log_conf = graph_utils._dist_to_root(parents, np.log(factors))
+    arbor_conf = np.exp(log_conf)
 
-    x.nodes['arbor_confidence'] = nodes['arbor_confidence'].values
+    for i, n in enumerate(neurons):
+        n.nodes['arbor_confidence'] = arbor_conf[offsets[i]:offsets[i + 1]]
 
     if not inplace:
         return x
@@ -235,35 +225,43 @@ def calc_cable(skdata, remote_instance=None, return_skdata=False):
     return np.sum(w[np.logical_not(np.isnan(w))]) / 1000
 
 
-def to_dotprops(x):
+@cache.memoize('value')
+def to_dotprops(x, k=None):
     """Convert neuron to point clouds with tangent vectors (but no connectivity).
 
-    Dotprops consist of a point and a vector. This works by (1) finding the
-    center between child->parent treenodes and (2) getting the vector between
-    them. Also returns the length of the vector.
+    Dotprops consist of points and (unit) tangent vectors. By default, this
+    works by (1) finding the center between child->parent treenodes and (2)
+    getting the vector between them. Alternatively, tangent vectors can be
+    calculated from the ``k`` nearest neighbours of each treenode (like in
+    R's nat).
 
     Parameters
     ----------
-    x :         CatmaidNeuron
-                Single neuron
+    x :         CatmaidNeuron | CatmaidNeuronList
+                Neuron(s) to generate dotprops for.
+    k :         int, optional
+                If provided, will use treenodes as points and generate
+                tangent vectors and alpha values from the first principal
+                component of each node's ``k`` nearest neighbours.
 
     Returns
     -------
-    pandas.DataFrame
-            DataFrame in which each row represents a segments between two
-            treenodes::
-
-                point  vector  vec_length
-             1
-             2
-             3
+    :class:`~pymaid.CatmaidDotprops`
+            For single neurons. Points, vectors and (if ``k`` is not
+            ``None``) alpha values are stored as float32 arrays. If
+            ``k=None``, the length of each child->parent vector is
+            available as ``.vec_length``.
+    list of :class:`~pymaid.CatmaidDotprops`
+            For CatmaidNeuronLists.
 
     Examples
     --------
     >>> x = pymaid.get_neurons(16)
     >>> dps = pymaid.to_dotprops(x)
     >>> # Get array of all locations
-    >>> locs = numpy.vstack(dps.point.values)
+    >>> locs = dps.points
+    >>> # Dotprops cache their KD-tree
+    >>> dist, ix = dps.kdtree.query(locs, k=2)
 
     See Also
     --------
@@ -275,31 +273,89 @@ def to_dotprops(x):
         if x.shape[0] == 1:
             x = x[0]
         else:
-            raise ValueError('Please pass only single CatmaidNeurons')
+            return _make_dotprops(x, k=k)
 
     if not isinstance(x, core.CatmaidNeuron):
         raise ValueError('Can only process CatmaidNeurons')
 
-    # First, get a list of child -> parent locs (exclude root node!)
-    tn_locs = x.nodes[~x.nodes.parent_id.isnull()][['x', 'y', 'z']].values
-    pn_locs = x.nodes.set_index('treenode_id').loc[x.nodes[~x.nodes.parent_id.isnull(
-    )].parent_id][['x', 'y', 'z']].values
+    return _make_dotprops([x], k=k)[0]
 
-    # Get centers between each pair of locs
-    centers = tn_locs + (pn_locs - tn_locs) / 2
 
-    # Get vector between points
-    vec = pn_locs - tn_locs
+def _make_dotprops(x, k=None):
+    """Generate dotprops for a list of neurons.
 
-    dps = pd.DataFrame([[c, v] for c, v in zip(centers, vec)],
-                       columns=['point', 'vector'])
+    Eigen decompositions for tangent vectors are done for all neurons in one
+    go.
 
-    # Add length of vector (for convenience)
-    dps['vec_length'] = (dps.vector ** 2).apply(sum).apply(math.sqrt)
+    """
+    if k and k < 2:
+        raise ValueError('Need at least 2 nearest neighbours, got '
+                         '{}'.format(k))
+
+    points, vect, alpha, lengths = [], [], [], []
+    covs = []
+    for n in config.tqdm(x, desc='Dotprops',
+                         disable=config.pbar_hide or len(x) <= 1,
+                         leave=config.pbar_leave):
+        locs = n.nodes[['x', 'y', 'z']].values.astype(np.float64)
+
+        if k:
+            if not locs.shape[0]:
+                covs.append(np.zeros((0, 3, 3)))
+                points.append(locs)
+                continue
+
+            # Get k nearest neighbours for each treenode
+            this_k = min(k, locs.shape[0])
+            tree = scipy.spatial.cKDTree(locs)
+            _, ix = tree.query(locs, k=this_k)
+            nb = locs[ix.reshape(locs.shape[0], -1)]
+
+            # Covariance of each neighbourhood
+            nb = nb - nb.mean(axis=1, keepdims=True)
+            covs.append(np.matmul(nb.transpose(0, 2, 1), nb) / this_k)
+            points.append(locs)
+        else:
+            parents = graph_utils._parent_index(n)
+            childs = np.where(parents >= 0)[0]
+
+            # Get vector between child -> parent
+            vec = locs[parents[childs]] - locs[childs]
+            le = np.sqrt((vec ** 2).sum(axis=1))
+
+            # Get centers between each pair of locs
+            points.append(locs[childs] + vec / 2)
+            vect.append(vec / np.where(le > 0, le, 1)[:, None])
+            lengths.append(le)
+
+    if k:
+        # One eigen decomposition for all neighbourhoods of all neurons
+        evals, evecs = np.linalg.eigh(np.concatenate(covs))
+
+        # Eigenvalues are in ascending order -> last one is first PC
+        all_vect = evecs[:, :, 2]
+        total = evals.sum(axis=1)
+        all_alpha = np.where(total > 0,
+                             (evals[:, 2] - evals[:, 1]) / np.where(total > 0, total, 1),
+                             0)
+
+        offsets = np.cumsum([0] + [len(p) for p in points])
+        vect = [all_vect[s:e] for s, e in zip(offsets[:-1], offsets[1:])]
+        alpha = [all_alpha[s:e] for s, e in zip(offsets[:-1], offsets[1:])]
+        lengths = [None] * len(points)
+    else:
+        alpha = [None] * len(points)
 
-    return dps
+    return [core.CatmaidDotprops(p, v,
+                                 alpha=a,
+                                 vec_length=le,
+                                 k=k,
+                                 skeleton_id=n.skeleton_id,
+                                 neuron_name=n.__dict__.get('neuron_name', None))
+            for p, v, a, le, n in zip(points, vect, alpha, lengths, x)]
 
 
+@cache.memoize('nodes', columns=['strahler_index'])
 def strahler_index(x, inplace=True, method='standard', fix_not_a_branch=False,
                    min_twig_size=None):
     """Calculate Strahler Index (SI).
@@ -333,166 +389,168 @@ def strahler_index(x, inplace=True, method='standard', fix_not_a_branch=False,
 
     Returns
     -------
-    if ``inplace=False``
+    if ``inplace=True``
                         Returns nothing but adds new column ``strahler_index``
                         to neuron.nodes.
-    if ``inplace=True``
+    if ``inplace=False``
                         Returns copy of original neuron with new column
                         ``strahler_index``.
 
+    Notes
+    -----
+    Runs in linear time: Strahler indices are propagated from leafs to root
+    along an array of parent indices. For CatmaidNeuronLists, all neurons
+    are processed in a single pass.
+
     """
     if isinstance(x, core.CatmaidNeuronList):
         if x.shape[0] == 1:
             x = x[0]
         else:
-            res = []
-            for n in config.tqdm(x):
-                res.append(strahler_index(n,
-                                          inplace=inplace,
-                                          method=method,
-                                          fix_not_a_branch=fix_not_a_branch,
-                                          min_twig_size=min_twig_size))
+            if not inplace:
+                x = x.copy()
+
+            # Process all neurons in one go: concatenate the parent arrays
+            # and offset indices so that each neuron is a separate tree
+            parents, ignore, offset = [], [], 0
+            for n in x:
+                p = graph_utils._parent_index(n)
+                p[p >= 0] += offset
+                parents.append(p)
+                ignore.append(_nab_leafs(n, fix_not_a_branch))
+                offset += p.shape[0]
+
+            SI = _strahler_from_parents(np.concatenate(parents),
+                                        method=method,
+                                        ignore=np.concatenate(ignore),
+                                        min_twig_size=min_twig_size)
+
+            offset = 0
+            for n in x:
+                n.nodes['strahler_index'] = SI[offset: offset + n.nodes.shape[0]]
+                offset += n.nodes.shape[0]
 
             if not inplace:
-                return core.CatmaidNeuronList(res)
+                return x
             else:
                 return
 
     if not inplace:
         x = x.copy()
 
-    # Find branch, root and end nodes
-    if 'type' not in x.nodes:
-        graph_utils.classify_nodes(x)
+    x.nodes['strahler_index'] = _strahler_from_parents(graph_utils._parent_index(x),
+                                                       method=method,
+                                                       ignore=_nab_leafs(x, fix_not_a_branch),
+                                                       min_twig_size=min_twig_size)
 
-    end_nodes = x.nodes[x.nodes.type == 'end'].treenode_id.values
-    branch_nodes = x.nodes[x.nodes.type == 'branch'].treenode_id.values
-    root = x.nodes[x.nodes.type == 'root'].treenode_id.values
+    if not inplace:
+        return x
 
-    end_nodes = set(end_nodes)
-    branch_nodes = set(branch_nodes)
-    root = set(root)
 
-    # These are branches that we will ignore for SI calculation and instead be
-    # given the SI of their parent branch
-    nab_branch = []
+def _nab_leafs(x, fix_not_a_branch):
+    """Return boolean mask for leaf nodes tagged with "not a branch"."""
     if fix_not_a_branch and 'not a branch' in x.tags:
-        nab_branch += x.tags['not a branch']
-    if min_twig_size:
-        nab_branch += [seg[0] for seg in x.small_segments if seg[0]
-                       in end_nodes and len(seg) < min_twig_size]
-
-    # Generate dicts for childs and parents
-    list_of_childs = graph_utils.generate_list_of_childs(x)
-
-    # Reindex according to treenode_id
-    this_tn = x.nodes.set_index('treenode_id')
-
-    # Do NOT name anything strahler_index - this overwrites the function!
-    SI = {}
-
-    starting_points = end_nodes
-
-    nodes_processed = []
-
-    while starting_points:
-        logger.debug('New starting point. Remaining: '
-                     '{}'.format(len(starting_points)))
-        new_starting_points = []
-        starting_points_done = []
-
-        for i, this_node in enumerate(starting_points):
-            logger.debug('%i of %i ' % (i, len(starting_points)))
-
-            # Calculate index for this branch
-            previous_indices = []
-            for child in list_of_childs[this_node]:
-                if SI.get(child, None):
-                    previous_indices.append(SI[child])
-
-            # If this is a not-a-branch branch
-            if this_node in nab_branch:
-                this_branch_index = None
-            # If this is an end node: start at 1
-            elif len(previous_indices) == 0:
-                this_branch_index = 1
-            # If this is a slab: assign SI of predecessor
-            elif len(previous_indices) == 1:
-                this_branch_index = previous_indices[0]
-            # If this is a branch point at which similar indices collide: +1
-            elif previous_indices.count(max(previous_indices)) >= 2 or method == 'greedy':
-                this_branch_index = max(previous_indices) + 1
-            # If just a branch point: continue max SI
-            else:
-                this_branch_index = max(previous_indices)
+        return x.nodes.treenode_id.isin(x.tags['not a branch']).values
+    return np.zeros(x.nodes.shape[0], dtype=bool)
 
-            nodes_processed.append(this_node)
-            starting_points_done.append(this_node)
 
-            # Now walk down this spine
-            # Find parent
-            spine = [this_node]
+def _strahler_from_parents(parents, method='standard', ignore=None,
+                           min_twig_size=None):
+    """Calculate Strahler indices from an array of parent indices.
 
-            # parent_node = list_of_parents [ this_node ]
-            parent_node = this_tn.loc[this_node, 'parent_id']
+    Works on the tree of leafs and branch points: slabs are skipped via
+    pointer jumping and the SI is then calculated level by level, starting
+    with the most distal branch points.
 
-            while parent_node not in branch_nodes and parent_node is not None:
-                this_node = parent_node
-                parent_node = None
+    Parameters
+    ----------
+    parents :       numpy.ndarray
+                    Parent index for each node, ``-1`` for roots. See
+                    :func:`pymaid.graph_utils._parent_index`. May contain
+                    multiple trees.
+    method :        'standard' | 'greedy'
+    ignore :        numpy.ndarray of bool, optional
+                    Terminal twigs whose leafs are ``True`` will be ignored
+                    and instead get the SI of their parent branch.
+    min_twig_size : int, optional
+                    Terminal twigs with fewer nodes (including the branch
+                    point) will be ignored.
 
-                spine.append(this_node)
-                nodes_processed.append(this_node)
+    Returns
+    -------
+    numpy.ndarray
+                    Strahler index for each node.
 
-                # Find next parent
-                try:
-                    parent_node = this_tn.loc[this_node, 'parent_id']
-                except BaseException:
-                    # Will fail if at root (no parent)
-                    break
+    """
+    if method not in ['standard', 'greedy']:
+        raise ValueError('Unknown method "{}"'.format(method))
 
-            SI.update({n: this_branch_index for n in spine})
+    n = parents.shape[0]
+    if not n:
+        return np.zeros(0, dtype=int)
 
-            # The last this_node is either a branch node or the root
-            # If a branch point: check, if all its childs have already been
-            # processed
-            if parent_node is not None:
-                node_ready = True
-                for child in list_of_childs[parent_node]:
-                    if child not in nodes_processed:
-                        node_ready = False
+    has_parent = parents >= 0
+    n_childs = np.bincount(parents[has_parent], minlength=n)
 
-                if node_ready is True and parent_node is not None:
-                    new_starting_points.append(parent_node)
+    # Key nodes are leafs and branch points: only there can the SI change
+    is_key = n_childs != 1
+    is_leaf = n_childs == 0
 
-        # Remove those starting_points that were successfully processed in this
-        # run before the next iteration
-        for node in starting_points_done:
-            starting_points.remove(node)
+    # Find the next key node (branch point) proximal to each node
+    key_parent, hops = graph_utils._jump_to(parents, is_key)
 
-        # Add new starting points
-        starting_points = starting_points | set(new_starting_points)
+    # Terminal twigs to ignore: must be attached to a branch point
+    skip = is_leaf & (key_parent >= 0)
+    to_ignore = np.zeros(n, dtype=bool)
+    if not isinstance(ignore, type(None)):
+        to_ignore |= ignore
+    if min_twig_size:
+        # Number of nodes in the twig including the branch point
+        to_ignore |= (hops + 1) < min_twig_size
+    skip &= to_ignore
+
+    # Depth of each key node in the tree of key nodes
+    kp = np.where(is_key, key_parent, -1)
+    _, depth = graph_utils._jump_to(kp, np.zeros(n, dtype=bool))
+    depth[~is_key] = -1
+
+    SI = np.zeros(n, dtype=int)
+    max_child = np.zeros(n, dtype=int)    # highest SI of incoming branches
+    n_max = np.zeros(n, dtype=int)        # number of branches with that SI
+    n_contrib = np.zeros(n, dtype=int)    # number of contributing branches
+
+    # All key childs of a key node are at the same depth -> by the time we
+    # get to a node, all its incoming branches have been processed
+    for this in graph_utils._group_by_depth(depth):
+        mx = max_child[this]
+        this_si = np.where(mx > 0, mx, 1)
+        if method == 'greedy':
+            this_si[n_contrib[this] >= 2] += 1
+        else:
+            this_si[n_max[this] >= 2] += 1
+        SI[this] = this_si
 
-    # Disconnected single nodes (e.g. after pruning) will end up w/o an entry
-    # --> we will give them an SI of 1
-    x.nodes['strahler_index'] = [SI.get(n, 1)
-                                 for n in x.nodes.treenode_id.values]
+        # Propagate to parent branch points
+        contrib = this[(key_parent[this] >= 0) & ~skip[this]]
+        if not contrib.shape[0]:
+            continue
+        kp_contrib = key_parent[contrib]
+        np.maximum.at(max_child, kp_contrib, SI[contrib])
+        np.add.at(n_contrib, kp_contrib, 1)
+        np.add.at(n_max, kp_contrib,
+                  (SI[contrib] == max_child[kp_contrib]).astype(int))
 
-    # Fix not-a-branch branches -> give them the SI of their parent branch
-    if fix_not_a_branch and 'not a branch' in x.tags:
-        this_tn = x.nodes.set_index('treenode_id')
-        # Go over all terminal branches with the tag
-        cond1 = (x.nodes.type == 'end')
-        cond2 = (x.nodes.treenode_id.isin(x.tags['not a branch']))
-        for tn in x.nodes[cond1 & cond2].treenode_id.values:
-            # Get this terminal segment
-            this_seg = [s for s in x.small_segments if s[0] == tn][0]
-            # Get strahler index of parent branch
-            new_SI = this_tn.loc[this_seg[-1]].strahler_index
-            # Set these nodes strahler index to that of the last branch point
-            x.nodes.loc[x.nodes.treenode_id.isin(this_seg), 'strahler_index'] = new_SI
+    # Ignored twigs get the SI of their parent branch point
+    SI[skip] = SI[key_parent[skip]]
 
-    if not inplace:
-        return x
+    # Slabs get the SI of the next key node distal to them
+    child = np.full(n, -1, dtype=int)
+    child[parents[has_parent]] = np.where(has_parent)[0]
+    child[is_key] = -1
+    head, _ = graph_utils._jump_to(child, is_key)
+    SI[~is_key] = SI[head[~is_key]]
+
+    return SI
 
 
 def prune_by_strahler(x, to_prune, reroot_soma=True, inplace=False,
@@ -572,26 +630,24 @@ def prune_by_strahler(x, to_prune, reroot_soma=True, inplace=False,
         SI_range = range(1, neuron.nodes.strahler_index.max() + 1)
         to_prune = list(SI_range)[to_prune]
 
-    # Prepare parent dict if needed later
+    keep = ~neuron.nodes.strahler_index.isin(to_prune).values
+
     if relocate_connectors:
-        parent_dict = {
-            tn.treenode_id: tn.parent_id for tn in neuron.nodes.itertuples()}
+        # Find the closest remaining treenode proximal to each removed node
+        new_tn, _ = graph_utils._jump_to(graph_utils._parent_index(neuron),
+                                         keep)
+        tn_ids = neuron.nodes.treenode_id.values
+        new_tn = pd.Series(np.where(new_tn >= 0, tn_ids[new_tn], -1),
+                           index=tn_ids)[~keep]
 
-    neuron.nodes = neuron.nodes[
-        ~neuron.nodes.strahler_index.isin(to_prune)].reset_index(drop=True)
+        to_move = neuron.connectors.treenode_id.isin(new_tn.index).values
+        neuron.connectors.loc[to_move, 'treenode_id'] = new_tn.loc[neuron.connectors.treenode_id.values[to_move]].values
 
-    if not relocate_connectors:
-        neuron.connectors = neuron.connectors[neuron.connectors.treenode_id.isin(
-            neuron.nodes.treenode_id.values)].reset_index(drop=True)
-    else:
-        remaining_tns = set(neuron.nodes.treenode_id.values)
-        for cn in neuron.connectors[~neuron.connectors.treenode_id.isin(neuron.nodes.treenode_id.values)].itertuples():
-            this_tn = parent_dict[cn.treenode_id]
-            while True:
-                if this_tn in remaining_tns:
-                    break
-                this_tn = parent_dict[this_tn]
-            neuron.connectors.loc[cn.Index, 'treenode_id'] = this_tn
+    neuron.nodes = neuron.nodes[keep].reset_index(drop=True)
+
+    # Drop connectors without a remaining treenode
+    neuron.connectors = neuron.connectors[neuron.connectors.treenode_id.isin(
+        neuron.nodes.treenode_id.values)].reset_index(drop=True)
 
     # Reset indices of node and connector tables (important for igraph!)
     neuron.nodes.reset_index(inplace=True, drop=True)
@@ -612,7 +668,8 @@ def prune_by_strahler(x, to_prune, reroot_soma=True, inplace=False,
 
 
 def split_axon_dendrite(x, method='bending', primary_neurite=True,
-                        reroot_soma=True, return_point=False):
+                        reroot_soma=True, return_point=False,
+                        label_only=False):
     """Split a neuron into axon, dendrite and primary neurite.
 
     The result is highly dependent on the method and on your neuron's
@@ -641,11 +698,26 @@ def split_axon_dendrite(x, method='bending', primary_neurite=True,
     return_point :      bool, optional
                         If True, will only return treenode ID of the node at
                         which to split the neuron.
+    label_only :        bool, optional
+                        If True, will not split the neuron but instead return
+                        a compartment label for each node. Neurons are only
+                        virtually rerooted (i.e. are left untouched) and
+                        CatmaidNeuronLists are processed in a single batch -
+                        in parallel if ``x._use_parallel`` is True.
 
     Returns
     -------
     CatmaidNeuronList
                         Axon, dendrite and primary neurite.
+    numpy.ndarray | list of numpy.ndarray
+                        If ``label_only=True``: one label per node (same
+                        order as ``x.nodes``): ``'axon'``, ``'dendrite'``,
+                        ``'primary_neurite'`` or ``'linker'``. The linker is
+                        the stretch of cable with maximum flow distal to the
+                        split point and hence only exists for flow centrality
+                        methods. Nodes of neurons that can not be split are
+                        labelled ``None``. List of arrays if ``x`` is a
+                        CatmaidNeuronList.
 
     Examples
     --------
@@ -661,11 +733,42 @@ def split_axon_dendrite(x, method='bending', primary_neurite=True,
     >>> # For convenience, split_axon_dendrite assigns colors to the resulting
     >>> # fragments: axon = red, dendrites = blue, primary neurite = green
     >>> split.plot3d(color=split.color)
+    >>> # Label nodes of many neurons without splitting them
+    >>> nl = pymaid.get_neuron('annotation:glomerulus DA1')
+    >>> labels = pymaid.split_axon_dendrite(nl, label_only=True)
+    >>> nl[0].nodes['compartment'] = labels[0]
 
     """
+    if label_only:
+        if method not in ['centrifugal', 'centripetal', 'sum', 'bending']:
+            raise ValueError('Unknown parameter for mode: {0}'.format(method))
+
+        if not isinstance(x, (core.CatmaidNeuron, core.CatmaidNeuronList)):
+            raise TypeError('Can only process CatmaidNeuron/List, '
+                            'got "{}"'.format(type(x)))
+
+        labels = _split_batch(x, method=method,
+                              primary_neurite=primary_neurite,
+                              reroot_soma=reroot_soma, ret='labels')
+
+        return labels[0] if isinstance(x, core.CatmaidNeuron) else labels
+
     if isinstance(x, core.CatmaidNeuronList) and len(x) == 1:
         x = x[0]
     elif isinstance(x, core.CatmaidNeuronList):
+        if reroot_soma:
+            for n in x:
+                if n.soma and n.soma not in n.root:
+                    n.reroot(n.soma)
+
+        # Calculate flow centrality for all neurons in one go
+        to_calc = core.CatmaidNeuronList([n for n in x if getattr(n, 'centrality_method', None) != method])
+        if to_calc:
+            if method == 'bending':
+                bending_flow(to_calc)
+            elif method in ['centripetal', 'centrifugal', 'sum']:
+                flow_centrality(to_calc, mode=method)
+
         nl = []
         for n in config.tqdm(x, desc='Splitting', disable=config.pbar_hide,
                              leave=config.pbar_leave):
@@ -781,6 +884,317 @@ def split_axon_dendrite(x, method='bending', primary_neurite=True,
         return core.CatmaidNeuronList([axon, dendrite])
 
 
+def _split_data(x, reroot_soma=True):
+    """Collect the data needed by :func:`~pymaid.morpho._split_helper`.
+
+    Only passing on what we actually need means less to pickle.
+
+    """
+    soma = None
+    if reroot_soma and x.soma:
+        soma = utils._make_iterable(x.soma)[0]
+        soma = int(np.where(x.nodes.treenode_id.values == soma)[0][0])
+
+    return {'nodes': x.nodes[['treenode_id', 'parent_id', 'x', 'y', 'z']],
+            'soma': soma,
+            'cn_treenode': x.connectors.treenode_id.values,
+            'relation': x.connectors.relation.values}
+
+
+def _split_batch(x, method='bending', primary_neurite=True, reroot_soma=True,
+                 ret='labels'):
+    """Run :func:`~pymaid.morpho._split_helper` over neuron(s).
+
+    CatmaidNeuronLists are distributed across ``x.n_cores`` processes if
+    ``x._use_parallel`` is True.
+
+    """
+    if isinstance(x, core.CatmaidNeuron):
+        x = core.CatmaidNeuronList(x)
+
+    data = [_split_data(n, reroot_soma=reroot_soma) for n in x]
+
+    if x._use_parallel and x.n_cores > 1 and len(data) > 1:
+        chunks = [data[c[0]:c[-1] + 1]
+                  for c in np.array_split(np.arange(len(data)),
+                                          min(x.n_cores, len(data)))]
+        with mp.Pool(x.n_cores) as pool:
+            res = list(config.tqdm(pool.imap(_split_helper,
+                                             [(c, method, primary_neurite, ret)
+                                              for c in chunks]),
+                                   total=len(chunks),
+                                   desc='Splitting',
+                                   disable=config.pbar_hide,
+                                   leave=config.pbar_leave))
+        if ret == 'labels':
+            return [l for r in res for l in r]
+        return np.concatenate(res)
+
+    return _split_helper((data, method, primary_neurite, ret))
+
+
+def _split_helper(args):
+    """Find axon/dendrite split for a batch of neurons.
+
+    Works on the concatenated parent indices of all neurons. Neurons are
+    rerooted to their soma only virtually. Follows the logic of
+    :func:`~pymaid.split_axon_dendrite`.
+
+    Parameters
+    ----------
+    args :      tuple
+                ``(data, method, primary_neurite, ret)``. ``data`` is a list
+                of dicts as returned by
+                :func:`~pymaid.morpho._split_data`. ``ret`` can be
+                ``'labels'`` for per-node compartment labels or
+                ``'segregation'`` for the segregation index (see
+                :func:`~pymaid.segregation_index`). Packed into a single
+                argument for use with ``multiprocessing.Pool.imap``.
+
+    Returns
+    -------
+    list of numpy.ndarray
+                Labels for each neuron if ``ret='labels'``.
+    numpy.ndarray
+                Segregation index for each neuron if ``ret='segregation'``.
+
+    """
+    data, method, primary_neurite, ret = args
+    n_neurons = len(data)
+
+    parents, offsets = graph_utils._concat_parents([d['nodes'] for d in data])
+    locs = np.concatenate([d['nodes'][['x', 'y', 'z']].values.astype(float)
+                           for d in data] + [np.zeros((0, 3))])
+    neuron_ix = np.repeat(np.arange(n_neurons), np.diff(offsets))
+    n = parents.shape[0]
+
+    # Virtually reroot to soma by reversing the edges between soma and root
+    soma = np.array([d['soma'] + offsets[i] for i, d in enumerate(data)
+                     if d['soma'] is not None], dtype=int)
+    rerooted = parents.copy()
+    this = soma
+    while this.shape[0]:
+        nxt = parents[this]
+        this = this[nxt >= 0]
+        nxt = nxt[nxt >= 0]
+        rerooted[nxt] = this
+        this = nxt
+    rerooted[soma] = -1
+    parents, orig_parents = rerooted, parents
+
+    # Number of connectors (pre, post, any) per node
+    n_cn = np.zeros((n, 3))
+    for i, d in enumerate(data):
+        rows = pd.Index(d['nodes'].treenode_id.values)
+        rows = rows.get_indexer(d['cn_treenode'])
+        rows, rel = rows[rows >= 0] + offsets[i], d['relation'][rows >= 0]
+        np.add.at(n_cn, (rows, np.zeros(rows.shape[0], dtype=int)), rel == 0)
+        np.add.at(n_cn, (rows, np.ones(rows.shape[0], dtype=int)), rel == 1)
+        np.add.at(n_cn, (rows, np.full(rows.shape[0], 2)), 1)
+    is_pre = (n_cn[:, 0] > 0).astype(float)
+    is_post = (n_cn[:, 1] > 0).astype(float)
+
+    has_parent = parents >= 0
+    childs = np.where(has_parent)[0]
+    n_childs = np.bincount(parents[childs], minlength=n)
+    is_branch = (n_childs > 1) & has_parent
+
+    # Flow centrality - see bending_flow() and flow_centrality()
+    distal = graph_utils._subtree_sums(parents, np.vstack([is_pre, is_post]).T)
+    distal_pre, distal_post = distal[:, 0], distal[:, 1]
+    if method == 'bending':
+        def child_sum(w):
+            return np.bincount(parents[childs], weights=w[childs], minlength=n)
+        raw = child_sum(distal_post) * child_sum(distal_pre) \
+            - child_sum(distal_pre * distal_post)
+        flow = np.where(n_childs > 1, raw, np.nan)
+    else:
+        total_pre = np.bincount(neuron_ix, weights=is_pre,
+                                minlength=n_neurons)[neuron_ix]
+        total_post = np.bincount(neuron_ix, weights=is_post,
+                                 minlength=n_neurons)[neuron_ix]
+        centrifugal = (total_post - distal_post) * distal_pre
+        centripetal = distal_post * (total_pre - distal_pre)
+        raw = {'centrifugal': centrifugal, 'centripetal': centripetal,
+               'sum': centrifugal + centripetal}[method]
+        flow = np.where(is_branch | (n_cn[:, 2] > 0), raw, np.nan)
+
+    # Split point is the node with the highest flow - if there are multiple,
+    # use the one closest to the root
+    flow_filled = np.where(np.isnan(flow), -np.inf, flow)
+    max_flow = np.full(n_neurons, -np.inf)
+    np.maximum.at(max_flow, neuron_ix, flow_filled)
+    cand = np.where(flow_filled == max_flow[neuron_ix])[0]
+    cand = cand[np.isfinite(flow_filled[cand])]
+    edge_length = np.zeros(n)
+    edge_length[childs] = np.linalg.norm(locs[childs] - locs[parents[childs]],
+                                         axis=1)
+    dist = graph_utils._dist_to_root(parents, edge_length)
+    cand = cand[np.lexsort((cand, dist[cand], neuron_ix[cand]))]
+    cut = np.full(n_neurons, -1, dtype=int)
+    u, first = np.unique(neuron_ix[cand], return_index=True)
+    cut[u] = cand[first]
+    has_cut = cut >= 0
+
+    if ret == 'segregation':
+        # Virtual split between the split point and one of its childs. This
+        # reproduces cutting a downsampled copy of the neuron (i.e. only
+        # roots, leafs, branch points and synapse-holding nodes) at the first
+        # child of the split point
+        keep = (n_childs != 1) | ~has_parent | (n_cn[:, 2] > 0)
+        next_kept, _ = graph_utils._jump_to(parents, keep)
+        cand = np.where(keep & (next_kept >= 0))[0]
+        cand = cand[next_kept[cand] == cut[neuron_ix[cand]]]
+        child = np.full(n_neurons, n, dtype=int)
+        np.minimum.at(child, neuron_ix[cand], cand)
+        child[child == n] = -1
+        is_mark = np.zeros(n, dtype=bool)
+        is_mark[child[child >= 0]] = True
+        anc, _ = graph_utils._jump_to(parents, is_mark)
+        anc[is_mark] = np.where(is_mark)[0]
+        is_distal = anc >= 0
+
+        # Cut node is present in both fragments
+        frag_cn = np.zeros((n_neurons, 2, 2))
+        for f, mask in enumerate([is_distal, ~is_distal]):
+            for c in range(2):
+                frag_cn[:, f, c] = np.bincount(neuron_ix[mask],
+                                               weights=n_cn[mask, [1, 2][c]],
+                                               minlength=n_neurons)
+        ok = child >= 0
+        frag_cn[ok, 1] += n_cn[child[ok]][:, [1, 2]]
+
+        H = _segregation(frag_cn[:, :, 0], frag_cn[:, :, 1])
+        return np.where(ok, H, np.nan)
+
+    # First child of each node: childs in order of the node table followed
+    # by the former parent of nodes that got rerooted (like in x.graph)
+    first_child = np.full(n, n, dtype=int)
+    not_flipped = childs[orig_parents[childs] == parents[childs]]
+    np.minimum.at(first_child, parents[not_flipped], not_flipped)
+    flipped = (first_child == n) & (n_childs > 0)
+    first_child[flipped] = orig_parents[flipped]
+    first_child[first_child == n] = -1
+
+    # Try cutting off the primary neurite: go from the split point towards
+    # the root and find the last branch point with flow
+    deg = n_childs + has_parent
+    do_pn = np.zeros(n_neurons, dtype=bool)
+    if primary_neurite:
+        do_pn[has_cut] = deg[cut[has_cut]] > 2
+    last = np.full(n_neurons, -1, dtype=int)
+    after = np.full(n_neurons, -1, dtype=int)
+    walk = np.where(do_pn)[0]
+    this = cut[walk]
+    while this.shape[0]:
+        br = is_branch[this]
+        with_flow = br & (np.nan_to_num(flow[this]) > 0)
+        last[walk[with_flow]] = this[with_flow]
+        after[walk[with_flow]] = -1
+        nxt_br = br & ~with_flow & (last[walk] >= 0) & (after[walk] < 0)
+        after[walk[nxt_br]] = this[nxt_br]
+
+        this = parents[this]
+        walk, this = walk[this >= 0], this[this >= 0]
+    do_pn &= last >= 0
+    to_cut = last
+    if method != 'bending':
+        to_cut = np.where(after >= 0, after, last)
+
+    # The distal cut has to be a child of the original cut node
+    distal_cut = cut.copy()
+    distal_cut[do_pn] = first_child[cut[do_pn]]
+
+    # Can't cut at the root
+    has_cut[has_cut] = has_parent[distal_cut[has_cut]]
+    do_pn &= has_cut
+
+    is_mark = np.zeros(n, dtype=bool)
+    is_mark[distal_cut[has_cut]] = True
+    is_mark[to_cut[do_pn]] = True
+    anc, _ = graph_utils._jump_to(parents, is_mark)
+    anc[is_mark] = np.where(is_mark)[0]
+
+    # Fragment A is distal to the (distal) cut, fragment B is the rest minus
+    # the primary neurite. Cut nodes are assigned to their distal fragment.
+    is_a = anc == distal_cut[neuron_ix]
+    is_pn = do_pn[neuron_ix] & (anc < 0)
+    is_b = has_cut[neuron_ix] & ~is_a & ~is_pn
+
+    # Figure out which one is which by comparing fraction of in- to outputs
+    # - note that the cut node counts towards both fragments
+    def frag_ratio(mask, extra=None):
+        pre = np.bincount(neuron_ix[mask], weights=n_cn[mask, 0],
+                          minlength=n_neurons).astype(float)
+        post = np.bincount(neuron_ix[mask], weights=n_cn[mask, 1],
+                           minlength=n_neurons).astype(float)
+        if not isinstance(extra, type(None)):
+            pre[has_cut] += n_cn[extra[has_cut], 0]
+            post[has_cut] += n_cn[extra[has_cut], 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(pre > 0, post / pre, np.inf)
+    a_is_dendrite = frag_ratio(is_a) > frag_ratio(is_b, extra=distal_cut)
+
+    labels = np.full(n, None, dtype=object)
+    labels[is_pn] = 'primary_neurite'
+    a_dend = a_is_dendrite[neuron_ix]
+    labels[is_a & a_dend] = 'dendrite'
+    labels[is_a & ~a_dend] = 'axon'
+    labels[is_b & a_dend] = 'axon'
+    labels[is_b & ~a_dend] = 'dendrite'
+
+    # Linker is the stretch of cable with maximum flow distal to the cut
+    if method != 'bending':
+        is_max = (raw == max_flow[neuron_ix]) & (max_flow[neuron_ix] > 0)
+        is_max &= has_cut[neuron_ix]
+        is_cut = np.zeros(n, dtype=bool)
+        is_cut[cut[has_cut]] = True
+        below, _ = graph_utils._jump_to(parents, is_cut)
+        below[is_cut] = np.where(is_cut)[0]
+        stretch, _ = graph_utils._jump_to(parents, ~is_max)
+        is_max &= below == cut[neuron_ix]
+        is_max &= stretch == parents[cut[neuron_ix]]
+        labels[is_max] = 'linker'
+
+    return [labels[offsets[i]:offsets[i + 1]] for i in range(n_neurons)]
+
+
+def _segregation(n_post, n_connectors):
+    """Calculate segregation index from per-fragment synapse counts.
+
+    Parameters
+    ----------
+    n_post :        numpy.ndarray
+                    ``(N, F)`` array with number of postsynapses in each
+                    of ``F`` fragments of ``N`` neurons.
+    n_connectors :  numpy.ndarray
+                    ``(N, F)`` array with number of connectors.
+
+    Returns
+    -------
+    numpy.ndarray
+                    ``(N, )`` array of segregation indices.
+
+    """
+    n_post = np.asarray(n_post, dtype=float)
+    n_connectors = np.asarray(n_connectors, dtype=float)
+
+    def entropy(p):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            S = - (p * np.log(p) + (1 - p) * np.log(1 - p))
+        return np.where((p > 0) & (p < 1), S, 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Calc entropy between fragments
+        S = np.sum(entropy(n_post / n_connectors) * n_connectors, axis=1)
+        S = S / n_connectors.sum(axis=1)
+
+        # Normalize to entropy in whole neuron
+        S_norm = entropy(n_post.sum(axis=1) / n_connectors.sum(axis=1))
+
+        return np.where(S_norm > 0, 1 - S / S_norm, 0)
+
+
 def segregation_index(x, centrality_method='centrifugal'):
     """ Calculates segregation index (SI).
 
@@ -829,50 +1243,19 @@ def segregation_index(x, centrality_method='centrifugal'):
         x = x[0]
 
     if not isinstance(x, core.CatmaidNeuronList):
-        # Get the branch point with highest flow centrality
-        split_point = split_axon_dendrite(x,
-                                          reroot_soma=True, return_point=True)
-
-        # Now make a virtual split (downsampled neuron to speed things up)
-        temp = x.copy()
-        temp.downsample(10000)
-
-        # Get one of its children
-        child = temp.nodes[temp.nodes.parent_id == split_point].treenode_id.values[0]
+        # Make a virtual split at the branch point with highest flow
+        # centrality - this does not copy or cut the neuron
+        return float(_split_batch(x, method='bending', reroot_soma=True,
+                                  ret='segregation')[0])
 
-        # This will leave the proximal split with the primary neurite but
-        # since that should not have synapses, we don't care at this point.
-        x = core.CatmaidNeuronList(list(graph_utils.cut_neuron(temp, child)))
+    # Calculate entropy between fragments
+    H = _segregation([x.n_postsynapses], [x.n_connectors])[0]
 
-    # Calculate entropy for each fragment
-    entropy = []
-    for n in x:
-        p = n.n_postsynapses / n.n_connectors
-
-        if 0 < p < 1:
-            S = - (p * math.log(p) + (1 - p) * math.log(1 - p))
-        else:
-            S = 0
-
-        entropy.append(S)
-
-    # Calc entropy between fragments
-    S = 1 / sum(x.n_connectors) * \
-        sum([e * x[i].n_connectors for i, e in enumerate(entropy)])
-
-    # Normalize to entropy in whole neuron
-    p_norm = sum(x.n_postsynapses) / sum(x.n_connectors)
-    if 0 < p_norm < 1:
-        S_norm = - (p_norm * math.log(p_norm) +
-                    (1 - p_norm) * math.log(1 - p_norm))
-        H = 1 - S / S_norm
-    else:
-        S_norm = 0
-        H = 0
-
-    return H
+    return float(H)
 
 
+@cache.memoize('nodes', columns=['flow_centrality'],
+               attrs=['centrality_method'])
 def bending_flow(x, polypre=False):
     """ Variation of the algorithm for calculating synapse flow from
     Schneider-Mizell et al. (eLife, 2016).
@@ -915,82 +1298,122 @@ def bending_flow(x, polypre=False):
         raise ValueError('Must pass CatmaidNeuron or CatmaidNeuronList, '
                          'got "{}"'.format(type(x)))
 
-    if isinstance(x, core.CatmaidNeuronList):
-        return [bending_flow(n, polypre=polypre, ) for n in x]
+    neurons = x if isinstance(x, core.CatmaidNeuronList) else [x]
 
-    if x.soma and x.soma not in x.root:
-        logger.warning('Neuron {0} is not rooted to its soma!'.format(x.skeleton_id))
+    parents, distal_pre, distal_post, _, _ = _distal_synapses(neurons,
+                                                              polypre=polypre)
 
-    # We will be processing a super downsampled version of the neuron to speed
-    # up calculations
-    current_level = logger.level
-    logger.setLevel('ERROR')
-    y = x.copy()
-    y.downsample(1000000)
-    logger.setLevel(current_level)
+    # For each branch point, sum the flow between each ordered pair of child
+    # branches: sum_l(post_l) * sum_r(pre_r) - sum_l(post_l * pre_l)
+    n = parents.shape[0]
+    has_parent = parents >= 0
+    childs = np.where(has_parent)[0]
+    n_childs = np.bincount(parents[has_parent], minlength=n)
 
-    if polypre:
-        # Get details for all presynapses
-        cn_details = fetch.get_connector_details(y.connectors[y.connectors.relation == 0],
-                                                 remote_instance=y._remote_instance)
-
-    # Get list of nodes with pre/postsynapses
-    pre_node_ids = y.connectors[y.connectors.relation == 0].treenode_id.values
-    post_node_ids = y.connectors[y.connectors.relation == 1].treenode_id.values
-
-    # Get list of branch_points
-    bp_node_ids = y.nodes[y.nodes.type == 'branch'].treenode_id.values.tolist()
-    # Add root if it is also a branch point
-    for r in y.root:
-        if y.graph.degree(r) > 1:
-            bp_node_ids += [r]
-
-    # Get list of childs of each branch point
-    bp_childs = {t: [e[0] for e in y.graph.in_edges(t)] for t in bp_node_ids}
-    childs = [tn for l in bp_childs.values() for tn in l]
-
-    # Get number of pre/postsynapses distal to each branch's childs
-    distal_pre = graph_utils.distal_to(y, pre_node_ids, childs)
-    distal_post = graph_utils.distal_to(y, post_node_ids, childs)
-
-    # Multiply columns (presynapses) by the number of postsynaptically
-    # connected nodes
-    if polypre:
-        # Map vertex ID to number of postsynaptic nodes (avoid 0)
-        distal_pre *= [max(1, len(cn_details[cn_details.presynaptic_to_node ==
-                                             n].postsynaptic_to_node.sum())) for n in distal_pre.columns]
+    sum_pre = np.bincount(parents[childs], weights=distal_pre[childs],
+                          minlength=n)
+    sum_post = np.bincount(parents[childs], weights=distal_post[childs],
+                           minlength=n)
+    sum_both = np.bincount(parents[childs],
+                           weights=distal_pre[childs] * distal_post[childs],
+                           minlength=n)
 
-    # Sum up axis - now each row represents the number of pre/postsynapses
-    # distal to that node
-    distal_pre = distal_pre.T.sum(axis=1)
-    distal_post = distal_post.T.sum(axis=1)
+    # Branch points only (includes roots with more than one child)
+    flow = np.where(n_childs > 1, sum_post * sum_pre - sum_both, np.nan)
 
-    # Now go over all branch points and check flow between branches
-    # (centrifugal) vs flow from branches to root (centripetal)
-    flow = {bp: 0 for bp in bp_childs}
-    for bp in bp_childs:
-        # We will use left/right to label the different branches here
-        # (even if there is more than two)
-        for left, right in itertools.permutations(bp_childs[bp], r=2):
-            flow[bp] += distal_post.loc[left] * distal_pre.loc[right]
+    offset = 0
+    for n in neurons:
+        n.nodes['flow_centrality'] = flow[offset: offset + n.nodes.shape[0]]
+        offset += n.nodes.shape[0]
 
-    # Set flow centrality to None for all nodes
-    x.nodes['flow_centrality'] = None
+        # Add little info on method used for flow centrality
+        n.centrality_method = 'bending'
 
-    # Change index to treenode_id
-    x.nodes.set_index('treenode_id', inplace=True)
+    return
 
-    # Add flow (make sure we use igraph of y to get node ids!)
-    x.nodes.loc[flow.keys(), 'flow_centrality'] = list(flow.values())
 
-    # Add little info on method used for flow centrality
-    x.centrality_method = 'bending'
+def _distal_synapses(x, polypre=False):
+    """Count number of synapse-holding nodes distal to each node.
 
-    x.nodes.reset_index(inplace=True)
+    Parameters
+    ----------
+    x :         CatmaidNeuronList | list of CatmaidNeurons
+                Neurons are processed in a single pass.
+    polypre :   bool, optional
+                If True, presynapses are weighted by the number of their
+                postsynaptic partners.
 
-    return
+    Returns
+    -------
+    parents :       numpy.ndarray
+                    Parent index for each node across all neurons.
+    distal_pre :    numpy.ndarray
+                    Number of presynapse-holding nodes distal to (and
+                    including) each node.
+    distal_post :   numpy.ndarray
+                    Number of postsynapse-holding nodes distal to each node.
+    total_pre :     numpy.ndarray
+                    Total number of presynapses of each node's neuron.
+    total_post :    numpy.ndarray
+                    Total number of postsynapses of each node's neuron.
 
+    """
+    for n in x:
+        if n.soma and n.soma not in n.root:
+            logger.warning('Neuron {} is not rooted to its '
+                           'soma!'.format(n.skeleton_id))
 
+    if polypre:
+        # Get details for all presynapses (of all neurons) in one go
+        pre = pd.concat([n.connectors[n.connectors.relation == 0] for n in x])
+        cn_details = fetch.get_connector_details(pre,
+                                                 remote_instance=x[0]._remote_instance)
+        # Number of postsynaptic nodes per connector (avoid 0)
+        n_post = cn_details.postsynaptic_to_node.apply(len)
+        polypre_weight = n_post.groupby(cn_details.presynaptic_to_node.values).sum()
+        polypre_weight = polypre_weight.clip(lower=1)
+
+    parents, pre, post, total_pre, total_post = [], [], [], [], []
+    offset = 0
+    for n in x:
+        p = graph_utils._parent_index(n)
+        p[p >= 0] += offset
+        parents.append(p)
+        offset += p.shape[0]
+
+        tn = n.nodes.treenode_id
+        this_pre = n.connectors[n.connectors.relation == 0].treenode_id.values
+        this_post = n.connectors[n.connectors.relation == 1].treenode_id.values
+        is_pre = tn.isin(this_pre).values
+        is_post = tn.isin(this_post).values
+
+        if polypre:
+            w = tn.map(polypre_weight).fillna(1).values
+            pre.append(np.where(is_pre, w, 0))
+            # Only this neuron's presynapses - connectors it receives from
+            # other neurons in the batch are in cn_details too
+            this_pre_cn = n.connectors[n.connectors.relation == 0].connector_id
+            this_details = cn_details[cn_details.connector_id.isin(this_pre_cn)]
+            n_pre = sum([max(1, len(r)) for r in this_details.postsynaptic_to_node.values])
+        else:
+            pre.append(is_pre.astype(float))
+            n_pre = is_pre.sum()
+        post.append(is_post.astype(float))
+
+        total_pre.append(np.full(p.shape[0], n_pre, dtype=float))
+        total_post.append(np.full(p.shape[0], is_post.sum(), dtype=float))
+
+    parents = np.concatenate(parents)
+    distal = graph_utils._subtree_sums(parents,
+                                       np.vstack([np.concatenate(pre),
+                                                  np.concatenate(post)]).T)
+
+    return (parents, distal[:, 0], distal[:, 1],
+            np.concatenate(total_pre), np.concatenate(total_post))
+
+
+@cache.memoize('nodes', columns=['flow_centrality'],
+               attrs=['centrality_method'])
 def flow_centrality(x, mode='centrifugal', polypre=False):
     """ Calculates synapse flow centrality (SFC).
 
@@ -1052,81 +1475,42 @@ def flow_centrality(x, mode='centrifugal', polypre=False):
         raise ValueError('Expected pass CatmaidNeuron or CatmaidNeuronList, '
                          'got "{}"'.format(type(x)))
 
-    if isinstance(x, core.CatmaidNeuronList):
-        return [flow_centrality(n, mode=mode, polypre=polypre) for n in x]
-
-    if x.soma and x.soma not in x.root:
-        logger.warning('Neuron {} is not rooted to its soma!'.format(x.skeleton_id))
-
-    # We will be processing a super downsampled version of the neuron to
-    # speed up calculations
-    current_level = logger.level
-    current_state = config.pbar_hide
-    logger.setLevel('ERROR')
-    config.pbar_hide = True
-    y = resample.downsample_neuron(x, float('inf'),
-                                   inplace=False, preserve_cn_treenodes=True)
-    logger.setLevel(current_level)
-    config.pbar_hide = current_state
+    neurons = x if isinstance(x, core.CatmaidNeuronList) else [x]
+
+    for n in neurons:
+        if 'type' not in n.nodes:
+            graph_utils.classify_nodes(n)
+
+    (_, distal_pre, distal_post,
+     total_pre, total_post) = _distal_synapses(neurons, polypre=polypre)
+
+    # Centrifugal is the flow from all non-distal postsynapses to all
+    # distal presynapses
+    centrifugal = (total_post - distal_post) * distal_pre
+
+    # Centripetal is the flow from all distal postsynapses to all
+    # non-distal presynapses
+    centripetal = distal_post * (total_pre - distal_pre)
 
-    if polypre:
-        # Get details for all presynapses
-        cn_details = fetch.get_connector_details(y.connectors[y.connectors.relation == 0],
-                                                 remote_instance=y._remote_instance)
-
-    # Get list of nodes with pre/postsynapses
-    pre_node_ids = y.connectors[y.connectors.relation == 0].treenode_id.unique()
-    post_node_ids = y.connectors[y.connectors.relation == 1].treenode_id.unique()
-    total_pre = len(pre_node_ids)
-    total_post = len(post_node_ids)
-
-    # Get list of points to calculate flow centrality for:
-    # branches and nodes with synapses
-    calc_node_ids = y.nodes[(y.nodes.type == 'branch') | (
-        y.nodes.treenode_id.isin(y.connectors.treenode_id))].treenode_id.values
-
-    # Get number of pre/postsynapses distal to each branch's childs
-    distal_pre = graph_utils.distal_to(y, pre_node_ids, calc_node_ids)
-    distal_post = graph_utils.distal_to(y, post_node_ids, calc_node_ids)
-
-    # Multiply columns (presynapses) by the number of postsynaptically
-    # connected nodes
-    if polypre:
-        # Map vertex ID to number of postsynaptic nodes (avoid 0)
-        distal_pre *= [max(1, len(cn_details[cn_details.presynaptic_to_node ==
-                                             n].postsynaptic_to_node.sum())) for n in distal_pre.columns]
-        # Also change total_pre as accordingly
-        total_pre = sum([max(1, len(row))
-                         for row in cn_details.postsynaptic_to_node.values])
-
-    # Sum up axis - now each row represents the number of pre/postsynapses
-    # that are distal to that node
-    distal_pre = distal_pre.T.sum(axis=1)
-    distal_post = distal_post.T.sum(axis=1)
-
-    if mode != 'centripetal':
-        # Centrifugal is the flow from all non-distal postsynapses to all
-        # distal presynapses
-        centrifugal = {
-            n: (total_post - distal_post[n]) * distal_pre[n] for n in calc_node_ids}
-
-    if mode != 'centrifugal':
-        # Centripetal is the flow from all distal postsynapses to all
-        # non-distal presynapses
-        centripetal = {
-            n: distal_post[n] * (total_post - distal_pre[n]) for n in calc_node_ids}
-
-    # Now map this onto our neuron
     if mode == 'centrifugal':
-        x.nodes['flow_centrality'] = x.nodes.treenode_id.map(centrifugal)
+        flow = centrifugal
     elif mode == 'centripetal':
-        x.nodes['flow_centrality'] = x.nodes.treenode_id.map(centripetal)
-    elif mode == 'sum':
-        combined = {n : centrifugal[n] + centripetal[n] for n in centrifugal}
-        x.nodes['flow_centrality'] = x.nodes.treenode_id.map(combined)
+        flow = centripetal
+    else:
+        flow = centrifugal + centripetal
 
-    # Add info on method/mode used for flow centrality
-    x.centrality_method = mode
+    offset = 0
+    for n in neurons:
+        this_flow = flow[offset: offset + n.nodes.shape[0]]
+        offset += n.nodes.shape[0]
+
+        # Only branch- and synapse-holding nodes get a flow centrality
+        calc = (n.nodes.type == 'branch').values | \
+            n.nodes.treenode_id.isin(n.connectors.treenode_id).values
+        n.nodes['flow_centrality'] = np.where(calc, this_flow, np.nan)
+
+        # Add info on method/mode used for flow centrality
+        n.centrality_method = mode
 
     return
 
@@ -1307,86 +1691,195 @@ def stitch_neurons(*x, method='LEAFS', master='SOMA', tn_to_stitch=None,
         # Make sure we're working with integers
         tn_to_stitch = [int(tn) for tn in tn_to_stitch]
 
-    # Generate a union of all graphs
-    g = nx.union_all([n.graph for n in x]).to_undirected()
+    # Generate one big neuron -> this also keeps track of original skeleton IDs
+    nodes = x.nodes
+    frags = np.repeat(np.arange(len(x)), [n.nodes.shape[0] for n in x])
+
+    # Collect treenodes that are allowed to make new edges
+    parents = graph_utils._parent_index(nodes)
+    if method == 'LEAFS':
+        n_childs = np.bincount(parents[parents >= 0],
+                               minlength=parents.shape[0])
+        cand = (n_childs == 0) | (parents < 0)
+    else:
+        cand = np.ones(parents.shape[0], dtype=bool)
 
-    # Set existing edges to zero weight to make sure they remain when
-    # calculating the minimum spanning tree
-    nx.set_edge_attributes(g, 0, 'weight')
+    if not isinstance(tn_to_stitch, type(None)):
+        # Fragments with any of the preferred treenodes use only those
+        preferred = nodes.treenode_id.isin(tn_to_stitch).values
+        has_preferred = np.bincount(frags[preferred], minlength=len(x)) > 0
+        cand = np.where(has_preferred[frags], preferred, cand)
 
-    # If two nodes occupy the same position (e.g. if fragments are the
-    # result of cutting), they will have a distance of 0. Hence, we won't be
-    # able to simply filter by distance
-    nx.set_edge_attributes(g, False, 'new')
+    cand = np.where(cand)[0]
+    edges = _stitch_mst(nodes[['x', 'y', 'z']].values[cand], frags[cand])
 
-    # Now iterate over every possible combination of fragments
-    for a, b in itertools.combinations(x, 2):
-        # Collect relevant treenodes
-        if not isinstance(tn_to_stitch, type(None)):
-            tnA = a.nodes.loc[a.nodes.treenode_id.isin(tn_to_stitch)]
-            tnB = b.nodes.loc[a.nodes.treenode_id.isin(tn_to_stitch)]
-        else:
-            tnA = pd.DataFrame([])
-            tnB = pd.DataFrame([])
+    tn_ids = nodes.treenode_id.values
+    to_add = [(tn_ids[cand[i]], tn_ids[cand[j]], {'weight': d, 'new': True})
+              for i, j, d in edges]
 
-        if tnA.empty:
-            if method == 'LEAFS':
-                tnA = a.nodes.loc[a.nodes['type'].isin(['end', 'root'])]
-            else:
-                tnA = a.nodes
-        if tnB.empty:
-            if method == 'LEAFS':
-                tnB = b.nodes.loc[b.nodes['type'].isin(['end', 'root'])]
-            else:
-                tnB = b.nodes
+    if suggest_only:
+        return to_add
 
-        # Get distance between treenodes in A and B
-        d = scipy.spatial.distance.cdist(tnA[['x', 'y', 'z']].values,
-                                         tnB[['x', 'y', 'z']].values,
-                                         metric='euclidean')
+    # Connect fragments and orient edges away from original master root
+    master_root = np.where(tn_ids == master.root[0])[0][0]
+    new_edges = np.array([(cand[i], cand[j]) for i, j, _ in edges],
+                         dtype=int).reshape(-1, 2)
+    nodes['parent_id'] = _connect_nodes(tn_ids, parents, new_edges,
+                                        master_root)
 
-        # List of edges
-        tn_comb = itertools.product(tnA.treenode_id.values, tnB.treenode_id.values)
+    master.nodes = nodes
+    master.connectors = x.connectors
+    master.tags = {}
+    for n in x:
+        for k, v in n.tags.items():
+            master.tags[k] = master.tags.get(k, []) + v
 
-        # Add edges to union graph
-        g.add_edges_from([(a, b, {'weight': w, 'new': True}) for (a, b), w in zip(tn_comb, d.ravel())])
+    # Add node tags
+    master.tags['stitched'] = master.tags.get('stitched', []) + \
+        [tn for e in to_add for tn in e[:2]]
 
-    # Get minimum spanning tree
-    edges = nx.minimum_spanning_edges(g)
+    # Reset temporary attributes of our final neuron
+    master._clear_temp_attr()
 
-    # Edges that need adding are those with weight > 0
-    to_add = [e for e in edges if e[2]['new']]
+    return master
 
-    if suggest_only:
-        return to_add
 
-    # Keep track of original master root
-    master_root = master.root[0]
+def _stitch_mst(points, frags, k=5):
+    """Find edges that connect fragments with minimal total length.
 
-    # Generate one big neuron -> this also keeps track of original skeleton IDs
-    master.nodes = x.nodes
-    master.connectors = x.connectors
-    for n in x:
-        master.tags.update(n.tags)
-    master._clear_temp_attr()
+    Uses Borůvka's algorithm on the fragments: in each round, every group of
+    already connected fragments is joined to its closest other group. The
+    closest points are found with a KD-tree so we never compute full
+    distance matrices.
 
-    for e in to_add:
-        # Reroot to one of the nodes in the edge
-        master.reroot(e[0], inplace=True)
+    Parameters
+    ----------
+    points :    numpy.ndarray
+                ``(N, 3)`` coordinates of points that can be connected.
+    frags :     numpy.ndarray
+                ``(N, )`` fragment each point belongs to.
+    k :         int, optional
+                Number of nearest neighbours to query initially. Larger
+                numbers are tried only where necessary.
 
-        # Connect the nodes
-        master.nodes.loc[master.nodes.treenode_id == e[0], 'parent_id'] = e[1]
+    Returns
+    -------
+    list
+                ``[(i, j, distance), ...]`` edges between points ``i`` and
+                ``j`` (indices into ``points``).
 
-        # Add node tags
-        master.tags['stitched'] = master.tags.get('stitched', []) + list(e[0:2])
+    """
+    points = np.asarray(points, dtype=float)
+    frags = np.unique(frags, return_inverse=True)[1].ravel()
+    n_frags = frags.max() + 1 if frags.shape[0] else 0
 
-        # We need to regenerate the graph
-        master._clear_temp_attr()
+    if n_frags < 2:
+        return []
 
-    # Reroot to original root
-    master.reroot(master_root, inplace=True)
+    tree = scipy.spatial.cKDTree(points)
+    k = min(k + 1, points.shape[0])
+    dist, nb = tree.query(points, k=k)
+    dist, nb = dist.reshape(-1, k), nb.reshape(-1, k)
 
-    return master
+    # Union-find over fragments
+    comp = np.arange(n_frags)
+
+    def find(c):
+        while comp[c] != c:
+            c = comp[c]
+        return c
+
+    edges = []
+    while True:
+        # Flatten union-find
+        while True:
+            flat = comp[comp]
+            if np.all(flat == comp):
+                break
+            comp = flat
+
+        if np.all(comp == comp[0]):
+            break
+
+        label = comp[frags]
+        best_d = np.full(points.shape[0], np.inf)
+        best_j = np.full(points.shape[0], -1, dtype=int)
+        todo = np.arange(points.shape[0])
+        this_dist, this_nb = dist, nb
+        this_k = k
+        while True:
+            # Closest neighbour from another group
+            foreign = label[this_nb] != label[todo, None]
+            found = foreign.any(axis=1)
+            first = foreign.argmax(axis=1)
+            ix = todo[found]
+            best_d[ix] = this_dist[found, first[found]]
+            best_j[ix] = this_nb[found, first[found]]
+
+            # Points without a foreign neighbour among their k nearest could
+            # still be closer than the best pair of their group found so far
+            group_best = np.full(n_frags, np.inf)
+            np.minimum.at(group_best, label, best_d)
+            unresolved = ~found & (this_dist[:, -1] < group_best[label[todo]])
+
+            if not np.any(unresolved) or this_k >= points.shape[0]:
+                break
+
+            todo = todo[unresolved]
+            this_k = min(this_k * 4, points.shape[0])
+            this_dist, this_nb = tree.query(points[todo], k=this_k)
+            this_dist = this_dist.reshape(-1, this_k)
+            this_nb = this_nb.reshape(-1, this_k)
+
+        # Closest pair for each group
+        srt = np.lexsort((best_d, label))
+        is_first = np.concatenate([[True], label[srt][1:] != label[srt][:-1]])
+        closest = srt[is_first]
+        closest = closest[np.argsort(best_d[closest], kind='stable')]
+
+        # Add edges - shortest first - unless groups are already connected
+        for i in closest:
+            a, b = find(frags[i]), find(frags[best_j[i]])
+            if a == b:
+                continue
+            comp[a] = b
+            edges.append((i, best_j[i], best_d[i]))
+
+    return edges
+
+
+def _connect_nodes(tn_ids, parents, new_edges, root):
+    """Add edges between nodes and orient all edges away from given root.
+
+    Parameters
+    ----------
+    tn_ids :    numpy.ndarray
+                Treenode IDs.
+    parents :   numpy.ndarray
+                Parent index for each node, ``-1`` for roots. See
+                :func:`~pymaid.graph_utils._parent_index`.
+    new_edges : numpy.ndarray
+                ``(N, 2)`` array of node indices to connect.
+    root :      int
+                Index of the new root.
+
+    Returns
+    -------
+    numpy.ndarray
+                New parent IDs (object array with ``None`` for roots).
+
+    """
+    n = tn_ids.shape[0]
+    has_parent = parents >= 0
+    a = np.concatenate([np.where(has_parent)[0], new_edges[:, 0]])
+    b = np.concatenate([parents[has_parent], new_edges[:, 1]])
+    g = csr_matrix((np.ones(a.shape[0]), (a, b)), shape=(n, n))
+
+    _, pred = csgraph.breadth_first_order(g, root, directed=False,
+                                          return_predecessors=True)
+
+    return np.where(pred >= 0, tn_ids[np.maximum(pred, 0)],
+                    None).astype(object)
 
 
 def union_neurons(*x, limit=1, base_neuron=None, track=False,
@@ -1395,7 +1888,8 @@ def union_neurons(*x, limit=1, base_neuron=None, track=False,
 
     This implementation works by iteratively merging nodes in neuron A and B
     that are closer than given threshold. This requires neurons to have a
-    certain amount of overlap.
+    certain amount of overlap. Close nodes are found once for all neurons
+    using a single KD-tree.
 
     Parameters
     ----------
@@ -1481,45 +1975,55 @@ def union_neurons(*x, limit=1, base_neuron=None, track=False,
     # Convert distance threshold from microns to nanometres
     limit *= 1000
 
+    # Concatenate all neurons -> rows in these arrays are "nodes"
+    base = skids.index(base_skid)
+    parents, offsets = graph_utils._concat_parents(x)
+    labels = np.repeat(np.arange(len(x)), np.diff(offsets))
+    tn_ids = np.concatenate([n.nodes.treenode_id.values for n in x])
+    locs = np.concatenate([n.nodes[['x', 'y', 'z']].values.astype(float)
+                           for n in x])
+
+    # Get all pairs of nodes from different neurons within distance limits
+    # using a single KD-tree over all neurons
+    tree = scipy.spatial.cKDTree(locs)
+    pairs = tree.query_pairs(limit, output_type='ndarray')
+    pairs = pairs[labels[pairs[:, 0]] != labels[pairs[:, 1]]]
+    pairs = np.vstack([pairs, pairs[:, ::-1]])
+    pairs = pairs[np.argsort(pairs[:, 0])]
+    pair_dist = np.linalg.norm(locs[pairs[:, 0]] - locs[pairs[:, 1]], axis=1)
+
+    # Pairs are sorted by their first node -> pairs of node i are
+    # pairs[pair_ptr[i]:pair_ptr[i + 1]]
+    pair_ptr = np.searchsorted(pairs[:, 0], np.arange(len(tn_ids) + 1))
+
+    def pairs_of(rows):
+        lens = pair_ptr[rows + 1] - pair_ptr[rows]
+        start = np.repeat(pair_ptr[rows] - np.cumsum(lens) + lens, lens)
+        return start + np.arange(lens.sum())
+
+    # Number of close node pairs between neurons
+    overlap = np.zeros((len(x), len(x)), dtype=int)
+    np.add.at(overlap, (labels[pairs[:, 0]], labels[pairs[:, 1]]), 1)
+
     # Keep track of old IDs
     if track:
-        for n in x:
-            # Original skeleton of each node
-            n.nodes['origin_skeletons'] = n.skeleton_id
-            # Original skeleton of each connector
-            n.connectors['origin_skeletons'] = n.skeleton_id
-            # Old parent if this node gets rewired
-            n.nodes['old_parent'] = n.nodes.parent_id.values
+        # Old parent if this node gets rewired
+        old_parent = np.where(parents >= 0, tn_ids[parents], None).astype(object)
 
     # Now make unions
     all_clps_nodes = {}
-    while len(x) > 1:
+    group = np.arange(len(x))
+    alive = np.ones(len(tn_ids), dtype=bool)
+    clps_target = np.full(len(tn_ids), -1, dtype=int)
+    remaining = list(range(len(x)))
+    while len(remaining) > 1:
         # First we need to find a pair of overlapping neurons
-        comb = itertools.combinations(x, 2)
-        ol = False
-        for c in comb:
-            # If combination contains base_skid, make sure it's the master
-            if c[0].skeleton_id == base_skid:
-                master, minion = c[0], c[1]
-            else:
-                master, minion = c[1], c[0]
-
-            # Generate KDTree for master neuron
-            tree = graph.neuron2KDTree(master, tree_type='c', data='treenodes')
-
-            # For each node in master get the nearest neighbor in minion
-            coords = minion.nodes[['x', 'y', 'z']].values
-            nn_dist, nn_ix = tree.query(coords, k=1, distance_upper_bound=limit)
-
-            # Use this combination if overlap found
-            if any(nn_dist <= limit):
-                ol = True
-                break
+        ol = np.triu(overlap[np.ix_(remaining, remaining)] > 0, 1)
 
         # If no overlap between remaining fragments
-        if not ol:
-            miss = [n.skeleton_id for n in x if n.skeleton_id != base_skid]
-            msg = "{} fragments do not overlap: {}.".format(len(x) - 1,
+        if not ol.any():
+            miss = [skids[g] for g in remaining if g != base]
+            msg = "{} fragments do not overlap: {}.".format(len(remaining) - 1,
                                                             ", ".join(miss))
             # Raise ...
             if non_overlap.lower() == 'raise':
@@ -1527,82 +2031,88 @@ def union_neurons(*x, limit=1, base_neuron=None, track=False,
             # ... or stitch up neurons using mst and break the loop...
             elif non_overlap.lower() == 'stitch':
                 logger.warning(msg + " Stitching.")
-                x = stitch_neurons(x, method='LEAFS', master=base_skid)
-                x = core.CatmaidNeuronList(x)
                 break
             # ... or just skip remaining fragments
             else:
                 logger.warning(msg + " Skipping.")
-                x = [n for n in x if n.skeleton_id == base_skid]
+                remaining = [base]
                 break
 
-        # Now collapse minion nodes that are within distance limits into master
-        to_clps = minion.nodes.loc[nn_dist <= limit, 'treenode_id'].values
-        clps_into = master.nodes.loc[nn_ix[nn_dist <= limit], 'treenode_id'].values
+        # Use the first overlapping combination. If combination contains
+        # base neuron, make sure it's the master
+        i, j = np.argwhere(ol)[0]
+        if remaining[i] == base:
+            master, minion = remaining[i], remaining[j]
+        else:
+            master, minion = remaining[j], remaining[i]
 
-        # Generate a map: minion node -> master node to collapse into
-        clps_map = dict(zip(to_clps, clps_into))
+        # For each node in minion get the nearest neighbor in master
+        is_minion = group[labels] == minion
+        this = pairs_of(np.where(is_minion & alive)[0])
+        this = this[alive[pairs[this, 1]]
+                    & (group[labels[pairs[this, 1]]] == master)]
+        cand = pairs[this][np.lexsort((pair_dist[this], pairs[this, 0]))]
+        first = np.append(True, cand[1:, 0] != cand[:-1, 0])
+        to_clps, clps_into = cand[first, 0], cand[first, 1]
 
         # Track the collapsed node into the master
         if track:
-            for n1, n2 in zip(to_clps, clps_into):
+            for n1, n2 in zip(tn_ids[to_clps], tn_ids[clps_into]):
                 all_clps_nodes[n2] = all_clps_nodes.get(n2, []) + [n1]
 
         # Reroot minion to one of the nodes that will be collapsed
-        graph_utils.reroot_neuron(minion, to_clps[0], inplace=True)
+        path = [to_clps[0]]
+        while parents[path[-1]] >= 0:
+            path.append(parents[path[-1]])
+        parents[path[1:]] = path[:-1]
+        parents[path[0]] = -1
+
+        # Pairs involving nodes that are about to be collapsed
+        this = pairs_of(to_clps)
+        this = this[alive[pairs[this, 1]]]
 
         # Collapse nodes by first dropping all collapsed nodes
-        minion.nodes = minion.nodes.loc[~minion.nodes.treenode_id.isin(to_clps)]
-        # Make independent of original table to prevent warnings
-        minion.nodes = minion.nodes.copy()
+        alive[to_clps] = False
+        clps_target[to_clps] = clps_into
+
+        # Remove these pairs from the overlap counts (in both directions)
+        u, v = pairs[this, 0], pairs[this, 1]
+        np.add.at(overlap, (group[labels[u]], group[labels[v]]), -1)
+        np.add.at(overlap, (group[labels[v[alive[v]]]],
+                            group[labels[u[alive[v]]]]), -1)
 
         # Reconnect children of the collapsed nodes to their new parents
-        to_rewire = minion.nodes.parent_id.isin(to_clps)
+        to_rewire = is_minion & alive & (parents >= 0)
+        to_rewire[to_rewire] = ~alive[parents[to_rewire]]
 
         # Track old parents before rewiring
         if track:
-            minion.nodes['old_parent'] = None
-            minion.nodes.loc[to_rewire, 'old_parent'] = minion.nodes.loc[to_rewire, 'parent_id']
+            old_parent[is_minion] = None
+            old_parent[to_rewire] = tn_ids[parents[to_rewire]]
 
         # Now rewire
-        new_parents = minion.nodes.loc[to_rewire, 'parent_id'].map(clps_map)
-        minion.nodes.loc[to_rewire, 'parent_id'] = new_parents
+        parents[to_rewire] = clps_target[parents[to_rewire]]
 
-        # Merge minion's node table into master
-        master.nodes = pd.concat([master.nodes, minion.nodes],
-                                 axis=0,
-                                 sort=True,
-                                 ignore_index=True)
+        # Merge minion into master
+        group[group == minion] = master
+        overlap[master] += overlap[minion]
+        overlap[:, master] += overlap[:, minion]
+        overlap[minion] = overlap[:, minion] = 0
+        remaining.remove(minion)
 
-        # Now some clean up! First up: node tags
-        # Make sure tags in minion are mapped onto their new IDs
-        tags = {k: [clps_map.get(n, n) for n in v] for k, v in minion.tags.items()}
-        # Combine master and minion tags
-        master.tags = {k: v + tags.get(k, []) for k, v in master.tags.items()}
-        master.tags.update({k: v for k, v in tags.items() if k not in master.tags})
+    # Collapsed nodes (and their tags/connectors) end up at the first node
+    # along their chain of collapses that survived
+    final, _ = graph_utils._jump_to(clps_target, alive)
+    final[alive] = np.where(alive)[0]
 
-        # Last but not least: merge connector tables
-        new_tn = minion.connectors.loc[minion.connectors.treenode_id.isin(to_clps),
-                                       'treenode_id'].map(clps_map)
-
-        if track:
-            minion.connectors['old_treenode'] = None
-            minion.connectors.loc[minion.connectors.treenode_id.isin(to_clps),
-                                  'old_treenode'] = minion.connectors.loc[minion.connectors.treenode_id.isin(to_clps),
-                                                                          'treenode_id']
-
-        minion.connectors.loc[minion.connectors.treenode_id.isin(to_clps),
-                              'treenode_id'] = new_tn
-        master.connectors = pd.concat([master.connectors, minion.connectors],
-                                      axis=0,
-                                      sort=True,
-                                      ignore_index=True)
-
-        # Reset master's attributes (graph, node types, etc)
-        master._clear_temp_attr()
+    # Turn the remaining groups into neurons
+    x = [_union_group(x, g, group, alive, parents, final, offsets, tn_ids,
+                      track=track,
+                      old_parent=old_parent if track else None)
+         for g in remaining]
 
-        # Almost done. Just need to pop minion from "x"
-        x = [n for n in x if n.skeleton_id != minion.skeleton_id]
+    if len(x) > 1:
+        x = [stitch_neurons(x, method='LEAFS', master=base_skid)]
 
     union = x[0]
 
@@ -1615,7 +2125,85 @@ def union_neurons(*x, limit=1, base_neuron=None, track=False,
     return union
 
 
-def average_neurons(x, limit=10, base_neuron=None):
+def _union_group(x, g, group, alive, parents, final, offsets, tn_ids,
+                 track=False, old_parent=None):
+    """Build a neuron from a group of (partially) merged neurons.
+
+    Parameters
+    ----------
+    x :             list of CatmaidNeuron
+                    Original neurons.
+    g :             int
+                    Index of the group's master in ``x``.
+    group :         numpy.ndarray
+                    Group of each neuron in ``x``.
+    alive :         numpy.ndarray
+                    Whether each (concatenated) node survived.
+    parents :       numpy.ndarray
+                    Parent row of each node.
+    final :         numpy.ndarray
+                    Surviving node each node has been collapsed into.
+    offsets :       numpy.ndarray
+                    Offsets of each neuron's nodes.
+    tn_ids :        numpy.ndarray
+                    Treenode ID of each node.
+    track :         bool
+                    Whether to add columns tracking the origin of nodes.
+    old_parent :    numpy.ndarray, optional
+                    Parent ID before rewiring. Required if ``track=True``.
+
+    Returns
+    -------
+    CatmaidNeuron
+
+    """
+    members = [g] + [k for k in np.where(group == g)[0] if k != g]
+    union = x[g]
+
+    nodes, connectors, tags = [], [], {}
+    for k in members:
+        n = x[k]
+        rows = np.arange(offsets[k], offsets[k + 1])
+        row_map = pd.Series(rows, index=n.nodes.treenode_id.values)
+
+        this_nodes = n.nodes[alive[rows]].copy()
+        p = parents[rows][alive[rows]]
+        this_nodes['parent_id'] = np.where(p >= 0, tn_ids[np.maximum(p, 0)],
+                                           None).astype(object)
+        if track:
+            this_nodes['origin_skeletons'] = n.skeleton_id
+            this_nodes['old_parent'] = old_parent[rows][alive[rows]]
+        nodes.append(this_nodes)
+
+        # Map connectors onto the nodes they have been collapsed into
+        cn = n.connectors.copy()
+        new_tn = tn_ids[final[row_map.loc[cn.treenode_id.values].values]]
+        if track:
+            cn['origin_skeletons'] = n.skeleton_id
+            cn['old_treenode'] = np.where(new_tn != cn.treenode_id.values,
+                                          cn.treenode_id.values,
+                                          None).astype(object)
+        cn['treenode_id'] = new_tn
+        connectors.append(cn)
+
+        # Same for tags
+        for t, v in n.tags.items():
+            tags[t] = tags.get(t, []) + [tn_ids[final[row_map[tn]]]
+                                         if tn in row_map.index else tn
+                                         for tn in v]
+
+    union.nodes = pd.concat(nodes, axis=0, sort=True, ignore_index=True)
+    union.connectors = pd.concat(connectors, axis=0, sort=True,
+                                 ignore_index=True)
+    union.tags = tags
+
+    # Reset attributes (graph, node types, etc)
+    union._clear_temp_attr()
+
+    return union
+
+
+def average_neurons(x, limit=10, base_neuron=None, n_cores=os.cpu_count()):
     """ Computes an average from a list of neurons.
 
     This is a very simple implementation which may give odd results if used
@@ -1630,6 +2218,8 @@ def average_neurons(x, limit=10, base_neuron=None):
     base_neuron :   skeleton_ID | CatmaidNeuron, optional
                     Neuron to use as template for averaging. If not provided,
                     the first neuron in the list is used as template!
+    n_cores :       int, optional
+                    Number of threads to use for nearest neighbour queries.
 
     Returns
     -------
@@ -1656,69 +2246,102 @@ def average_neurons(x, limit=10, base_neuron=None):
     if len(x) < 2:
         raise ValueError('Need at least 2 neurons to average!')
 
-    # Generate KDTrees for each neuron
-    for n in x:
-        n.tree = graph.neuron2KDTree(n, tree_type='c', data='treenodes')
-
     # Set base for average: we will use this neurons treenodes to query
-    # the KDTrees
+    # the other neurons
     if isinstance(base_neuron, core.CatmaidNeuron):
         base_neuron = base_neuron.copy()
-    elif isinstance(base_neuron, int):
-        base_neuron = x.skid[base_neuron].copy
+    elif isinstance(base_neuron, (int, str)):
+        base_neuron = x.skid[base_neuron].copy()
     elif isinstance(base_neuron, type(None)):
         base_neuron = x[0].copy()
     else:
         raise ValueError('Unable to interpret base_neuron of '
                          'type "{0}"'.format(type(base_neuron)))
 
-    base_nodes = base_neuron.nodes[['x', 'y', 'z']].values
-    other_neurons = x[1:]
-
-    # Make sure these stay 2-dimensional arrays -> will add a colum for each
-    # "other" neuron
-    base_x = base_nodes[:, 0:1]
-    base_y = base_nodes[:, 1:2]
-    base_z = base_nodes[:, 2:3]
+    base_nodes = base_neuron.nodes[['x', 'y', 'z']].values.astype(float)
+    other_neurons = [n for n in x if n.skeleton_id != base_neuron.skeleton_id]
 
     # For each "other" neuron, collect nearest neighbour coordinates
-    for n in other_neurons:
-        nn_dist, nn_ix = n.tree.query(
-            base_nodes, k=1, distance_upper_bound=limit * 1000)
-
-        # Translate indices into coordinates
-        # First, make empty array
-        this_coords = np.zeros((len(nn_dist), 3))
-        # Set coords without a nearest neighbour within distances to "None"
-        this_coords[nn_dist == float('inf')] = None
-        # Fill in coords of nearest neighbours
-        this_coords[nn_dist != float(
-            'inf')] = n.tree.data[nn_ix[nn_dist != float('inf')]]
-        # Add coords to base coords
-        base_x = np.append(base_x, this_coords[:, 0:1], axis=1)
-        base_y = np.append(base_y, this_coords[:, 1:2], axis=1)
-        base_z = np.append(base_z, this_coords[:, 2:3], axis=1)
-
-    # Calculate means
-    mean_x = np.mean(base_x, axis=1)
-    mean_y = np.mean(base_y, axis=1)
-    mean_z = np.mean(base_z, axis=1)
+    nn_dist, nn_ix, locs = _nearest_per_neuron(base_nodes, other_neurons,
+                                               limit * 1000, n_cores=n_cores)
+
+    # Base coordinates + one column for each "other" neuron - coordinates
+    # without a nearest neighbour within distance are "NaN"
+    coords = np.full((base_nodes.shape[0], len(other_neurons) + 1, 3), np.nan)
+    coords[:, 0] = base_nodes
+    has_nn = np.isfinite(nn_dist)
+    coords[:, 1:][has_nn] = locs[nn_ix[has_nn]]
 
     # If any of the base coords has NO nearest neighbour within limit
     # whatsoever, the average of that row will be "NaN" -> in this case we
     # will fall back to the base coordinate
-    mean_x[np.isnan(mean_x)] = base_nodes[np.isnan(mean_x), 0]
-    mean_y[np.isnan(mean_y)] = base_nodes[np.isnan(mean_y), 1]
-    mean_z[np.isnan(mean_z)] = base_nodes[np.isnan(mean_z), 2]
+    mean = coords.mean(axis=1)
+    mean[np.isnan(mean)] = base_nodes[np.isnan(mean)]
 
     # Change coordinates accordingly
-    base_neuron.nodes.loc[:, 'x'] = mean_x
-    base_neuron.nodes.loc[:, 'y'] = mean_y
-    base_neuron.nodes.loc[:, 'z'] = mean_z
+    base_neuron.nodes.loc[:, 'x'] = mean[:, 0]
+    base_neuron.nodes.loc[:, 'y'] = mean[:, 1]
+    base_neuron.nodes.loc[:, 'z'] = mean[:, 2]
 
     return base_neuron
 
 
+def _nearest_per_neuron(points, neurons, limit, n_cores=1):
+    """Find the nearest node in each of the neurons for a set of points.
+
+    Uses a single KD-tree over the nodes of all neurons. Each neuron is
+    offset along a fourth dimension by more than the spatial extent of the
+    data, so that querying a point with a given neuron's offset returns the
+    nearest node of that neuron only.
+
+    Parameters
+    ----------
+    points :    numpy.ndarray
+                ``(N, 3)`` query coordinates.
+    neurons :   list of CatmaidNeuron
+    limit :     int | float
+                Max distance for nearest neighbour search.
+    n_cores :   int, optional
+                Number of threads to run queries in.
+
+    Returns
+    -------
+    dist :      numpy.ndarray
+                ``(N, len(neurons))`` distances. ``inf`` if no node within
+                ``limit``.
+    ix :        numpy.ndarray
+                ``(N, len(neurons))`` row index into ``locs``.
+    locs :      numpy.ndarray
+                Concatenated node coordinates of all neurons.
+
+    """
+    locs = np.concatenate([n.nodes[['x', 'y', 'z']].values.astype(float)
+                           for n in neurons] + [np.zeros((0, 3))])
+    labels = np.repeat(np.arange(len(neurons)),
+                       [n.nodes.shape[0] for n in neurons])
+
+    dist = np.full((points.shape[0], len(neurons)), np.inf)
+    ix = np.full((points.shape[0], len(neurons)), locs.shape[0], dtype=int)
+
+    if not locs.shape[0] or not points.shape[0]:
+        return dist, ix, locs
+
+    all_locs = np.vstack([locs, points])
+    gap = (all_locs.max(axis=0) - all_locs.min(axis=0)).max() * 2 + limit + 1
+    tree = scipy.spatial.cKDTree(np.c_[locs, labels * gap])
+
+    def query(k):
+        dist[:, k], ix[:, k] = tree.query(np.c_[points,
+                                                np.full(len(points), k * gap)],
+                                          k=1, distance_upper_bound=limit)
+
+    # Queries release the GIL -> threads are sufficient
+    with ThreadPoolExecutor(max_workers=max(1, n_cores)) as e:
+        list(e.map(query, range(len(neurons))))
+
+    return dist, ix, locs
+
+
 def tortuosity(x, seg_length=10, skip_remainder=False):
     """ Calculates tortuosity for a neurons.
 
@@ -1759,61 +2382,107 @@ def tortuosity(x, seg_length=10, skip_remainder=False):
     # - try as angles between dotproduct vectors
     #
 
-    if isinstance(x, core.CatmaidNeuronList):
-        if not isinstance(seg_length, (list, np.ndarray, tuple)):
-            seg_length = [seg_length]
-        df = pd.DataFrame([tortuosity(n,
-                                      seg_length=seg_length,
-                                      skip_remainder=skip_remainder) for n in config.tqdm(x, desc='Tortuosity', disable=config.pbar_hide, leave=config.pbar_leave)],
-                          index=x.skeleton_id, columns=seg_length).T
-        df.index.name = 'seg_length'
-        return df
-
-    if not isinstance(x, core.CatmaidNeuron):
+    if not isinstance(x, (core.CatmaidNeuron, core.CatmaidNeuronList)):
         raise TypeError('Need CatmaidNeuron, got {0}'.format(type(x)))
 
-    if isinstance(seg_length, (list, np.ndarray)):
-        return [tortuosity(x, l) for l in seg_length]
+    is_list = isinstance(seg_length, (list, np.ndarray, tuple))
+    lengths = list(seg_length) if is_list else [seg_length]
 
-    if seg_length <= 0:
+    if any(l <= 0 for l in lengths):
         raise ValueError('Segment length must be >0.')
 
-    # We will collect coordinates and do distance calculations later
-    start_tn = []
-    end_tn = []
-    L = []
+    neurons = x if isinstance(x, core.CatmaidNeuronList) else [x]
+
+    # Process all neurons in one go
+    parents, offsets = graph_utils._concat_parents(neurons)
+    locs = np.concatenate([n.nodes[['x', 'y', 'z']].values.astype(float)
+                           for n in neurons] + [np.zeros((0, 3))])
+    neuron_ix = np.repeat(np.arange(len(neurons)), np.diff(offsets))
+
+    # Convert to microns
+    T = np.array([_tortuosity(parents, locs / 1000, neuron_ix, len(neurons),
+                              l, skip_remainder) for l in lengths]).T
+
+    if isinstance(x, core.CatmaidNeuronList):
+        df = pd.DataFrame(T, index=x.skeleton_id, columns=lengths).T
+        df.index.name = 'seg_length'
+        return df
+
+    if is_list:
+        return list(T[0])
 
-    # Go over all segments
-    for seg in x.small_segments:
-        # Collect distances between treenodes (in microns)
-        dist = np.array([x.graph.edges[(c, p)]['weight']
-                         for c, p in zip(seg[:-1], seg[1:])]) / 1000
-        # Walk the segment, collect stretches of length `seg_length`
-        cut_ix = [0]
-        for i, tn in enumerate(seg):
-            if sum(dist[cut_ix[-1]:i]) > seg_length:
-                cut_ix.append(i)
+    return T[0, 0]
 
-        # If the last node is not a cut node
-        if cut_ix[-1] < i and not skip_remainder:
-            cut_ix.append(i)
 
-        # Translate into treenode IDs
-        if len(cut_ix) > 1:
-            L += [sum(dist[s:e]) for s, e in zip(cut_ix[:-1], cut_ix[1:])]
-            start_tn += [seg[n] for n in cut_ix[:-1]]
-            end_tn += [seg[n] for n in cut_ix[1:]]
+def _tortuosity(parents, locs, neuron_ix, n_neurons, seg_length,
+                skip_remainder=False):
+    """Mean tortuosity per neuron for a single segment length.
 
-    # Now calculate euclidean distances
-    tn_table = x.nodes.set_index('treenode_id')
-    start_co = tn_table.loc[start_tn, ['x', 'y', 'z']].values
-    end_co = tn_table.loc[end_tn, ['x', 'y', 'z']].values
-    R = np.linalg.norm(start_co - end_co, axis=1) / 1000
+    Parameters
+    ----------
+    parents :           numpy.ndarray
+                        Parent index for each node, ``-1`` for roots. See
+                        :func:`~pymaid.graph_utils._parent_index`. May
+                        contain multiple trees.
+    locs :              numpy.ndarray
+                        ``(N, 3)`` node coordinates.
+    neuron_ix :         numpy.ndarray
+                        Index of the neuron each node belongs to.
+    n_neurons :         int
+                        Number of neurons.
+    seg_length :        int | float
+                        Target segment length in units of ``locs``.
+    skip_remainder :    bool, optional
+                        If True, will ignore stretches shorter than
+                        ``seg_length`` at the end of each segment.
 
-    # Get tortousity
-    T = np.array(L) / R
+    Returns
+    -------
+    numpy.ndarray
+                        ``(n_neurons, )`` array of mean tortuosities.
 
-    return T.mean()
+    """
+    nodes, offsets = graph_utils._segment_array(parents)
+    seg_ix = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    ends = offsets[1:][seg_ix] - 1
+
+    # Cumulative cable along each segment
+    dist = np.zeros(len(nodes))
+    if len(nodes):
+        dist[1:] = np.linalg.norm(np.diff(locs[nodes], axis=0), axis=1)
+    dist[offsets[:-1]] = 0
+    cum = np.cumsum(dist)
+    cum -= cum[offsets[:-1]][seg_ix]
+
+    # Offset segments against each other so that we can search all at once
+    gap = (cum.max() if len(cum) else 0) + seg_length + 1
+    glob = cum + seg_ix * gap
+    nxt = np.searchsorted(glob, glob + seg_length, side='right')
+
+    # Walk all segments in parallel: next cut is the first node more than
+    # `seg_length` away from the previous cut
+    is_cut = np.zeros(len(nodes), dtype=bool)
+    this = offsets[:-1][np.diff(offsets) > 0]
+    while this.shape[0]:
+        is_cut[this] = True
+        this = nxt[this][nxt[this] <= ends[this]]
+
+    # Add last node of each segment unless asked to skip the remainder
+    if not skip_remainder and len(nodes):
+        is_cut[offsets[1:][np.diff(offsets) > 0] - 1] = True
+
+    cuts = np.where(is_cut)[0]
+    same = seg_ix[cuts[:-1]] == seg_ix[cuts[1:]]
+    start, end = cuts[:-1][same], cuts[1:][same]
+
+    L = cum[end] - cum[start]
+    R = np.linalg.norm(locs[nodes[start]] - locs[nodes[end]], axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        T = L / R
+        ix = neuron_ix[nodes[start]]
+        return (np.bincount(ix, weights=T, minlength=n_neurons)
+                / np.bincount(ix, minlength=n_neurons))
 
 
 def remove_tagged_branches(x, tag, how='segment', preserve_connectors=False,
@@ -2021,22 +2690,13 @@ def despike_neuron(x, sigma=5, max_spike_length=1, inplace=False,
 
     """
 
-    # TODO:
-    # - flattening all segments first before Spike detection should speed up
-    #   quite a lot
-    # -> as intermediate step: assign all new positions at once
-
     if isinstance(x, core.CatmaidNeuronList):
         if not inplace:
             x = x.copy()
 
-        for n in config.tqdm(x, desc='Despiking', disable=config.pbar_hide,
-                             leave=config.pbar_leave):
-            despike_neuron(n,
-                           sigma=sigma,
-                           max_spike_length=max_spike_length,
-                           reverse=reverse,
-                           inplace=True)
+        # Process all neurons in one go
+        _despike_neurons(x, sigma=sigma, max_spike_length=max_spike_length,
+                         reverse=reverse)
 
         if not inplace:
             return x
@@ -2048,52 +2708,59 @@ def despike_neuron(x, sigma=5, max_spike_length=1, inplace=False,
     if not inplace:
         x = x.copy()
 
-    # Index treenodes table by treenode ID
-    this_treenodes = x.nodes.set_index('treenode_id')
+    _despike_neurons([x], sigma=sigma, max_spike_length=max_spike_length,
+                     reverse=reverse)
+
+    if not inplace:
+        return x
+
+
+def _despike_neurons(neurons, sigma=5, max_spike_length=1, reverse=False):
+    """Despike neurons in place. See :func:`pymaid.despike_neuron`."""
+    parents, offsets = graph_utils._concat_parents(neurons)
+    locs = np.concatenate([n.nodes[['x', 'y', 'z']].values.astype(float)
+                           for n in neurons] + [np.zeros((0, 3))])
 
-    segs_to_walk = x.segments
+    nodes, seg_offsets = graph_utils._long_segment_array(parents)
+    seg_ix = np.repeat(np.arange(len(seg_offsets) - 1),
+                       np.diff(seg_offsets))
+    ends = seg_offsets[1:][seg_ix]
+    starts = seg_offsets[:-1][seg_ix]
 
+    # Positions in the reversed segments
+    rev = starts + ends - 1 - np.arange(len(nodes))
+    walks = [np.arange(len(nodes))]
     if reverse:
-        segs_to_walk += x.segments[::-1]
+        walks.append(rev)
 
     # For each spike length do -> do this in reverse to correct the long
     # spikes first
-    for l in list(range(1, max_spike_length + 1))[::-1]:
-        # Go over all segments
-        for seg in x.segments:
-            # Get nodes A, B and C of this segment
-            this_A = this_treenodes.loc[seg[:-l - 1]]
-            this_B = this_treenodes.loc[seg[l:-1]]
-            this_C = this_treenodes.loc[seg[l + 1:]]
-
-            # Get coordinates
-            A = this_A[['x', 'y', 'z']].values
-            B = this_B[['x', 'y', 'z']].values
-            C = this_C[['x', 'y', 'z']].values
+    for l in range(max_spike_length, 0, -1):
+        for walk in walks:
+            # Get nodes A, B and C for all segments at once
+            seg_nodes = nodes[walk]
+            ix = np.where(np.arange(len(nodes)) + l + 1 < ends)[0]
+            A = locs[seg_nodes[ix]]
+            B = seg_nodes[ix + l]
+            C = locs[seg_nodes[ix + l + 1]]
 
             # Calculate euclidian distances A->B and A->C
-            dist_AB = np.linalg.norm(A - B, axis=1)
+            dist_AB = np.linalg.norm(A - locs[B], axis=1)
             dist_AC = np.linalg.norm(A - C, axis=1)
 
             # Get the spikes
-            spikes_ix = np.where((dist_AB / dist_AC) > sigma)[0]
-            spikes = this_B.iloc[spikes_ix]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                spikes = (dist_AB / dist_AC) > sigma
 
-            if not spikes.empty:
-                # Interpolate new position(s) between A and C
-                new_positions = A[spikes_ix] + (C[spikes_ix] - A[spikes_ix]) / 2
+            # Interpolate new position(s) between A and C
+            locs[B[spikes]] = A[spikes] + (C[spikes] - A[spikes]) / 2
 
-                this_treenodes.loc[spikes.index, ['x', 'y', 'z']] = new_positions
+    for i, n in enumerate(neurons):
+        n.nodes[['x', 'y', 'z']] = locs[offsets[i]:offsets[i + 1]]
 
-    # Reassign treenode table
-    x.nodes = this_treenodes.reset_index(drop=False)
-
-    # The weights in the graph have changed, we need to update that
-    x._clear_temp_attr(exclude=['segments', 'small_segments',
-                                'classify_nodes'])
-
-    if not inplace:
-        return x
+        # The weights in the graph have changed, we need to update that
+        n._clear_temp_attr(exclude=['segments', 'small_segments',
+                                    'classify_nodes'])
 
 
 def guess_radius(x, method='linear', limit=None, smooth=True, inplace=False):
@@ -2126,20 +2793,7 @@ def guess_radius(x, method='linear', limit=None, smooth=True, inplace=False):
 
     """
 
-    if isinstance(x, core.CatmaidNeuronList):
-        if not inplace:
-            x = x.copy()
-
-        for n in config.tqdm(x, desc='Guessing', disable=config.pbar_hide,
-                             leave=config.pbar_leave):
-            guess_radius(n, method=method, limit=limit, smooth=smooth,
-                         inplace=True)
-
-        if not inplace:
-            return x
-        return
-
-    elif not isinstance(x, core.CatmaidNeuron):
+    if not isinstance(x, (core.CatmaidNeuron, core.CatmaidNeuronList)):
         raise TypeError('Can only process CatmaidNeuron or CatmaidNeuronList, '
                         'not "{0}"'.format(type(x)))
 
@@ -2150,65 +2804,163 @@ def guess_radius(x, method='linear', limit=None, smooth=True, inplace=False):
     if isinstance(smooth, bool) and smooth:
         smooth = 5
 
-    # We will be using the index as distance to interpolate. For this we have
-    # to change method 'linear' to 'index'
-    method = 'index' if method == 'linear' else method
+    neurons = x if isinstance(x, core.CatmaidNeuronList) else [x]
 
-    # Collect connectors and calc distances
-    cn = x.connectors.copy()
+    # Process all neurons in one go
+    parents, offsets = graph_utils._concat_parents(neurons)
+    locs = np.concatenate([n.nodes[['x', 'y', 'z']].values.astype(float)
+                           for n in neurons] + [np.zeros((0, 3))])
 
-    # Prepare nodes (add parent_dist for later, set index)
-    _parent_dist(x, root_dist=0)
-    nodes = x.nodes.set_index('treenode_id')
+    # Set undefined radii to NaN
+    radii = np.concatenate([n.nodes.radius.values.astype(float)
+                            for n in neurons] + [np.zeros(0)])
+    radii[radii <= 0] = np.nan
 
     # For each connector (pre and post), get the X/Y distance to its treenode
-    cn_locs = cn[['x', 'y']].values
-    tn_locs = nodes.loc[cn.treenode_id.values,
-                        ['x', 'y']].values
-    dist = np.sqrt(np.sum((tn_locs - cn_locs) ** 2, axis=1).astype(int))
-    cn['dist'] = dist
-
-    # Get max distance per treenode (in case of multiple connectors per
-    # treenode)
-    cn_grouped = cn.groupby('treenode_id').max()
+    # and assign the max distance per treenode as its radius
+    for i, n in enumerate(neurons):
+        if n.connectors.empty:
+            continue
+        cn = n.connectors
+        tn_ix = pd.Series(np.arange(n.nodes.shape[0]) + offsets[i],
+                          index=n.nodes.treenode_id.values)
+        tn_ix = tn_ix.loc[cn.treenode_id.values].values
+        dist = np.sqrt(np.sum((locs[tn_ix, :2] - cn[['x', 'y']].values) ** 2,
+                              axis=1).astype(int))
+        cn_radii = np.full(len(radii), -np.inf)
+        np.maximum.at(cn_radii, tn_ix, dist)
+        has_cn = np.isfinite(cn_radii)
+        radii[has_cn] = cn_radii[has_cn]
+
+    nodes, seg_offsets = graph_utils._long_segment_array(parents)
+    radii = _interp_segments(nodes, seg_offsets, locs, radii, method=method,
+                             limit=limit, smooth=smooth)
 
-    # Set undefined radii to None
-    nodes.loc[nodes.radius <= 0, 'radius'] = None
+    # Set non-interpolated radii back to -1
+    radii[np.isnan(radii)] = -1
 
-    # Assign radii to treenodes
-    nodes.loc[cn_grouped.index, 'radius'] = cn_grouped.dist.values
+    for i, n in enumerate(neurons):
+        n.nodes['radius'] = radii[offsets[i]:offsets[i + 1]]
 
-    # Go over each segment and interpolate radii
-    for s in config.tqdm(x.segments, desc='Interp.', disable=config.pbar_hide,
-                         leave=config.pbar_leave):
+    if not inplace:
+        return x
 
-        # Get this segments radii and parent dist
-        this_radii = nodes.loc[s, ['radius', 'parent_dist']]
-        this_radii['parent_dist_cum'] = this_radii.parent_dist.cumsum()
 
-        # Set cumulative distance as index and drop parent_dist
-        this_radii = this_radii.set_index('parent_dist_cum',
-                                          drop=True).drop('parent_dist',
-                                                          axis=1)
+def _interp_segments(nodes, offsets, locs, values, method='linear',
+                     limit=None, smooth=False):
+    """Interpolate missing values along segments.
 
-        # Interpolate missing radii
-        interp = this_radii.interpolate(method=method, limit_direction='both',
-                                        limit=limit)
+    Segments are processed in order of nesting: the last node of each
+    segment belongs to a previous segment and acts as anchor with its
+    already interpolated value.
 
-        if smooth:
-            interp = interp.rolling(smooth,
-                                    min_periods=1).max()
+    Parameters
+    ----------
+    nodes :     numpy.ndarray
+                Row indices of nodes in segment order.
+    offsets :   numpy.ndarray
+                ``(N_segments + 1, )`` offsets into ``nodes``. See
+                :func:`~pymaid.graph_utils._long_segment_array`.
+    locs :      numpy.ndarray
+                ``(N, 3)`` node coordinates.
+    values :    numpy.ndarray
+                ``(N, )`` values with ``NaN`` for missing ones.
+    method :    str, optional
+                Interpolation method. ``linear`` is vectorized, everything
+                else is passed to ``pandas.Series.interpolate`` per segment.
+    limit :     int, optional
+                Maximum number of consecutive missing values to fill.
+    smooth :    int | False, optional
+                Size of window for trailing rolling max.
 
-        nodes.loc[s, 'radius'] = interp.values
+    Returns
+    -------
+    numpy.ndarray
+                Interpolated values.
 
-    # Set non-interpolated radii back to -1
-    nodes.loc[nodes.radius.isnull(), 'radius'] = -1
+    """
+    values = np.array(values, dtype=float)
+    n_segs = len(offsets) - 1
+    if not n_segs:
+        return values
+
+    seg_ix = np.repeat(np.arange(n_segs), np.diff(offsets))
+    pos = np.arange(len(nodes))
+
+    # Each node is owned by the first segment it shows up in
+    _, first = np.unique(nodes, return_index=True)
+    owner = np.empty(len(values), dtype=int)
+    owner[nodes[first]] = seg_ix[first]
+    is_owned = np.zeros(len(nodes), dtype=bool)
+    is_owned[first] = True
+
+    # Segments are nested: a segment depends on the one owning its last node
+    seg_parent = owner[nodes[offsets[1:] - 1]]
+    seg_parent[seg_parent == np.arange(n_segs)] = -1
+    _, level = graph_utils._jump_to(seg_parent, np.zeros(n_segs, dtype=bool))
+
+    # Cumulative distance along segments, offset between segments so that
+    # we can interpolate all segments at once
+    dist = np.zeros(len(nodes))
+    dist[1:] = np.linalg.norm(np.diff(locs[nodes], axis=0), axis=1)
+    dist[offsets[:-1]] = 0
+    cum = np.cumsum(dist)
+    cum -= cum[offsets[:-1]][seg_ix]
+    cum += seg_ix * (cum.max() + 1)
+
+    for lvl in range(level.max() + 1):
+        this = np.isin(seg_ix, np.where(level == lvl)[0])
+        ix, v = pos[this], values[nodes[this]]
+        this_seg = seg_ix[this]
+
+        # Previous and next known value within the same segment
+        known = ~np.isnan(v)
+        prv = np.maximum.accumulate(np.where(known, np.arange(len(v)), -1))
+        nxt = np.minimum.accumulate(np.where(known, np.arange(len(v)),
+                                             len(v))[::-1])[::-1]
+        has_prv = prv >= 0
+        has_prv[has_prv] = this_seg[prv[has_prv]] == this_seg[has_prv]
+        has_nxt = nxt < len(v)
+        has_nxt[has_nxt] = this_seg[nxt[has_nxt]] == this_seg[has_nxt]
+
+        if method == 'linear':
+            new = v.copy()
+            if known.any():
+                both = ~known & has_prv & has_nxt
+                new[both] = np.interp(cum[ix][both], cum[ix][known], v[known])
+
+                # Beyond the first/last known value use the nearest one
+                only_prv = ~known & has_prv & ~has_nxt
+                only_nxt = ~known & ~has_prv & has_nxt
+                new[only_prv] = v[prv[only_prv]]
+                new[only_nxt] = v[nxt[only_nxt]]
+        else:
+            new = np.concatenate([pd.Series(v[this_seg == s],
+                                            index=cum[ix][this_seg == s]
+                                            ).interpolate(method=method,
+                                                          limit_direction='both').values
+                                  for s in np.unique(this_seg)])
+
+        # Only fill gaps up to the given number of nodes from a known value
+        if limit:
+            gap = np.minimum(np.where(has_prv, np.arange(len(v)) - prv, np.inf),
+                             np.where(has_nxt, nxt - np.arange(len(v)), np.inf))
+            new[~known & (gap > limit)] = np.nan
+
+        # Trailing rolling max (ignoring NaNs) within segments
+        if smooth:
+            sm = new.copy()
+            for k in range(1, int(smooth)):
+                src = np.arange(len(v)) - k
+                ok = src >= 0
+                ok[ok] = this_seg[src[ok]] == this_seg[ok]
+                sm[ok] = np.fmax(sm[ok], new[src[ok]])
+            new = sm
 
-    # Reassign nodes
-    x.nodes = nodes.reset_index(drop=False)
+        own = is_owned[ix]
+        values[nodes[ix[own]]] = new[own]
 
-    if not inplace:
-        return x
+    return values
 
 
 def smooth_neuron(x, window=5, inplace=False):
@@ -2234,9 +2986,8 @@ def smooth_neuron(x, window=5, inplace=False):
         if not inplace:
             x = x.copy()
 
-        for n in config.tqdm(x, desc='Smoothing', disable=config.pbar_hide,
-                             leave=config.pbar_leave):
-            smooth_neuron(n, window=window, inplace=True)
+        # Process all neurons in one go
+        _smooth_neurons(x, window=window)
 
         if not inplace:
             return x
@@ -2249,34 +3000,37 @@ def smooth_neuron(x, window=5, inplace=False):
     if not inplace:
         x = x.copy()
 
-    # Prepare nodes (add parent_dist for later, set index)
-    _parent_dist(x, root_dist=0)
-    nodes = x.nodes.set_index('treenode_id')
+    _smooth_neurons([x], window=window)
 
-    # Go over each segment and interpolate radii
-    for s in config.tqdm(x.segments, desc='Smoothing',
-                         disable=config.pbar_hide,
-                         leave=config.pbar_leave):
+    if not inplace:
+        return x
 
-        # Get this segments radii and parent dist
-        this_co = nodes.loc[s, ['x', 'y', 'z', 'parent_dist']]
-        this_co['parent_dist_cum'] = this_co.parent_dist.cumsum()
 
-        # Set cumulative distance as index and drop parent_dist
-        this_co = this_co.set_index('parent_dist_cum',
-                                    drop=True).drop('parent_dist', axis=1)
+def _smooth_neurons(neurons, window=5):
+    """Smooth neurons in place. See :func:`pymaid.smooth_neuron`."""
+    parents, offsets = graph_utils._concat_parents(neurons)
+    locs = np.concatenate([n.nodes[['x', 'y', 'z']].values.astype(float)
+                           for n in neurons] + [np.zeros((0, 3))])
 
-        interp = this_co.rolling(window, min_periods=1).mean()
+    nodes, seg_offsets = graph_utils._long_segment_array(parents)
+    seg_ix = np.repeat(np.arange(len(seg_offsets) - 1),
+                       np.diff(seg_offsets))
+    starts = seg_offsets[:-1][seg_ix]
 
-        nodes.loc[s, ['x', 'y', 'z']] = interp.values
+    # Rolling mean over the (up to) `window` previous nodes in each segment
+    pos = np.arange(len(nodes))
+    lo = np.maximum(starts, pos - window + 1)
+    cum = np.concatenate([np.zeros((1, 3)), np.cumsum(locs[nodes], axis=0)])
+    interp = (cum[pos + 1] - cum[lo]) / (pos + 1 - lo)[:, None]
 
-    # Reassign nodes
-    x.nodes = nodes.reset_index(drop=False)
+    # Each node is updated by the first segment it shows up in - i.e. the
+    # segment it belongs to (or the first segment ending in a root)
+    _, first = np.unique(nodes, return_index=True)
+    locs[nodes[first]] = interp[first]
 
-    x._clear_temp_attr()
-
-    if not inplace:
-        return x
+    for i, n in enumerate(neurons):
+        n.nodes[['x', 'y', 'z']] = locs[offsets[i]:offsets[i + 1]]
+        n._clear_temp_attr()
 
 
 def time_machine(x, target, inplace=False, remote_instance=None):
@@ -2296,92 +3050,215 @@ def time_machine(x, target, inplace=False, remote_instance=None):
     1. Removal of tags/annotations: i.e. we know when e.g. a tag was added
        and that it was subsequently removed at some point but not when.
 
+    Histories of all neurons are fetched concurrently and only once - even
+    if multiple targets are given.
+
     Parameters
     ----------
     x :                 skeleton ID(s) | CatmaidNeuron | CatmaidNeuronList
                         Neuron(s) to rejuvenate.
-    target :            str | datetime-like | pandas.Timestamp
+    target :            str | datetime-like | pandas.Timestamp | list thereof
                         Date or date + time to time-travel to. Must be
                         parsable by ``pandas.TimeStamp``. Format for string
-                        is YEAR-MONTH-DAY.
+                        is YEAR-MONTH-DAY. Provide a list of dates to get
+                        multiple snapshots in one go.
     inplace :           bool, optional
-                        If True, will perform time travel on and return a copy
-                        of original.
+                        If True, will perform time travel on original
+                        neuron(s). Not possible with multiple targets.
     remote_instance :   CatmaidInstance, optional
 
     Returns
     -------
     CatmaidNeuron/List
-                        A younger version of the neuron(s).
+                        A younger version of the neuron(s). If multiple
+                        targets are given, returns a list with one
+                        CatmaidNeuron/List per target.
 
     Examples
     --------
     >>> n = pymaid.get_neuron(16)
     >>> previous_n = pymaid.time_machine(n, '2016-12-1')
+    >>> # Get multiple snapshots at once
+    >>> snaps = pymaid.time_machine(n, ['2016-6-1', '2016-12-1', '2017-6-1'])
 
     """
     remote_instance = utils._eval_remote_instance(remote_instance)
 
-    if isinstance(x, core.CatmaidNeuronList):
-        return core.CatmaidNeuronList([time_machine(n, target,
-                                                    inplace=inplace,
-                                                    remote_instance=remote_instance)
-                                  for n in config.tqdm(x,
-                                                       'Traveling time',
-                                                       disable=config.pbar_hide,
-                                                       leave=config.pbar_leave)])
+    multi = isinstance(target, (list, tuple, np.ndarray, pd.Series,
+                                pd.DatetimeIndex))
+    targets = [_to_utc(t) for t in (target if multi else [target])]
 
-    if not isinstance(x, core.CatmaidNeuron):
+    now = pd.Timestamp.now(tz='UTC')
+    if any([t > now for t in targets]):
+        raise ValueError("This is not Back to the Future II: for forward time "
+                         "travel, you'll have to trace yourself.")
+
+    if multi and inplace:
+        raise ValueError('Unable to time travel inplace to multiple targets.')
+
+    # Neurons we fetched ourselves can be changed in place (single target)
+    fetched = False
+    if not isinstance(x, (core.CatmaidNeuron, core.CatmaidNeuronList)):
         x = fetch.get_neuron(x, remote_instance=remote_instance)
+        fetched = True
 
-    if not inplace:
-        x = x.copy()
+    neurons = x if isinstance(x, core.CatmaidNeuronList) else [x]
 
-    if not isinstance(target, pd.Timestamp):
-        target = pd.Timestamp(target)
+    history = _fetch_history([n.skeleton_id for n in neurons], now,
+                             remote_instance=remote_instance)
 
-    # Need to localize all timestamps
-    target = target.tz_localize('UTC')
+    snapshots = []
+    for t in targets:
+        snap = x if (inplace or (fetched and not multi)) else x.copy()
+        this_neurons = snap if isinstance(snap, core.CatmaidNeuronList) else [snap]
+        for n in this_neurons:
+            n.nodes, n.connectors, n.annotations, n.tags = _time_travel(
+                                            history[str(n.skeleton_id)], t)
+            n._clear_temp_attr()
+        snapshots.append(snap)
 
-    if target > pd.Timestamp.now().tz_localize('UTC'):
-        raise ValueError("This is not Back to the Future II: for forward time "
-                         "travel, you'll have to trace yourself.")
+    if multi:
+        return snapshots
 
-    # First get the entire history of the neuron
-    url = remote_instance._get_compact_details_url(x.skeleton_id,
-                                                   with_history=True,
-                                                   with_merge_history=True,
-                                                   with_connectors=True,
-                                                   with_tags=True,
-                                                   with_annotations=True)
-    data = remote_instance.fetch(url)
-
-    # Turn stuff into DataFrames for easier sifting/sorting
-    nodes = pd.DataFrame(data[0], columns=['treenode_id', 'parent_id',
-                                           'user_id', 'x', 'y', 'z', 'radius',
-                                           'confidence', 'creation_timestamp',
-                                           'modified_timestamp', 'ordering_by'])
-    nodes.loc[:, 'parent_id'] = nodes.parent_id.values.astype(object)
-    nodes.loc[~nodes.parent_id.isnull(), 'parent_id'] = nodes.loc[~nodes.parent_id.isnull(), 'parent_id'].map(int)
-    nodes.loc[nodes.parent_id.isnull(), 'parent_id'] = None
+    if not inplace or fetched:
+        return snapshots[0]
+
+    return
+
+
+def _to_utc(t):
+    """Turn datetime-like into UTC ``pandas.Timestamp``."""
+    t = pd.Timestamp(t)
+    return t.tz_localize('UTC') if t.tzinfo is None else t.tz_convert('UTC')
+
+
+def _fetch_history(skids, now, remote_instance=None):
+    """Fetch and parse history for multiple neurons.
+
+    Parameters
+    ----------
+    skids :             list
+                        Skeleton IDs to fetch history for.
+    now :               pandas.Timestamp
+                        Time stamp to use as end of validity for nodes and
+                        connectors that still exist.
+    remote_instance :   CatmaidInstance, optional
+
+    Returns
+    -------
+    dict
+                        ``{skeleton_id: (nodes, connectors, links,
+                        annotations, tags)}``
+
+    """
+    remote_instance = utils._eval_remote_instance(remote_instance)
+
+    # Fetch histories of all neurons concurrently
+    urls = [remote_instance._get_compact_details_url(s,
+                                                     with_history=True,
+                                                     with_merge_history=True,
+                                                     with_connectors=True,
+                                                     with_tags=True,
+                                                     with_annotations=True)
+            for s in skids]
+    data = remote_instance.fetch(urls, desc='Fetching history')
 
-    connectors = pd.DataFrame(data[1], columns=['treenode_id', 'connector_id',
-                                                'relation', 'x', 'y', 'z',
-                                                'creation_timestamp',
-                                                'modified_timestamp'])
-    # This is a dictionary with {'tag': [[treenode_id, date_tagged], ...]}
-    tags = data[2]
-    annotations = pd.DataFrame(data[4], columns=['annotation_id',
-                                                 'annotated_timestamp'])
     an_list = fetch.get_annotation_list(remote_instance=remote_instance)
-    annotations['annotation'] = annotations.annotation_id.map(an_list.set_index('id').name.to_dict())
+    an_list = an_list.set_index('id').name.to_dict()
+
+    links = fetch.get_connector_links(skids, remote_instance=remote_instance)
+    links['skeleton_id'] = links.skeleton_id.astype(str)
+    links['creation_time'] = pd.to_datetime(links.creation_time, utc=True)
+    links = dict(list(links.groupby('skeleton_id')))
+
+    # Concatenate everything to parse timestamps only once
+    nodes = pd.concat([pd.DataFrame(d[0], columns=['treenode_id', 'parent_id',
+                                                   'user_id', 'x', 'y', 'z',
+                                                   'radius', 'confidence',
+                                                   'creation_timestamp',
+                                                   'modified_timestamp',
+                                                   'ordering_by'])
+                       for d in data], axis=0, keys=range(len(data)))
+    connectors = pd.concat([pd.DataFrame(d[1], columns=['treenode_id',
+                                                        'connector_id',
+                                                        'relation', 'x', 'y',
+                                                        'z',
+                                                        'creation_timestamp',
+                                                        'modified_timestamp'])
+                            for d in data], axis=0, keys=range(len(data)))
+    annotations = pd.concat([pd.DataFrame(d[4], columns=['annotation_id',
+                                                         'annotated_timestamp'])
+                             for d in data], axis=0, keys=range(len(data)))
+
+    for df in [nodes, connectors]:
+        for ts in ['creation_timestamp', 'modified_timestamp']:
+            df[ts] = pd.to_datetime(df[ts], utc=True)
+
+        # Nodes/connectors where creation_timestamp is younger than the
+        # modified_timestamp are the current versions -> valid until now
+        df.loc[df.creation_timestamp > df.modified_timestamp,
+               'modified_timestamp'] = now
+
+    annotations['annotated_timestamp'] = pd.to_datetime(annotations.annotated_timestamp,
+                                                        utc=True)
+    annotations['annotation'] = annotations.annotation_id.map(an_list)
+
+    # Remove nodes without a window (these seems to be temporary states)
+    nodes = nodes[nodes.creation_timestamp != nodes.modified_timestamp].copy()
+    connectors = connectors[connectors.creation_timestamp != connectors.modified_timestamp].copy()
+
+    # Make parent IDs integers (or None)
+    nodes['parent_id'] = nodes.parent_id.astype(object)
+    nodes.loc[nodes.parent_id.isnull(), 'parent_id'] = None
+    has_parent = nodes.parent_id.notnull()
+    nodes.loc[has_parent, 'parent_id'] = nodes.loc[has_parent, 'parent_id'].map(int)
+
+    # Split back into individual neurons
+    empty_nodes, empty_cn, empty_an = [df.iloc[:0].reset_index(drop=True)
+                                       for df in [nodes, connectors,
+                                                  annotations]]
+    nodes, connectors, annotations = [{k: v.reset_index(drop=True)
+                                       for k, v in df.groupby(level=0)}
+                                      for df in [nodes, connectors,
+                                                 annotations]]
+
+    history = {}
+    for i, (s, d) in enumerate(zip(skids, data)):
+        # This is a dictionary with {'tag': [[treenode_id, date_tagged], ...]}
+        tags = {t: (np.array([e[0] for e in d[2][t]]),
+                    pd.to_datetime([e[1] for e in d[2][t]], utc=True))
+                for t in d[2]}
+
+        this_links = links.get(str(s), pd.DataFrame([], columns=['connector_id',
+                                                                 'treenode_id',
+                                                                 'creation_time']))
+
+        history[str(s)] = (nodes.get(i, empty_nodes),
+                           connectors.get(i, empty_cn),
+                           this_links,
+                           annotations.get(i, empty_an),
+                           tags)
+
+    return history
+
+
+def _time_travel(history, target):
+    """Reconstruct neuron at given time from its history.
+
+    Parameters
+    ----------
+    history :   tuple
+                ``(nodes, connectors, links, annotations, tags)`` as returned
+                by :func:`~pymaid.morpho._fetch_history`.
+    target :    pandas.Timestamp
+                UTC time stamp to travel to.
+
+    Returns
+    -------
+    nodes, connectors, annotations, tags
 
-    # Convert stuff to timestamps
-    for ts in ['creation_timestamp', 'modified_timestamp']:
-        nodes[ts] = nodes[ts].map(pd.Timestamp)
-        connectors[ts] = connectors[ts].map(pd.Timestamp)
-    annotations['annotated_timestamp'] = annotations['annotated_timestamp'].map(pd.Timestamp)
-    tags = {t: [[e[0], pd.Timestamp(e[1])] for e in tags[t]] for t in tags}
+    """
+    nodes, connectors, links, annotations, tags = history
 
     # General rules:
     # 1. creation_timestamp and modified timestamp represent a validity
@@ -2393,86 +3270,67 @@ def time_machine(x, target, inplace=False, remote_instance=None):
     #    modification time.
     # 4. Useful little detail: nodes/connectors are ordered by new -> old
 
-    # First change the modified_timestamp for nodes that still exist
-    # (see rule 2) to right now
-    nodes.loc[nodes.creation_timestamp > nodes.modified_timestamp, 'modified_timestamp'] = pd.Timestamp.now().tz_localize('UTC')
-    connectors.loc[connectors.creation_timestamp > connectors.modified_timestamp, 'modified_timestamp'] = pd.Timestamp.now().tz_localize('UTC')
-
-    # Remove nodes without a window (these seems to be temporary states)
-    nodes = nodes[nodes.creation_timestamp != nodes.modified_timestamp]
-    connectors = connectors[connectors.creation_timestamp != connectors.modified_timestamp]
-
-    # Second subset to versions of the nodes that existed at given time
-    before_nodes = nodes[(nodes.creation_timestamp <= target) & (nodes.modified_timestamp >= target)]
-    before_connectors = connectors[(connectors.creation_timestamp <= target) & (connectors.modified_timestamp >= target)]
+    # Subset to versions of the nodes that existed at given time
+    before_nodes = nodes[(nodes.creation_timestamp <= target).values
+                         & (nodes.modified_timestamp >= target).values].copy()
+    before_connectors = connectors[(connectors.creation_timestamp <= target).values
+                                   & (connectors.modified_timestamp >= target).values].copy()
 
     # Now fix tags and annotations
-    before_annotations = annotations[annotations.annotated_timestamp <= target]
-    before_tags = {t: [e[0] for e in tags[t] if e[1] <= target] for t in tags}
+    before_annotations = annotations[(annotations.annotated_timestamp <= target).values].copy()
+    before_tags = {t: tags[t][0][(tags[t][1] <= target)].tolist() for t in tags}
     before_tags = {t: before_tags[t] for t in before_tags if before_tags[t]}
 
-    x.nodes = before_nodes.copy()
-    x.connectors = before_connectors.copy()
-    x.annotations = before_annotations.copy()
-    x.tags = before_tags
-
     # We might end up with multiple disconnected pieces - I don't yet know why
-    x.nodes.loc[~x.nodes.parent_id.isin(x.nodes.treenode_id), 'parent_id'] = None
+    before_nodes.loc[~before_nodes.parent_id.isin(before_nodes.treenode_id), 'parent_id'] = None
 
     # If there is more than one root, we have to remove the disconnected
     # pieces and keep only the "oldest branch".
     # The theory for doing this is: if a node shows up as "root" and the very
     # next step is that it is a child to another node, we should consider
     # it a not-yet connected branch that needs to be removed.
-    roots = x.nodes[x.nodes.parent_id.isnull()].treenode_id.tolist()
-    if len(roots) > 1:
-        after_nodes = nodes[nodes.modified_timestamp > target]
-        for r in roots:
-            # Find the next version of this node
-            nv = after_nodes[(after_nodes.treenode_id == r)]
-            # If this node is not a root anymore in its next iteration, it's
-            # not the "real" one
-            if not nv.empty and nv.iloc[-1].parent_id is not None:
-                roots.remove(r)
+    parents = graph_utils._parent_index(before_nodes)
+    is_root = parents < 0
+    if is_root.sum() > 1:
+        # Find the next version of each root (nodes are ordered new -> old)
+        after_nodes = nodes[(nodes.modified_timestamp > target).values]
+        next_version = after_nodes.drop_duplicates('treenode_id', keep='last')
+        next_version = next_version.set_index('treenode_id').parent_id
+        next_parent = before_nodes.treenode_id.map(next_version).values
+
+        # If this node is not a root anymore in its next iteration, it's
+        # not the "real" one
+        real = is_root & pd.isnull(next_parent)
 
         # Get disconnected components
-        g = graph.neuron2nx(x)
-        subgraphs = [l for l in nx.connected_components(nx.to_undirected(g))]
+        comp, _ = graph_utils._jump_to(parents, is_root)
+        comp[is_root] = np.where(is_root)[0]
 
         # If we have a winner root, keep the bit that it is part of
-        if len(roots) == 1:
-            keep = [l for l in subgraphs if roots[0] in l][0]
+        if real.sum() == 1:
+            keep = comp == np.where(real)[0][0]
         # If we have multiple winners (unlikely) or none (e.g. if the "real"
         # root got rerooted too) go for the biggest branch
         else:
-            keep = sorted(subgraphs, key=lambda x: len(x), reverse=True)[0]
+            keep = comp == np.bincount(comp).argmax()
 
-        x.nodes = x.nodes[x.nodes.treenode_id.isin(keep)].copy()
+        before_nodes = before_nodes[keep]
 
     # Remove connectors where the treenode does not even exist yet
-    x.connectors = x.connectors[x.connectors.treenode_id.isin(x.nodes.treenode_id)]
-
-    # Take care of connectors where the treenode might exist but was not yet linked
-    links = fetch.get_connector_links(x.skeleton_id)
-    #localize = lambda x: pd.Timestamp.tz_localize(x, 'UTC')
-    #links['creation_time'] = links.creation_time.map(localize)
-    links = links[links.creation_time <= target]
-    links['connector_id'] = links.connector_id.astype(int)
-    links['treenode_id'] = links.treenode_id.astype(int)
+    before_connectors = before_connectors[before_connectors.treenode_id.isin(before_nodes.treenode_id).values]
 
-    # Get connector ID -> treenode combinations
-    l = links[['connector_id', 'treenode_id']].T.apply(tuple)
-    c = x.connectors[['connector_id', 'treenode_id']].T.apply(tuple)
+    # Take care of connectors where the treenode might exist but was not yet
+    # linked: keep only those where connector->treenode link is present
+    links = links[(links.creation_time <= target).values]
+    links = pd.MultiIndex.from_arrays([links.connector_id.astype(int),
+                                       links.treenode_id.astype(int)])
+    is_linked = pd.MultiIndex.from_arrays([before_connectors.connector_id.astype(int),
+                                           before_connectors.treenode_id.astype(int)]).isin(links)
+    before_connectors = before_connectors[is_linked]
 
-    # Keep only those where connector->treenode connection is present
-    x.connectors = x.connectors[c.isin(l)]
-
-    x._clear_temp_attr()
-
-    if not inplace:
-        return x
-
-    return
+    return (before_nodes.reset_index(drop=True),
+            before_connectors.reset_index(drop=True),
+            before_annotations, before_tags)
 
 
 def break_fragments(x):
@@ -2578,18 +3436,69 @@ def heal_fragmented_neuron(x, min_size=0, method='LEAFS', inplace=False):
     if not isinstance(x, core.CatmaidNeuron):
         raise TypeError('Expected CatmaidNeuron/List, got "{}"'.format(type(x)))
 
+    if not inplace:
+        x = x.copy()
+
     # Don't do anything if not actually fragmented
     if x.n_skeletons > 1:
-        frags = break_fragments(x)
-        healed = stitch_neurons(*[f for f in frags if f.n_nodes > min_size],
-                                method=method)
-        if not inplace:
-            return healed
+        # Label nodes by the root of their fragment
+        parents = graph_utils._parent_index(x)
+        is_root = parents < 0
+        frags, _ = graph_utils._jump_to(parents, is_root)
+        frags[is_root] = np.where(is_root)[0]
+
+        # Drop fragments that are too small
+        too_small = np.bincount(frags, minlength=frags.shape[0]) <= min_size
+        too_small = too_small[frags]
+        if np.any(too_small):
+            graph_utils.subset_neuron(x,
+                                      x.nodes.treenode_id.values[~too_small],
+                                      inplace=True)
+            parents = graph_utils._parent_index(x)
+            is_root = parents < 0
+            frags, _ = graph_utils._jump_to(parents, is_root)
+            frags[is_root] = np.where(is_root)[0]
+
+        locs = x.nodes[['x', 'y', 'z']].values.astype(float)
+
+        if method == 'LEAFS':
+            n_childs = np.bincount(parents[~is_root],
+                                   minlength=parents.shape[0])
+            cand = np.where((n_childs == 0) | is_root)[0]
+        else:
+            cand = np.arange(parents.shape[0])
+
+        edges = _stitch_mst(locs[cand], frags[cand])
+
+        # Keep the root of the fragment with the soma or the longest one
+        tn_ids = x.nodes.treenode_id.values
+        soma = x.soma
+        if isinstance(soma, type(None)):
+            soma = []
+        with_soma = np.isin(tn_ids, utils._make_iterable(soma))
+        if np.any(with_soma):
+            root = frags[np.where(with_soma)[0][0]]
         else:
-            x.nodes = healed.nodes  # update nodes
-            x.tags = healed.tags  # update tags
-            x._clear_temp_attr()
-    elif not inplace:
+            edge_len = np.zeros(parents.shape[0])
+            edge_len[~is_root] = np.linalg.norm(locs[~is_root]
+                                                - locs[parents[~is_root]],
+                                                axis=1)
+            cable = np.bincount(frags, weights=edge_len,
+                                minlength=frags.shape[0])
+            root = np.argmax(np.where(is_root, cable, -1))
+
+        new_edges = np.array([(cand[i], cand[j]) for i, j, _ in edges],
+                             dtype=int).reshape(-1, 2)
+        x.nodes['parent_id'] = _connect_nodes(tn_ids, parents, new_edges,
+                                              root)
+
+        # Add node tags
+        x.tags['stitched'] = x.tags.get('stitched', []) + \
+            tn_ids[new_edges.ravel()].tolist()
+
+        x._clear_temp_attr()
+
+    if not inplace:
         return x
 
 
@@ -2665,6 +3574,12 @@ def prune_twigs(x, size, exclude_tags=None, inplace=False, recursive=False):
     CatmaidNeuron/List
                     Pruned neuron(s).
 
+    Notes
+    -----
+    All rounds of recursive pruning are computed in a single bottom-up pass
+    by tracking in which round each twig becomes terminal. Neuronlists are
+    processed in one go.
+
     See Also
     --------
     :func:`pymaid.longest_neurite`
@@ -2687,78 +3602,184 @@ def prune_twigs(x, size, exclude_tags=None, inplace=False, recursive=False):
     True
 
     """
-    if isinstance(x, core.CatmaidNeuronList):
-        if not inplace:
-            x = x.copy()
-
-        [prune_twigs(n,
-                     size=size,
-                     exclude_tags=exclude_tags,
-                     inplace=True,
-                     recursive=recursive) for n in config.tqdm(x,
-                                                               desc='Pruning',
-                                                               disable=config.pbar_hide,
-                                                               leave=config.pbar_leave)]
-
-        if not inplace:
-            return x
-        else:
-            return None
-    elif isinstance(x, core.CatmaidNeuron):
-        neuron = x
-    else:
+    if not isinstance(x, (core.CatmaidNeuron, core.CatmaidNeuronList)):
         raise TypeError('Expected CatmaidNeuron/List, got {}'.format(type(x)))
 
     # If people set recursive=True, assume that they mean float("inf")
-    if isinstance(recursive, bool) and recursive:
-        recursive = float('inf')
+    if isinstance(recursive, bool):
+        recursive = float('inf') if recursive else 0
 
     # Make a copy if necessary before making any changes
     if not inplace:
-        neuron = neuron.copy()
+        x = x.copy()
 
-    # Convert units to microns
-    size *= 1000
+    neurons = x if isinstance(x, core.CatmaidNeuronList) else [x]
 
-    # Find terminal nodes
-    leafs = neuron.nodes[neuron.nodes.type == 'end'].treenode_id.values
+    if isinstance(exclude_tags, type(None)):
+        exclude_tags = []
+    exclude_tags = utils._make_iterable(exclude_tags)
 
-    # Exclude if tagged
-    if not isinstance(exclude_tags, type(None)):
-        exclude_tags = utils._make_iterable(exclude_tags)
-        exclude_leafs = [n for t in exclude_tags for n in neuron.tags.get(t, [])]
+    # Process all neurons in one go
+    n_nodes = np.array([n.nodes.shape[0] for n in neurons], dtype=int)
+    offsets = np.concatenate([[0], np.cumsum(n_nodes)]).astype(int)
 
-        leafs = set(leafs) - set(exclude_leafs)
+    parents = [graph_utils._parent_index(n) for n in neurons]
+    parents = np.concatenate([np.where(p >= 0, p + o, -1)
+                              for p, o in zip(parents, offsets)] + [[]])
+    parents = parents.astype(int)
+    locs = np.concatenate([n.nodes[['x', 'y', 'z']].values.astype(float)
+                           for n in neurons] + [np.zeros((0, 3))])
 
-    # Find terminal segments
-    segs = graph_utils._break_segments(neuron)
-    segs = np.array([s for s in segs if s[0] in leafs])
+    # Leafs with any of the tags are protected
+    protected = [n.nodes.treenode_id.isin([tn for t in exclude_tags
+                                           for tn in n.tags.get(t, [])]).values
+                 for n in neurons]
+    protected = np.concatenate(protected + [np.zeros(0, dtype=bool)])
 
-    # Get segment lengths
-    seg_lengths = np.array([graph_utils.segment_length(neuron, s) for s in segs])
+    # Convert units to microns
+    remove = _twigs_to_prune(parents, locs, size * 1000, protected,
+                             rounds=recursive + 1)
+
+    for i, n in enumerate(config.tqdm(neurons, desc='Pruning',
+                                      disable=config.pbar_hide,
+                                      leave=config.pbar_leave)):
+        this = remove[offsets[i]:offsets[i + 1]]
+        if this.any():
+            graph_utils.subset_neuron(n,
+                                      n.nodes.treenode_id.values[~this],
+                                      inplace=True)
 
-    # Find out which to delete
-    segs_to_delete = segs[seg_lengths <= size]
+    if not inplace:
+        return x
+    else:
+        return None
 
-    if segs_to_delete.any():
-        # Unravel the into list of node IDs -> skip the last parent
-        nodes_to_delete = [n for s in segs_to_delete for n in s[:-1]]
 
-        # Subset neuron
-        nodes_to_keep = neuron.nodes[~neuron.nodes.treenode_id.isin(nodes_to_delete)].treenode_id.values
-        graph_utils.subset_neuron(neuron,
-                                  nodes_to_keep,
-                                  inplace=True)
+def _twigs_to_prune(parents, locs, size, protected, rounds=float('inf')):
+    """Find nodes belonging to terminal twigs under a given size.
 
-        # Go recursive
-        if recursive:
-            recursive -= 1
-            prune_twigs(neuron, size=size, inplace=True, recursive=recursive)
+    Parameters
+    ----------
+    parents :   numpy.ndarray
+                Parent index for each node, ``-1`` for roots. See
+                :func:`~pymaid.graph_utils._parent_index`. May contain
+                multiple trees.
+    locs :      numpy.ndarray
+                ``(N, 3)`` node coordinates.
+    size :      float
+                Twigs up to this length [nm] will be pruned.
+    protected : numpy.ndarray of bool
+                Leafs that must not be pruned.
+    rounds :    int | float("inf")
+                Rounds of pruning. Use ``float("inf")`` to prune until no
+                more twigs under the given size are left.
 
-    if not inplace:
-        return neuron
-    else:
-        return None
+    Returns
+    -------
+    numpy.ndarray of bool
+                True for nodes to remove.
+
+    """
+    n = parents.shape[0]
+    has_parent = parents >= 0
+    n_childs = np.bincount(parents[has_parent], minlength=n)
+
+    # Only leafs, branch points and roots are relevant -> collapse the rest
+    is_key = (n_childs != 1) | ~has_parent
+    is_head = is_key & has_parent
+    key_parent, _ = graph_utils._jump_to(parents, is_key)
+    key_parent[~is_head] = -1
+
+    edge_len = np.zeros(n)
+    edge_len[has_parent] = np.linalg.norm(locs[has_parent]
+                                          - locs[parents[has_parent]], axis=1)
+    dist = graph_utils._dist_to_root(parents, edge_len)
+
+    # Length of the segment between each key node and its key parent
+    seg_len = np.zeros(n)
+    seg_len[is_head] = dist[is_head] - dist[key_parent[is_head]]
+
+    protected = protected & (n_childs == 0)
+    is_root = ~has_parent
+
+    _, depth = graph_utils._jump_to(key_parent, np.zeros(n, dtype=bool))
+    depth[~is_head] = -1
+    levels = graph_utils._group_by_depth(depth)
+
+    # For each key node: the round in which the twig running through it
+    # becomes terminal and the length of that twig. Leafs are terminal right
+    # away, key nodes that remain branch points never are.
+    ready = np.full(n, np.inf)
+    twig_len = np.full(n, np.inf)
+
+    pruned = np.zeros(n, dtype=bool)
+    last_pruned = np.zeros(n)
+    n_surv = np.zeros(n, dtype=int)
+    surv_ready = np.zeros(n)
+    surv_len = np.zeros(n)
+
+    # Bottom-up: all childs of a key node are on the same level
+    for this in levels:
+        leaf = n_childs[this] == 0
+        surv = n_surv[this]
+        after = last_pruned[this] + 1
+
+        # Leafs are terminal in the first round
+        ready[this] = np.where(leaf, 1, np.inf)
+        twig_len[this] = np.where(leaf & ~protected[this], seg_len[this],
+                                  np.inf)
+
+        # Branch points with no twigs left become leafs
+        gone = ~leaf & (surv == 0)
+        ready[this[gone]] = after[gone]
+        twig_len[this[gone]] = seg_len[this[gone]]
+
+        # Branch points with a single twig left extend that twig
+        single = ~leaf & (surv == 1)
+        ready[this[single]] = np.maximum(after[single],
+                                         surv_ready[this[single]])
+        twig_len[this[single]] = (seg_len[this[single]]
+                                  + surv_len[this[single]])
+
+        # Twigs are pruned in the round they become terminal if they are
+        # short enough - but only as long as their proximal key node is
+        # still a branch point (or root), i.e. has at least two twigs left
+        # at the start of that round
+        parent = key_parent[this]
+        cand = (twig_len[this] <= size) & (ready[this] <= rounds)
+
+        srt = np.lexsort((ready[this], parent))
+        p_srt, r_srt, c_srt = parent[srt], ready[this][srt], cand[srt]
+        cum = np.cumsum(c_srt) - c_srt
+        new_parent = np.concatenate([[True], p_srt[1:] != p_srt[:-1]])
+        new_round = new_parent | np.concatenate([[True],
+                                                 r_srt[1:] != r_srt[:-1]])
+        parent_start = np.where(new_parent)[0][np.cumsum(new_parent) - 1]
+        round_start = np.where(new_round)[0][np.cumsum(new_round) - 1]
+        pruned_before = cum[round_start] - cum[parent_start]
+
+        prune = np.zeros(this.shape[0], dtype=bool)
+        prune[srt] = c_srt & ((n_childs[p_srt] - pruned_before >= 2)
+                              | is_root[p_srt])
+        pruned[this] = prune
+
+        np.maximum.at(last_pruned, parent[prune], ready[this[prune]])
+        np.add.at(n_surv, parent[~prune], 1)
+        np.maximum.at(surv_ready, parent[~prune], ready[this[~prune]])
+        np.maximum.at(surv_len, parent[~prune], twig_len[this[~prune]])
+
+    # Top-down: everything distal to a pruned twig goes too
+    for this in levels[::-1]:
+        pruned[this] |= pruned[key_parent[this]]
+
+    # Map from key nodes to the slab nodes proximal to them
+    child = np.full(n, -1, dtype=int)
+    child[parents[has_parent]] = np.where(has_parent)[0]
+    child[is_key] = -1
+    head, _ = graph_utils._jump_to(child, is_key)
+    head[is_key] = np.where(is_key)[0]
+
+    return pruned[head]
 
 
 def prune_by_length(x, min_length=0, max_length=float('inf'), inplace=False):
@@ -2857,3 +3878,228 @@ def prune_by_length(x, min_length=0, max_length=float('inf'), inplace=False):
         return neuron
     else:
         return None
+
+
+_MORPHOMETRICS = ['n_nodes', 'cable_length', 'n_branch_nodes',
+                  'n_end_nodes', 'n_open_ends', 'max_strahler', 'tortuosity',
+                  'segregation_index', 'bbox', 'radius', 'n_connectors',
+                  'n_presynapses', 'n_postsynapses']
+
+
+@cache.memoize('rows', ignore=['parallel', 'n_cores'])
+def morphometrics(x, metrics=None, seg_length=10, parallel=None,
+                  n_cores=None):
+    """ Calculate a set of morphometrics for neurons in one go.
+
+    All neurons are processed in a single batch and intermediates (parent
+    index, segments, node classification) are shared between metrics. This
+    is considerably faster than calling e.g. :func:`~pymaid.tortuosity` and
+    :func:`~pymaid.strahler_index` separately for each neuron.
+
+    Parameters
+    ----------
+    x :             CatmaidNeuron | CatmaidNeuronList
+                    Neuron(s) to process.
+    metrics :       str | list of str, optional
+                    Metrics to calculate. If None, will calculate all but
+                    ``segregation_index``. Available metrics:
+
+                      - ``n_nodes``
+                      - ``cable_length`` in microns [um]
+                      - ``n_branch_nodes``
+                      - ``n_end_nodes``
+                      - ``n_open_ends``
+                      - ``max_strahler``: highest Strahler index
+                      - ``tortuosity``: see :func:`~pymaid.tortuosity`
+                      - ``segregation_index``: see
+                        :func:`~pymaid.segregation_index`
+                      - ``bbox``: adds ``{x,y,z}_{min,max}`` columns
+                      - ``radius``: adds ``radius_mean`` and ``radius_max``
+                        columns (ignoring nodes without radius)
+                      - ``n_connectors``
+                      - ``n_presynapses``
+                      - ``n_postsynapses``
+
+    seg_length :    int | float, optional
+                    Segment length [um] for ``tortuosity``.
+    parallel :      bool, optional
+                    If True, will distribute neurons across ``n_cores``
+                    worker processes. Defaults to ``x._use_parallel`` for
+                    CatmaidNeuronLists.
+    n_cores :       int, optional
+                    Number of worker processes. Defaults to ``x.n_cores``
+                    for CatmaidNeuronLists.
+
+    Returns
+    -------
+    pandas.DataFrame
+                    One row per neuron (index is skeleton ID), one column
+                    per metric. Counts are integers, everything else floats.
+
+    Examples
+    --------
+    >>> nl = pymaid.get_neuron('annotation:glomerulus DA1')
+    >>> m = pymaid.morphometrics(nl, metrics=['cable_length', 'tortuosity'])
+
+    """
+    if isinstance(x, core.CatmaidNeuron):
+        x = core.CatmaidNeuronList(x)
+
+    if not isinstance(x, core.CatmaidNeuronList):
+        raise TypeError('Expected CatmaidNeuron/List, got {}'.format(type(x)))
+
+    if isinstance(metrics, type(None)):
+        metrics = [m for m in _MORPHOMETRICS if m != 'segregation_index']
+    metrics = list(utils._make_iterable(metrics))
+
+    for m in metrics:
+        if m not in _MORPHOMETRICS:
+            raise ValueError('Unknown metric "{}". Available metrics: '
+                             '{}'.format(m, ', '.join(_MORPHOMETRICS)))
+
+    if isinstance(parallel, type(None)):
+        parallel = x._use_parallel
+    if isinstance(n_cores, type(None)):
+        n_cores = x.n_cores
+
+    # Make sure we have skeleton data
+    x.get_skeletons(skip_existing=True)
+
+    # Only pass on the data we actually need -> less to pickle
+    closed = ['ends', 'uncertain end', 'uncertain continuation',
+              'not a branch', 'soma']
+    data = []
+    for n in x:
+        cols = [c for c in ['treenode_id', 'parent_id', 'x', 'y', 'z',
+                            'radius'] if c in n.nodes.columns]
+        closed_tn = [tn for t in closed for tn in n.tags.get(t, [])]
+        d = {'nodes': n.nodes[cols],
+             'closed': n.nodes.treenode_id.isin(closed_tn).values,
+             'relation': n.connectors.relation.values}
+        if 'segregation_index' in metrics:
+            d.update(_split_data(n, reroot_soma=True))
+            d['nodes'] = n.nodes[cols]
+        data.append(d)
+
+    if parallel and n_cores > 1 and len(data) > 1:
+        chunks = [data[c[0]:c[-1] + 1]
+                  for c in np.array_split(np.arange(len(data)),
+                                          min(n_cores, len(data)))]
+        with mp.Pool(n_cores) as pool:
+            res = list(config.tqdm(pool.imap(_morphometrics_helper,
+                                             [(c, metrics, seg_length)
+                                              for c in chunks]),
+                                   total=len(chunks),
+                                   desc='Morphometrics',
+                                   disable=config.pbar_hide,
+                                   leave=config.pbar_leave))
+        res = pd.concat(res, axis=0, ignore_index=True)
+    else:
+        res = _morphometrics_helper((data, metrics, seg_length))
+
+    res.index = x.skeleton_id
+    res.index.name = 'skeleton_id'
+
+    return res
+
+
+def _morphometrics_helper(args):
+    """Calculate morphometrics for a batch of neurons.
+
+    Parameters
+    ----------
+    args :      tuple
+                ``(data, metrics, seg_length)`` - see
+                :func:`~pymaid.morphometrics`. Packed into a single argument
+                for use with ``multiprocessing.Pool.imap``.
+
+    Returns
+    -------
+    pandas.DataFrame
+
+    """
+    data, metrics, seg_length = args
+    n_neurons = len(data)
+
+    # Shared intermediates
+    parents, offsets = graph_utils._concat_parents([d['nodes'] for d in data])
+    locs = np.concatenate([d['nodes'][['x', 'y', 'z']].values.astype(float)
+                           for d in data] + [np.zeros((0, 3))])
+    neuron_ix = np.repeat(np.arange(n_neurons), np.diff(offsets))
+    n_nodes = np.diff(offsets)
+
+    has_parent = parents >= 0
+    is_root = np.concatenate([d['nodes'].parent_id.isnull().values
+                              for d in data] + [np.zeros(0, dtype=bool)])
+    n_childs = np.bincount(parents[has_parent], minlength=parents.shape[0])
+
+    def per_neuron(mask):
+        return np.bincount(neuron_ix[mask], minlength=n_neurons)
+
+    res = {}
+    for m in metrics:
+        if m == 'n_nodes':
+            res[m] = n_nodes
+        elif m == 'cable_length':
+            dist = np.linalg.norm(locs[has_parent]
+                                  - locs[parents[has_parent]], axis=1)
+            res[m] = np.bincount(neuron_ix[has_parent], weights=dist,
+                                 minlength=n_neurons) / 1000
+        elif m == 'n_branch_nodes':
+            res[m] = per_neuron((n_childs > 1) & ~is_root)
+        elif m in ('n_end_nodes', 'n_open_ends'):
+            is_end = (n_childs == 0) & ~is_root
+            if m == 'n_open_ends':
+                is_end &= ~np.concatenate([d['closed'] for d in data]
+                                          + [np.zeros(0, dtype=bool)])
+            res[m] = per_neuron(is_end)
+        elif m == 'max_strahler':
+            si = _strahler_from_parents(parents)
+            res[m] = np.zeros(n_neurons, dtype=int)
+            np.maximum.at(res[m], neuron_ix, si)
+        elif m == 'tortuosity':
+            res[m] = _tortuosity(parents, locs / 1000, neuron_ix, n_neurons,
+                                 seg_length)
+        elif m == 'segregation_index':
+            si = _split_helper((data, 'bending', False, 'segregation'))
+            res[m] = np.where([len(d['relation']) > 0 for d in data], si,
+                              np.nan)
+        elif m == 'bbox':
+            for i, ax in enumerate(['x', 'y', 'z']):
+                mn = np.full(n_neurons, np.inf)
+                mx = np.full(n_neurons, -np.inf)
+                np.minimum.at(mn, neuron_ix, locs[:, i])
+                np.maximum.at(mx, neuron_ix, locs[:, i])
+                res[ax + '_min'] = np.where(n_nodes > 0, mn, np.nan)
+                res[ax + '_max'] = np.where(n_nodes > 0, mx, np.nan)
+        elif m == 'radius':
+            radii = np.concatenate([d['nodes'].radius.values.astype(float)
+                                    if 'radius' in d['nodes'].columns
+                                    else np.full(d['nodes'].shape[0], -1.)
+                                    for d in data] + [np.zeros(0)])
+            has_radius = radii > 0
+            n_radii = per_neuron(has_radius)
+            mx = np.full(n_neurons, -np.inf)
+            np.maximum.at(mx, neuron_ix[has_radius], radii[has_radius])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                res['radius_mean'] = np.bincount(neuron_ix[has_radius],
+                                                 weights=radii[has_radius],
+                                                 minlength=n_neurons) / n_radii
+            res['radius_max'] = np.where(n_radii > 0, mx, np.nan)
+        elif m in ('n_connectors', 'n_presynapses', 'n_postsynapses'):
+            rel = {'n_connectors': None, 'n_presynapses': 0,
+                   'n_postsynapses': 1}[m]
+            res[m] = np.array([len(d['relation']) if rel is None
+                               else np.sum(d['relation'] == rel)
+                               for d in data], dtype=int)
+
+    df = pd.DataFrame(res)
+
+    # Enforce types: counts are integers, everything else is float
+    for c in df.columns:
+        if c.startswith('n_') or c == 'max_strahler':
+            df[c] = df[c].astype(int)
+        else:
+            df[c] = df[c].astype(float)
+
+    return df
@@ -0,0 +1,402 @@
+#    This script is part of pymaid (http://www.github.com/schlegelp/pymaid).
+#    Copyright (C) 2017 Philipp Schlegel
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along
+
+""" Pure Python implementation of NBLAST (Costa et al., 2016). Unlike the
+functions in :mod:`pymaid.rmaid`, this does not require R.
+"""
+
+import math
+import multiprocessing as mp
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.spatial
+
+from . import core, morpho, resample, utils, config
+
+# Set up logging
+logger = config.logger
+
+__all__ = sorted(['nblast', 'nblast_allbyall'])
+
+# Upper bounds of distance [um] and absolute dot product bins of the FCWB
+# scoring matrix from nat.nblast (smat.fcwb).
+_FCWB_DIST_BINS = np.array([0.75, 1.5, 2, 2.5, 3, 3.5, 4, 5, 6, 7, 8, 9, 10,
+                            12, 14, 16, 20, 25, 30, 40, 500])
+_FCWB_DOT_BINS = np.array([.1, .2, .3, .4, .5, .6, .7, .8, .9, 1])
+_SMAT_FCWB = np.array([
+    [9.5001, 9.2151, 9.2112, 8.7785, 9.1648, 9.2267, 9.9818, 9.9877, 10.8048, 11.3892],
+    [8.4478, 9.0461, 8.6680, 8.6210, 8.7763, 8.9917, 9.6180, 9.4940, 9.9039, 10.5559],
+    [7.8141, 8.2756, 8.1866, 8.2373, 8.1560, 8.4498, 9.0030, 8.7795, 9.0776, 9.7274],
+    [7.5162, 7.6816, 7.8252, 7.7937, 7.8869, 8.0318, 7.9042, 7.8917, 8.4622, 9.3565],
+    [6.9783, 6.9431, 7.0792, 7.0497, 7.2131, 6.9387, 7.6370, 7.4002, 8.2437, 8.8056],
+    [6.3372, 6.5105, 6.3574, 6.7307, 6.6413, 6.6849, 6.8452, 6.9654, 7.5842, 8.3100],
+    [5.7350, 5.7766, 5.8749, 6.0785, 6.0242, 5.9365, 6.1652, 6.3006, 6.9599, 7.8737],
+    [5.1158, 5.0216, 5.1566, 5.1043, 5.1409, 5.1087, 5.3135, 5.3295, 5.9090, 6.5132],
+    [4.2340, 4.1579, 4.2073, 4.1546, 4.1269, 4.0734, 4.1397, 4.3003, 4.5781, 5.1649],
+    [3.3403, 3.3051, 3.2960, 3.2605, 3.2924, 3.1789, 3.3598, 3.3541, 3.5764, 3.9759],
+    [2.4952, 2.5210, 2.5231, 2.4695, 2.4828, 2.4959, 2.5325, 2.4789, 2.5714, 3.0339],
+    [1.8024, 1.7811, 1.7068, 1.7754, 1.7529, 1.7515, 1.7908, 1.7148, 1.7659, 2.1119],
+    [1.2320, 1.2490, 1.1506, 1.1536, 1.1054, 1.0910, 1.1121, 1.0740, 1.2133, 1.3623],
+    [0.4010, 0.4059, 0.3648, 0.4453, 0.3406, 0.3382, 0.2801, 0.2572, 0.3098, 0.4610],
+    [-0.2327, -0.2849, -0.3367, -0.3412, -0.4036, -0.4496, -0.4105, -0.4949, -0.4863, -0.3439],
+    [-0.7206, -0.7372, -0.7916, -0.9133, -0.8659, -0.9299, -0.9381, -0.9496, -0.9490, -0.8925],
+    [-1.2078, -1.2243, -1.2328, -1.3178, -1.3346, -1.3817, -1.3994, -1.3559, -1.3668, -1.3141],
+    [-1.6459, -1.6727, -1.6981, -1.7562, -1.7914, -1.8785, -1.8742, -1.9195, -1.9394, -1.9380],
+    [-2.5178, -2.5453, -2.5397, -2.5458, -2.6068, -2.6859, -2.6633, -2.7018, -2.7817, -2.9123],
+    [-3.9601, -4.0314, -4.0721, -4.1474, -4.3300, -4.4201, -4.5079, -4.7941, -4.8332, -5.0857],
+    [-9.9210, -10.0876, -10.0554, -10.1027, -10.0868, -9.9122, -10.0800, -9.9520, -10.0536, -10.1288],
+])
+
+# Targets (points, vectors, alpha, KD-tree) held by each worker process
+_TARGETS = None
+
+_PRECISIONS = {16: np.float16, 32: np.float32, 64: np.float64}
+
+
+def nblast(query, target=None, scores='forward', normalized=True,
+           use_alpha=False, k=5, resample_to=1, convert_um=True,
+           n_cores=os.cpu_count(), precision=32, remote_instance=None):
+    """NBLAST query against target neurons.
+
+    This is a pure Python implementation of NBLAST (Costa et al., 2016) using
+    the FCWB scoring matrix from R's ``nat.nblast``.
+
+    Parameters
+    ----------
+    query,target :      skeleton IDs | CatmaidNeuron/List | CatmaidDotprops
+                        Query and target neurons. Dotprops (e.g. from
+                        :func:`~pymaid.to_dotprops`) are used as they are
+                        (``k``, ``resample_to`` and ``convert_um`` are
+                        ignored) and must already be in microns. If
+                        ``target`` is None, will nblast ``query`` against
+                        itself.
+    scores :            'forward' | 'mean', optional
+                        Which scores to return. 'mean' is the average of
+                        the query->target and target->query scores.
+    normalized :        bool, optional
+                        If True, will divide scores by the self-match score
+                        of the query.
+    use_alpha :         bool, optional
+                        Emphasises neurons' straight parts (backbone) over
+                        parts that have lots of branches.
+    k :                 int, optional
+                        Number of nearest neighbours used to calculate
+                        tangent vectors.
+    resample_to :       int | float | None, optional
+                        Resolution in microns [um] the neurons will be
+                        resampled to before nblasting. Set to ``None`` to
+                        skip resampling.
+    convert_um :        bool, optional
+                        NBLAST is optimised for microns! If your neurons
+                        aren't already in microns, leave this parameter True.
+    n_cores :           int, optional
+                        Number of processes to use for nblasting.
+    precision :         16 | 32 | 64, optional
+                        Precision (in bits) of the returned scores. Use
+                        lower precision to save memory when blasting large
+                        numbers of neurons.
+    remote_instance :   CatmaidInstance, optional
+                        Only neccessary if only skeleton IDs are provided.
+
+    Returns
+    -------
+    pandas.DataFrame
+                        Scores with queries as rows and targets as columns.
+
+    See Also
+    --------
+    :func:`pymaid.nblast_allbyall`
+                        NBLAST neurons against each other.
+    :func:`pymaid.rmaid.nblast`
+                        NBLAST using R.
+
+    """
+    if scores not in ['forward', 'mean']:
+        raise ValueError('"scores" must be "forward" or "mean", got '
+                         '"{}"'.format(scores))
+
+    q_dps = _prepare_dotprops(query, k=k, resample_to=resample_to,
+                              convert_um=convert_um,
+                              remote_instance=remote_instance)
+
+    if isinstance(target, type(None)):
+        t_dps = q_dps
+    else:
+        t_dps = _prepare_dotprops(target, k=k, resample_to=resample_to,
+                                  convert_um=convert_um,
+                                  remote_instance=remote_instance)
+
+    res = _score_matrix(q_dps, t_dps,
+                        normalized=normalized,
+                        use_alpha=use_alpha,
+                        n_cores=n_cores,
+                        precision=precision)
+
+    if scores == 'mean':
+        if isinstance(target, type(None)):
+            _mean_with_transposed(res)
+        else:
+            rev = _score_matrix(t_dps, q_dps,
+                                normalized=normalized,
+                                use_alpha=use_alpha,
+                                n_cores=n_cores,
+                                precision=precision)
+            _mean_with_transposed(res, rev)
+
+    return pd.DataFrame(res,
+                        index=[dp.skeleton_id for dp in q_dps],
+                        columns=[dp.skeleton_id for dp in t_dps])
+
+
+def nblast_allbyall(x, normalized=True, use_alpha=False, k=5, resample_to=1,
+                    convert_um=True, n_cores=os.cpu_count(), precision=32,
+                    remote_instance=None):
+    """NBLAST neurons against each other.
+
+    This is a pure Python implementation which does not require R. Scores
+    are the mean between the query->target and target->query scores.
+
+    Parameters
+    ----------
+    x :                 skeleton IDs | CatmaidNeuronList | list of CatmaidDotprops
+                        Neurons to blast.
+    normalized :        bool, optional
+                        If True, will divide scores by the self-match score
+                        of the query.
+    use_alpha :         bool, optional
+                        Emphasises neurons' straight parts (backbone) over
+                        parts that have lots of branches.
+    k :                 int, optional
+                        Number of nearest neighbours used to calculate
+                        tangent vectors.
+    resample_to :       int | float | None, optional
+                        Resolution in microns [um] the neurons will be
+                        resampled to before nblasting.
+    convert_um :        bool, optional
+                        NBLAST is optimised for microns! If your neurons
+                        aren't already in microns, leave this parameter True.
+    n_cores :           int, optional
+                        Number of processes to use for nblasting.
+    precision :         16 | 32 | 64, optional
+                        Precision (in bits) of the score matrix.
+    remote_instance :   CatmaidInstance, optional
+                        Only neccessary if only skeleton IDs are provided.
+
+    Returns
+    -------
+    :class:`pymaid.ClustResults`
+                        Holds the similarity matrix and contains wrappers to
+                        cluster and plot data.
+
+    Examples
+    --------
+    >>> import matplotlib.pyplot as plt
+    >>> nl = pymaid.get_neuron('annotation:glomerulus DA1')
+    >>> res = pymaid.nblast_allbyall(nl)
+    >>> res.cluster(method='ward')
+    >>> res.plot_matrix()
+    >>> plt.show()
+
+    See Also
+    --------
+    :func:`pymaid.nblast`
+                        NBLAST query against target neurons.
+    :func:`pymaid.rmaid.nblast_allbyall`
+                        NBLAST using R.
+
+    """
+    from . import cluster
+
+    is_dps = utils._is_iterable(x) and len(x) \
+        and all([isinstance(d, core.CatmaidDotprops) for d in x])
+    if not isinstance(x, core.CatmaidNeuronList) and not is_dps:
+        remote_instance = utils._eval_remote_instance(remote_instance)
+        x = core.CatmaidNeuronList(x, remote_instance=remote_instance)
+
+    matrix = nblast(x, scores='mean', normalized=normalized,
+                    use_alpha=use_alpha, k=k, resample_to=resample_to,
+                    convert_um=convert_um, n_cores=n_cores,
+                    precision=precision, remote_instance=remote_instance)
+
+    if isinstance(x, core.CatmaidNeuronList):
+        res = cluster.ClustResults(matrix,
+                                   labels=x.neuron_name.tolist(),
+                                   mat_type='similarity')
+        res.neurons = x
+    else:
+        res = cluster.ClustResults(matrix, mat_type='similarity')
+
+    return res
+
+
+def _prepare_dotprops(x, k=5, resample_to=1, convert_um=True,
+                      remote_instance=None):
+    """Turn input into list of CatmaidDotprops in microns."""
+    if isinstance(x, core.CatmaidDotprops):
+        return [x]
+
+    if isinstance(x, (list, np.ndarray)) and len(x) \
+       and all([isinstance(d, core.CatmaidDotprops) for d in x]):
+        return list(x)
+
+    if not isinstance(x, (core.CatmaidNeuron, core.CatmaidNeuronList)):
+        remote_instance = utils._eval_remote_instance(remote_instance)
+        x = core.CatmaidNeuronList(x, remote_instance=remote_instance)
+
+    if isinstance(x, core.CatmaidNeuron):
+        x = core.CatmaidNeuronList(x)
+
+    if resample_to:
+        x = resample.resample_neuron(x,
+                                     resample_to * 1000 if convert_um else resample_to,
+                                     inplace=False)
+
+    dps = morpho.to_dotprops(x, k=k)
+    if isinstance(dps, core.CatmaidDotprops):
+        dps = [dps]
+
+    if convert_um:
+        for dp in dps:
+            dp.points /= 1000
+            if not isinstance(dp.vec_length, type(None)):
+                dp.vec_length /= 1000
+
+    return dps
+
+
+def _init_worker(targets):
+    """Set targets for this worker process."""
+    global _TARGETS
+    _TARGETS = [(t[0], t[1], t[2], scipy.spatial.cKDTree(t[0]))
+                for t in targets]
+
+
+def _score_lookup(dist, dots):
+    """Sum scores for given distances and absolute dot products."""
+    d_ix = np.searchsorted(_FCWB_DIST_BINS, dist, side='left')
+    d_ix = np.clip(d_ix, 0, _SMAT_FCWB.shape[0] - 1)
+    dot_ix = np.searchsorted(_FCWB_DOT_BINS, dots, side='left')
+    dot_ix = np.clip(dot_ix, 0, _SMAT_FCWB.shape[1] - 1)
+    return _SMAT_FCWB[d_ix, dot_ix].sum()
+
+
+def _self_score(points, vect, alpha, use_alpha=False):
+    """Score of a neuron against itself."""
+    dots = np.ones(points.shape[0])
+    if use_alpha and not isinstance(alpha, type(None)):
+        dots = dots * alpha
+    return _score_lookup(np.zeros(points.shape[0]), dots)
+
+
+def _score_rows(args):
+    """Score a chunk of queries against all targets (in worker)."""
+    queries, normalized, use_alpha, dtype = args
+
+    scores = np.zeros((len(queries), len(_TARGETS)), dtype=dtype)
+    for i, (q_pts, q_vect, q_alpha) in enumerate(queries):
+        if not q_pts.shape[0]:
+            continue
+
+        if normalized:
+            self_score = _self_score(q_pts, q_vect, q_alpha,
+                                     use_alpha=use_alpha)
+
+        for j, (t_pts, t_vect, t_alpha, t_tree) in enumerate(_TARGETS):
+            if not t_pts.shape[0]:
+                continue
+
+            dist, ix = t_tree.query(q_pts)
+            dots = np.abs((q_vect * t_vect[ix]).sum(axis=1))
+
+            if use_alpha and not isinstance(q_alpha, type(None)):
+                dots = dots * np.sqrt(q_alpha * t_alpha[ix])
+
+            sc = _score_lookup(dist, dots)
+            if normalized:
+                sc = sc / self_score if self_score else 0
+
+            scores[i, j] = sc
+
+    return scores
+
+
+def _mean_with_transposed(mat, other=None, blocksize=2000):
+    """Average ``mat`` and ``other.T`` in place.
+
+    Works block by block to avoid full-size temporary (float64) copies. If
+    ``other`` is None, ``mat`` must be square and is averaged with its own
+    transpose.
+
+    """
+    n = mat.shape[0]
+    if isinstance(other, type(None)):
+        for i in range(0, n, blocksize):
+            for j in range(i, n, blocksize):
+                a = mat[i: i + blocksize, j: j + blocksize].astype(np.float32)
+                b = mat[j: j + blocksize, i: i + blocksize].astype(np.float32)
+                m = (a + b.T) / 2
+                mat[i: i + blocksize, j: j + blocksize] = m
+                mat[j: j + blocksize, i: i + blocksize] = m.T
+    else:
+        for i in range(0, n, blocksize):
+            a = mat[i: i + blocksize].astype(np.float32)
+            b = other[:, i: i + blocksize].astype(np.float32)
+            mat[i: i + blocksize] = (a + b.T) / 2
+    return mat
+
+
+def _score_matrix(q_dps, t_dps, normalized=True, use_alpha=False,
+                  n_cores=os.cpu_count(), precision=32):
+    """Calculate forward scores of queries against targets."""
+    if precision not in _PRECISIONS:
+        raise ValueError('"precision" must be 16, 32 or 64, got '
+                         '"{}"'.format(precision))
+    dtype = _PRECISIONS[precision]
+
+    if use_alpha:
+        missing = [dp.skeleton_id for dp in list(q_dps) + list(t_dps)
+                   if isinstance(dp.alpha, type(None))]
+        if missing:
+            raise ValueError('Need alpha values for use_alpha=True. Please '
+                             'generate dotprops with to_dotprops(k=...)')
+
+    targets = [(dp.points, dp.vect, dp.alpha) for dp in t_dps]
+    queries = [(dp.points, dp.vect, dp.alpha) for dp in q_dps]
+
+    # Split queries into chunks
+    n_cores = max(1, min(n_cores or 1, len(queries)))
+    chunksize = max(1, math.ceil(len(queries) / (n_cores * 10)))
+    chunks = [(queries[i: i + chunksize], normalized, use_alpha, dtype)
+              for i in range(0, len(queries), chunksize)]
+
+    if n_cores > 1:
+        with mp.Pool(n_cores, initializer=_init_worker,
+                     initargs=(targets, )) as pool:
+            res = list(config.tqdm(pool.imap(_score_rows, chunks),
+                                   total=len(chunks),
+                                   desc='NBLASTing',
+                                   disable=config.pbar_hide,
+                                   leave=config.pbar_leave))
+    else:
+        _init_worker(targets)
+        res = [_score_rows(c) for c in config.tqdm(chunks,
+                                                   desc='NBLASTing',
+                                                   disable=config.pbar_hide,
+                                                   leave=config.pbar_leave)]
+
+    return np.vstack(res) if res else np.zeros((0, len(targets)), dtype=dtype)
@@ -23,7 +23,7 @@ import numpy as np
 import scipy.spatial
 import scipy.interpolate
 
-from . import core, graph_utils, config
+from . import core, graph_utils, utils, config
 
 # Set up logging
 logger = config.logger
@@ -37,7 +37,9 @@ def resample_neuron(x, resample_to, method='linear', inplace=False,
 
     Preserves root, leafs, branchpoints. Tags and connectors are mapped onto
     the closest new treenode. Columns "confidence" and "creator" of the
-    treenode table are discarded.
+    treenode table are discarded. Radii are interpolated linearly between
+    nodes with known radius. New nodes next to a node with unknown radius
+    (-1) get -1.
 
     Important
     ---------
@@ -60,13 +62,19 @@ def resample_neuron(x, resample_to, method='linear', inplace=False,
                         resampled copy is returned.
     skip_errors :       bool, optional
                         If True, will skip errors during interpolation and
-                        only print summary.
+                        only print summary. Affected segments are
+                        interpolated linearly instead.
 
     Returns
     -------
     CatmaidNeuron/List
                         Downsampled neuron(s). Only if ``inplace=False``.
 
+    Notes
+    -----
+    All segments of all neurons are concatenated and resampled in one go.
+    For ``method='linear'`` (default), this is fully vectorized.
+
     See Also
     --------
     :func:`pymaid.downsample_neuron`
@@ -77,175 +85,204 @@ def resample_neuron(x, resample_to, method='linear', inplace=False,
 
     """
     if isinstance(x, core.CatmaidNeuronList):
-        results = [resample_neuron(x[i], resample_to,
-                                   method=method, inplace=inplace,
-                                   skip_errors=skip_errors)
-                   for i in config.trange(x.shape[0],
-                                          desc='Resampl. neurons',
-                                          disable=config.pbar_hide,
-                                          leave=config.pbar_leave)]
         if not inplace:
-            return core.CatmaidNeuronList(results)
-        return
-    elif not isinstance(x, core.CatmaidNeuron):
+            x = x.copy(deepcopy=False)
+        neurons = x.neurons
+    elif isinstance(x, core.CatmaidNeuron):
+        if not inplace:
+            x = x.copy()
+        neurons = [x]
+    else:
         logger.error('Unexpected datatype: %s' % str(type(x)))
         raise ValueError
 
-    if not inplace:
-        x = x.copy()
+    new_nodes = _resample_nodes(neurons, resample_to, method=method,
+                                skip_errors=skip_errors)
 
-    # Collect some information for later
-    nodes = x.nodes.set_index('treenode_id')
-    locs = nodes[['x', 'y', 'z']]
-    radii = nodes['radius'].to_dict()
+    for n, nodes in zip(neurons, new_nodes):
+        # Map connectors and tags onto the closest new node
+        _map_to_nodes(n, nodes)
 
-    new_nodes = []
-    max_tn_id = x.nodes.treenode_id.max() + 1
-
-    errors = 0
-
-    # Iterate over segments
-    # This progress bar is only interesting for debugging really
-    for i, seg in enumerate(config.tqdm(x.small_segments,
-                                        desc='Proc. segments',
-                                        disable=config.logger.level > 10,
-                                        leave=False)):
-        # Get coordinates
-        coords = locs.loc[seg].values.astype(float)
-        # Get radii
-        rad = [radii[tn] for tn in seg]
-
-        # Vecs between subsequently measured points
-        vecs = np.diff(coords.T)
-
-        # path: cum distance along points (norm from first to ith point)
-        path = np.cumsum(np.linalg.norm(vecs, axis=0))
-        path = np.insert(path, 0, 0)
-
-        # If path is too short, just keep the first and last treenode
-        if path[-1] < resample_to or (method == 'cubic' and len(seg) <= 3):
-            new_nodes += [[seg[0], seg[-1], None, coords[0]
-                           [0], coords[0][1], coords[0][2], radii[seg[0]], 5]]
-            continue
-
-        # Coords of interpolation
-        n_nodes = int(path[-1] / resample_to)
-        interp_coords = np.linspace(path[0], path[-1], n_nodes)
-
-        try:
-            sampleX = scipy.interpolate.interp1d(path, coords[:, 0],
-                                                 kind=method)
-            sampleY = scipy.interpolate.interp1d(path, coords[:, 1],
-                                                 kind=method)
-            sampleZ = scipy.interpolate.interp1d(path, coords[:, 2],
-                                                 kind=method)
-            sampleR = scipy.interpolate.interp1d(path, rad,
-                                                 kind=method)
-        except ValueError as e:
-            if skip_errors:
-                errors += 1
-                new_nodes += x.nodes.loc[x.nodes.treenode_id.isin(seg[:-1]),
-                                         ['treenode_id', 'parent_id',
-                                          'creator_id', 'x', 'y', 'z',
-                                          'radius', 'confidence']].values.tolist()
-                continue
-            else:
-                raise e
-
-        # Sample each dim
-        xnew = sampleX(interp_coords)
-        ynew = sampleY(interp_coords)
-        znew = sampleZ(interp_coords)
-        rnew = sampleR(interp_coords).round(1)
-
-        # Generate new coordinates
-        new_coords = np.array([xnew, ynew, znew]).T.round()
-
-        # Generate new ids (start and end node IDs of this segment)
-        new_ids = seg[:1] + [max_tn_id
-                             + i for i in range(len(new_coords) - 2)] + seg[-1:]
-
-        # Keep track of new nodes
-        new_nodes += [[tn, pn, None, co[0], co[1], co[2], -1, 5]
-                      for tn, pn, co, r in zip(new_ids[:-1],
-                                               new_ids[1:],
-                                               new_coords,
-                                               rnew)]
-
-        # Increase max index
-        max_tn_id += len(new_ids)
-
-    if errors:
-        logger.warning('{} ({:.0%}) segments skipped due to '
-                       'errors'.format(errors, errors / i))
-
-    # Add root node(s)
-    root = x.root
-    if not isinstance(root, (np.ndarray, list)):
-        root = [x.root]
-    root = x.nodes.loc[x.nodes.treenode_id.isin(root), ['treenode_id',
-                                                        'parent_id',
-                                                        'creator_id',
-                                                        'x', 'y', 'z',
-                                                        'radius',
-                                                        'confidence']]
-    new_nodes += [list(r) for r in root.values]
-
-    # Generate new nodes dataframe
-    new_nodes = pd.DataFrame(data=new_nodes,
-                             columns=['treenode_id', 'parent_id', 'creator_id',
-                                      'x', 'y', 'z', 'radius', 'confidence'],
-                             dtype=object
-                             )
-
-    # Convert columns to appropriate dtypes
-    dtypes = {'treenode_id': int, 'parent_id': object, 'x': int, 'y': int,
-              'z': int, 'radius': int, 'confidence': int}
-
-    for k, v in dtypes.items():
-        new_nodes[k] = new_nodes[k].astype(v)
-
-    # Remove duplicate treenodes (branch points)
-    new_nodes = new_nodes[~new_nodes.treenode_id.duplicated()]
-
-    # Map connectors back:
-    # 1. Get position of old synapse-bearing treenodes
-    old_tn_position = x.nodes.set_index(
-        'treenode_id').loc[x.connectors.treenode_id, ['x', 'y', 'z']].values
-    # 2. Get closest neighbours
-    distances = scipy.spatial.distance.cdist(
-        old_tn_position, new_nodes[['x', 'y', 'z']].values)
-    min_ix = np.argmin(distances, axis=1)
-    # 3. Map back onto neuron
-    x.connectors['treenode_id'] = new_nodes.iloc[min_ix].treenode_id.values
-
-    # Map tags back:
-    if x.tags:
-        # 1. Get position of old tag bearing treenodes
-        tag_tn = set([tn for l in x.tags.values() for tn in l])
-        old_tn_position = x.nodes.set_index(
-            'treenode_id').loc[tag_tn, ['x', 'y', 'z']].values
-        # 2. Get closest neighbours
-        distances = scipy.spatial.distance.cdist(
-            old_tn_position, new_nodes[['x', 'y', 'z']].values)
-        min_ix = np.argmin(distances, axis=1)
-        # 3. Create a dictionary
-        new_tag_tn = {
-            tn: new_nodes.iloc[min_ix[i]].treenode_id for i, tn in enumerate(tag_tn)}
-        # 4. Map tags back
-        new_tags = {t: [new_tag_tn[tn] for tn in x.tags[t]] for t in x.tags}
-        x.tags = new_tags
-
-    # Set nodes
-    x.nodes = new_nodes
+        n.nodes = nodes
 
-    # Clear and regenerate temporary attributes
-    x._clear_temp_attr()
+        # Clear and regenerate temporary attributes
+        n._clear_temp_attr()
 
     if not inplace:
         return x
 
 
+def _resample_nodes(neurons, resample_to, method='linear', skip_errors=True):
+    """Generate resampled node tables for a list of neurons."""
+    n_nodes = np.array([n.nodes.shape[0] for n in neurons], dtype=int)
+    starts = np.concatenate([[0], np.cumsum(n_nodes)[:-1]]).astype(int)
+
+    # Concatenate all neurons into one big forest
+    parents = [graph_utils._parent_index(n) for n in neurons]
+    parents = np.concatenate([np.where(p >= 0, p + s, -1)
+                              for p, s in zip(parents, starts)] + [[]])
+    parents = parents.astype(int)
+    all_nodes = pd.concat([n.nodes for n in neurons], ignore_index=True,
+                          sort=False)
+    tn_ids = all_nodes.treenode_id.values.astype(int)
+    values = all_nodes[['x', 'y', 'z', 'radius']].values.astype(float)
+    neuron_ix = np.repeat(np.arange(len(neurons)), n_nodes)
+
+    # Segments as flat array of node indices plus offsets
+    seg_nodes, offsets = graph_utils._segment_array(parents)
+    n_seg = offsets.shape[0] - 1
+    seg_size = np.diff(offsets)
+    row_seg = np.repeat(np.arange(n_seg), seg_size)
+    seg_values = values[seg_nodes]
+
+    # Cumulative path length along each segment
+    step = np.zeros(seg_nodes.shape[0])
+    step[1:] = np.linalg.norm(np.diff(seg_values[:, :3], axis=0), axis=1)
+    step[offsets[:-1]] = 0
+    path = np.cumsum(step)
+    seg_start = path[offsets[:-1]]
+    seg_len = path[offsets[1:] - 1] - seg_start
+    path -= seg_start[row_seg]
+
+    # Number of new points per segment: the last point of a segment is its
+    # proximal branch point/root, which is not generated here. Segments
+    # shorter than the new resolution only keep their first node.
+    n_new = (seg_len / resample_to).astype(int)
+    n_samples = np.where(n_new > 1, n_new - 1, 1)
+    if method == 'cubic':
+        n_samples[seg_size <= 3] = 1
+    spacing = seg_len / np.maximum(n_new - 1, 1)
+
+    smp_offsets = np.concatenate([[0], np.cumsum(n_samples)]).astype(int)
+    smp_seg = np.repeat(np.arange(n_seg), n_samples)
+    smp_pos = np.arange(smp_seg.shape[0]) - smp_offsets[smp_seg]
+    smp_path = smp_pos * spacing[smp_seg]
+
+    # Shift segments apart, so that all of them can be interpolated at once
+    shift = np.concatenate([[0], np.cumsum(seg_len + 1)[:-1]])
+    xp = path + shift[row_seg]
+    xq = smp_path + shift[smp_seg]
+    new_values = np.column_stack([np.interp(xq, xp, seg_values[:, i])
+                                  for i in range(seg_values.shape[1])])
+
+    if method != 'linear':
+        errors = 0
+        for s in np.where(n_samples > 1)[0]:
+            this = slice(offsets[s], offsets[s + 1])
+            smp = slice(smp_offsets[s], smp_offsets[s + 1])
+            try:
+                f = scipy.interpolate.interp1d(path[this], seg_values[this],
+                                               kind=method, axis=0)
+                new_values[smp] = f(smp_path[smp])
+            except ValueError as e:
+                if skip_errors:
+                    errors += 1
+                else:
+                    raise e
+
+        if errors:
+            logger.warning('{} ({:.0%}) segments interpolated linearly due '
+                           'to errors'.format(errors, errors / n_seg))
+
+    # Radii are only interpolated between nodes with known radius - new nodes
+    # next to a node with unknown radius (-1) get -1 too
+    radius = seg_values[:, 3]
+    lo = np.clip(np.searchsorted(xp, xq, side='right') - 1, 0, xp.shape[0] - 1)
+    hi = np.minimum(lo + 1, xp.shape[0] - 1)
+    span = xp[hi] - xp[lo]
+    frac = np.zeros(xq.shape[0])
+    frac[span > 0] = (xq - xp[lo])[span > 0] / span[span > 0]
+    known = (radius[lo] > 0) & ((radius[hi] > 0) | (frac == 0))
+    new_values[:, 3] = np.where(known,
+                                radius[lo] + frac * (radius[hi] - radius[lo]),
+                                -1)
+
+    # First point of each segment keeps the ID of the segment's first node,
+    # all others get new IDs unique within their neuron
+    first = seg_nodes[offsets[:-1]]
+    last = seg_nodes[offsets[1:] - 1]
+    smp_neuron = neuron_ix[first][smp_seg]
+
+    new_ids = np.zeros(smp_seg.shape[0], dtype=int)
+    is_first = smp_pos == 0
+    new_ids[is_first] = tn_ids[first[smp_seg[is_first]]]
+
+    max_ids = np.array([n.nodes.treenode_id.max() if n.nodes.shape[0] else 0
+                        for n in neurons], dtype=int)
+    gen_neuron = smp_neuron[~is_first]
+    gen_start = np.searchsorted(gen_neuron, np.arange(len(neurons)))
+    new_ids[~is_first] = (max_ids[gen_neuron] + 1
+                          + np.arange(gen_neuron.shape[0])
+                          - gen_start[gen_neuron])
+
+    # Each new node's parent is the next one in the segment
+    new_parents = np.zeros(smp_seg.shape[0], dtype=int)
+    new_parents[:-1] = new_ids[1:]
+    is_last = smp_offsets[1:] - 1
+    new_parents[is_last] = tn_ids[last]
+
+    new_values = new_values.round().astype(int)
+
+    # Split back into neurons
+    cols = ['treenode_id', 'parent_id', 'creator_id', 'x', 'y', 'z',
+            'radius', 'confidence']
+    smp_bounds = np.searchsorted(smp_neuron, np.arange(len(neurons) + 1))
+    new_nodes = []
+    for i, n in enumerate(neurons):
+        this = slice(smp_bounds[i], smp_bounds[i + 1])
+        nodes = pd.DataFrame({'treenode_id': new_ids[this],
+                              'parent_id': new_parents[this].astype(object),
+                              'creator_id': None,
+                              'x': new_values[this, 0],
+                              'y': new_values[this, 1],
+                              'z': new_values[this, 2],
+                              'radius': new_values[this, 3],
+                              'confidence': 5},
+                             columns=cols)
+
+        # Add root node(s)
+        root = n.nodes.loc[parents[starts[i]:starts[i] + n_nodes[i]] < 0,
+                           cols].copy()
+        root['parent_id'] = None
+        root[['x', 'y', 'z', 'radius']] = root[['x', 'y', 'z',
+                                                'radius']].values.round()
+
+        nodes = pd.concat([nodes, root], ignore_index=True, sort=False)
+
+        # Convert columns to appropriate dtypes
+        dtypes = {'treenode_id': int, 'parent_id': object, 'x': int,
+                  'y': int, 'z': int, 'radius': int, 'confidence': int}
+        for k, v in dtypes.items():
+            nodes[k] = nodes[k].astype(v)
+
+        new_nodes.append(nodes)
+
+    return new_nodes
+
+
+def _map_to_nodes(x, new_nodes):
+    """Map connectors and tags of neuron onto closest node in new nodes."""
+    has_cn = isinstance(x.connectors, pd.DataFrame) and not x.connectors.empty
+    if not has_cn and not x.tags:
+        return
+
+    tree = scipy.spatial.cKDTree(new_nodes[['x', 'y', 'z']].values)
+    locs = x.nodes.set_index('treenode_id')[['x', 'y', 'z']]
+    new_ids = new_nodes.treenode_id.values
+
+    # Map connectors back
+    if has_cn:
+        _, ix = tree.query(locs.loc[x.connectors.treenode_id].values)
+        x.connectors['treenode_id'] = new_ids[ix]
+
+    # Map tags back
+    if x.tags:
+        tag_tn = list(set([tn for l in x.tags.values() for tn in l]))
+        _, ix = tree.query(locs.loc[tag_tn].values)
+        new_tag_tn = dict(zip(tag_tn, new_ids[ix]))
+        x.tags = {t: [new_tag_tn[tn] for tn in x.tags[t]] for t in x.tags}
+
+
 def downsample_neuron(x, resampling_factor, preserve_cn_treenodes=True,
                       preserve_tag_treenodes=False, inplace=False):
     """Downsample neuron(s) by a given factor.
@@ -286,11 +323,19 @@ def downsample_neuron(x, resampling_factor, preserve_cn_treenodes=True,
 
     """
     if isinstance(x, core.CatmaidNeuronList):
-        return core.CatmaidNeuronList([downsample_neuron(n,
-                                                         resampling_factor=resampling_factor,
-                                                         preserve_cn_treenodes=preserve_cn_treenodes,
-                                                         preserve_tag_treenodes=preserve_tag_treenodes,
-                                                         inplace=inplace) for n in x])
+        if not inplace:
+            x = x.copy(deepcopy=False)
+        for n in config.tqdm(x, desc='Downsampling',
+                             disable=config.pbar_hide,
+                             leave=config.pbar_leave):
+            downsample_neuron(n,
+                              resampling_factor=resampling_factor,
+                              preserve_cn_treenodes=preserve_cn_treenodes,
+                              preserve_tag_treenodes=preserve_tag_treenodes,
+                              inplace=True)
+        if not inplace:
+            return x
+        return
     elif isinstance(x, core.CatmaidNeuron):
         if not inplace:
             x = x.copy()
@@ -312,75 +357,44 @@ def downsample_neuron(x, resampling_factor, preserve_cn_treenodes=True,
 
     logger.debug('Preparing to downsample neuron...')
 
-    list_of_parents = {
-        n.treenode_id: n.parent_id for n in x.nodes.itertuples()}
-    list_of_parents[None] = None
-
-    if 'type' not in x.nodes:
-        graph_utils.classify_nodes(x)
+    parents = graph_utils._parent_index(x)
+    has_parent = parents >= 0
+    n_childs = np.bincount(parents[has_parent], minlength=parents.shape[0])
 
-    selection = x.nodes.type != 'slab'
+    # Fix points: root, leafs and branch points (+ optional nodes)
+    fix = (n_childs != 1) | ~has_parent
 
     if preserve_cn_treenodes:
-        selection = selection | x.nodes.treenode_id.isin(
-            x.connectors.treenode_id)
+        fix |= x.nodes.treenode_id.isin(x.connectors.treenode_id).values
 
     if preserve_tag_treenodes:
         with_tags = [t for l in x.tags.values() for t in l]
-        selection = selection | x.nodes.treenode_id.isin(with_tags)
-
-    fix_points = x.nodes[selection].treenode_id.values
+        fix |= x.nodes.treenode_id.isin(with_tags).values
 
     # Add soma node
-    if not isinstance(x.soma, type(None)) and x.soma not in fix_points:
-        fix_points = np.append(fix_points, x.soma)
-
-    # Walk from all fix points to the root - jump N nodes on the way
-    new_parents = {}
+    if not isinstance(x.soma, type(None)):
+        fix |= x.nodes.treenode_id.isin(utils._make_iterable(x.soma)).values
 
     logger.debug(
         'Sampling neuron down by factor of {0}'.format(resampling_factor))
 
-    for en in fix_points:
-        this_node = en
-
-        while True:
-            stop = False
-            new_p = list_of_parents[this_node]
-            if new_p:
-                i = 0
-                while i < resampling_factor:
-                    if new_p in fix_points or not new_p:
-                        new_parents[this_node] = new_p
-                        stop = True
-                        break
-                    new_p = list_of_parents[new_p]
-                    i += 1
-
-                if stop is True:
-                    break
-                else:
-                    new_parents[this_node] = new_p
-                    this_node = new_p
-            else:
-                new_parents[this_node] = None
-                break
-
-    new_nodes = x.nodes[x.nodes.treenode_id.isin(
-        list(new_parents.keys()))].copy()
-    new_nodes.loc[:, 'parent_id'] = [new_parents[tn]
-                                     for tn in new_nodes.treenode_id]
-
-    # We have to temporarily set parent of root node from 1 to an integer
-    root_ix = new_nodes[new_nodes.parent_id.isnull()].index
-    new_nodes.loc[root_ix, 'parent_id'] = 0
-    # first convert everything to int
-    new_nodes.loc[:, 'parent_id'] = new_nodes.parent_id.values.astype(int)
-    # then back to object so that we can add a 'None'
-    new_nodes.loc[:, 'parent_id'] = new_nodes.parent_id.values.astype(object)
-
-    # Reassign parent_id None to root node
-    new_nodes.loc[root_ix, 'parent_id'] = None
+    # Between fix points, keep every Nth node counting from the distal fix
+    # point. Nodes in between fix points have exactly one child, so we can
+    # simply walk down to the next fix point.
+    child = np.full(parents.shape[0], -1, dtype=int)
+    child[parents[has_parent]] = np.where(has_parent)[0]
+    child[fix] = -1
+    _, hops = graph_utils._jump_to(child, fix)
+    keep = fix | (np.mod(hops, np.ceil(resampling_factor) + 1) == 0)
+
+    # New parent is the closest kept node proximal to each kept node
+    new_parents, _ = graph_utils._jump_to(parents, keep)
+
+    tn_ids = x.nodes.treenode_id.values
+    new_parents = np.where(new_parents >= 0, tn_ids[new_parents], None)
+
+    new_nodes = x.nodes[keep].copy()
+    new_nodes['parent_id'] = new_parents[keep]
 
     logger.debug('Nodes before/after: {}/{}'.format(len(x.nodes),
                                                     len(new_nodes)))
@@ -0,0 +1,811 @@
+#    This script is part of pymaid (http://www.github.com/schlegelp/pymaid).
+#    Copyright (C) 2017 Philipp Schlegel
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along
+
+
+""" This module contains functions and classes to take a local snapshot of
+a project's synaptic connectivity and query it offline.
+"""
+
+import datetime
+import json
+import urllib
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from . import fetch, core, intersect, utils, config, connectivity
+
+# Set up logging
+logger = config.logger
+
+__all__ = sorted(['ConnectomeSnapshot', 'get_connectome_snapshot'])
+
+# Columns (and dtypes) of the links table
+LINK_COLUMNS = {'connector_id': np.int64,
+                'skeleton_id': np.int64,
+                'treenode_id': np.int64,
+                'relation': str,
+                'confidence': np.int8,
+                'creator': str,
+                'x': np.float32,
+                'y': np.float32,
+                'z': np.float32,
+                'tn_x': np.float32,
+                'tn_y': np.float32,
+                'tn_z': np.float32}
+
+NEURON_COLUMNS = {'skeleton_id': np.int64,
+                  'neuron_name': str,
+                  'num_nodes': np.int64}
+
+# Maps directions in get_partners() to query/partner relations
+DIRECTIONS = {'incoming': ('postsynaptic_to', 'presynaptic_to'),
+              'outgoing': ('presynaptic_to', 'postsynaptic_to'),
+              'gapjunctions': ('gapjunction_with', 'gapjunction_with'),
+              'attachments': ('attached_to', 'close_to')}
+
+
+class ConnectomeSnapshot:
+    """ Local snapshot of connector links between neurons.
+
+    Answers connectivity queries offline. Methods mirror the respective
+    functions in pymaid (e.g. :func:`~pymaid.get_partners`) and return data
+    in the same format. Use :func:`~pymaid.get_connectome_snapshot` to
+    generate a snapshot from a CATMAID server.
+
+    Parameters
+    ----------
+    links :         pandas.DataFrame
+                    Connector links. Must contain columns ``connector_id``,
+                    ``skeleton_id``, ``treenode_id``, ``relation``,
+                    ``confidence``, ``creator``, ``x``, ``y``, ``z`` (connector
+                    position) and ``tn_x``, ``tn_y``, ``tn_z`` (treenode
+                    position).
+    neurons :       pandas.DataFrame
+                    Neurons. Must contain ``skeleton_id``, ``neuron_name``
+                    and ``num_nodes``.
+    skeleton_ids :  array-like, optional
+                    Skeleton IDs for which the snapshot has ALL links. Links
+                    of other neurons (i.e. partners) are restricted to the
+                    connectors of these neurons. If None, assumes all
+                    neurons in ``neurons`` are complete.
+    meta :          dict, optional
+                    Any additional meta data (e.g. server and date).
+
+    Attributes
+    ----------
+    links :         pandas.DataFrame
+    neurons :       pandas.DataFrame
+    skeleton_ids :  numpy.ndarray
+
+    Examples
+    --------
+    >>> # Download a snapshot once...
+    >>> snap = pymaid.get_connectome_snapshot('annotation:glomerulus DA1')
+    >>> snap.save('DA1_snapshot.npz')
+    >>> # ... and load it again later
+    >>> snap = pymaid.ConnectomeSnapshot.load('DA1_snapshot.npz')
+    >>> # Queries are answered locally
+    >>> cn_table = snap.get_partners(snap.skeleton_ids[:2])
+    >>> adj = snap.adjacency_matrix(snap.skeleton_ids)
+
+    See Also
+    --------
+    :func:`~pymaid.get_connectome_snapshot`
+                    Generates a snapshot from a CATMAID server.
+
+    """
+
+    def __init__(self, links, neurons, skeleton_ids=None, meta={}):
+        self.links = pd.DataFrame({c: links[c].values.astype(dt)
+                                   for c, dt in LINK_COLUMNS.items()})
+        self.neurons = pd.DataFrame({c: neurons[c].values.astype(dt)
+                                     for c, dt in NEURON_COLUMNS.items()})
+        self.neurons.drop_duplicates('skeleton_id', inplace=True)
+        self.neurons.reset_index(drop=True, inplace=True)
+
+        if isinstance(skeleton_ids, type(None)):
+            skeleton_ids = self.neurons.skeleton_id.values
+        self.skeleton_ids = np.unique(np.asarray(skeleton_ids).astype(np.int64))
+
+        self.meta = dict(meta)
+
+    def __len__(self):
+        return self.links.shape[0]
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __repr__(self):
+        return '{} of {} neurons with {} connector links at {}'.format(type(self),
+                                                                       self.skeleton_ids.shape[0],
+                                                                       self.links.shape[0],
+                                                                       hex(id(self)))
+
+    def copy(self):
+        """Return a copy of the snapshot."""
+        return ConnectomeSnapshot(self.links.copy(), self.neurons.copy(),
+                                  self.skeleton_ids.copy(), self.meta)
+
+    def save(self, filename):
+        """ Save snapshot to a compressed numpy ``.npz`` file.
+
+        Parameters
+        ----------
+        filename :  str
+                    Filename to save to.
+
+        See Also
+        --------
+        :func:`~pymaid.ConnectomeSnapshot.load`
+                    Load snapshot from file.
+
+        """
+        data = {'links_' + c: self.links[c].values.astype(dt)
+                for c, dt in LINK_COLUMNS.items()}
+        data.update({'neurons_' + c: self.neurons[c].values.astype(dt)
+                     for c, dt in NEURON_COLUMNS.items()})
+        data['skeleton_ids'] = self.skeleton_ids
+        data['meta'] = np.array(json.dumps(self.meta, default=str))
+
+        np.savez_compressed(filename, **data)
+
+    @classmethod
+    def load(cls, filename):
+        """ Load snapshot from compressed numpy ``.npz`` file.
+
+        Parameters
+        ----------
+        filename :  str
+                    File generated with
+                    :func:`~pymaid.ConnectomeSnapshot.save`.
+
+        Returns
+        -------
+        ConnectomeSnapshot
+
+        """
+        with np.load(filename, allow_pickle=False) as data:
+            links = pd.DataFrame({c: data['links_' + c]
+                                  for c in LINK_COLUMNS})
+            neurons = pd.DataFrame({c: data['neurons_' + c]
+                                    for c in NEURON_COLUMNS})
+            skeleton_ids = data['skeleton_ids']
+            meta = json.loads(str(data['meta']))
+
+        return cls(links, neurons, skeleton_ids, meta)
+
+    def _eval_skids(self, x):
+        """Turn input into skeleton IDs (int). Neuron names are looked up
+        in the snapshot."""
+        if isinstance(x, (str, np.str_)) and not x.isnumeric() \
+           and not x.startswith('annotation'):
+            x = self.neurons.loc[self.neurons.neuron_name == x.replace('name:', '', 1),
+                                 'skeleton_id'].values
+            if not x.shape[0]:
+                raise ValueError('Name not found in snapshot')
+        elif isinstance(x, (list, np.ndarray, set)) \
+                and any([isinstance(s, (str, np.str_)) and not s.isnumeric() for s in x]):
+            return np.concatenate([self._eval_skids(s) for s in x])
+
+        return np.array(utils.eval_skids(x, warn_duplicates=False),
+                        dtype=np.int64)
+
+    def _check_complete(self, skids, what='neurons'):
+        """Warn if queried neurons are not fully contained in snapshot."""
+        miss = ~np.isin(skids, self.skeleton_ids)
+        if any(miss):
+            logger.warning('{} {} not fully contained in snapshot - results '
+                           'may be incomplete.'.format(miss.sum(), what))
+
+    def _pairs(self, rel1, rel2, skids1=None, skids2=None,
+               min_confidence=None):
+        """ Pair links of two relations on the same connector.
+
+        Parameters
+        ----------
+        rel1,rel2 :         str
+                            Relations, e.g. "presynaptic_to".
+        skids1,skids2 :     array-like, optional
+                            Restrict sides to these skeleton IDs.
+        min_confidence :    int, optional
+                            Minimum confidence of both links.
+
+        Returns
+        -------
+        pandas.DataFrame
+                            Columns of links with suffixes "1" and "2".
+
+        """
+        l = self.links
+        a = l[l.relation.values == rel1]
+        b = l[l.relation.values == rel2]
+
+        if not isinstance(skids1, type(None)):
+            a = a[np.isin(a.skeleton_id.values, skids1)]
+        if not isinstance(skids2, type(None)):
+            b = b[np.isin(b.skeleton_id.values, skids2)]
+
+        # Only pair links on shared connectors
+        b = b[np.isin(b.connector_id.values, a.connector_id.values)]
+
+        pairs = a.merge(b, on='connector_id', suffixes=('1', '2'))
+
+        # Make sure we don't pair links with themselves
+        if rel1 == rel2:
+            pairs = pairs[(pairs.treenode_id1.values != pairs.treenode_id2.values)
+                          | (pairs.skeleton_id1.values != pairs.skeleton_id2.values)]
+
+        if min_confidence:
+            conf = np.minimum(pairs.confidence1.values,
+                              pairs.confidence2.values)
+            pairs = pairs[conf >= min_confidence]
+
+        return pairs
+
+    def get_edges(self, sources=None, targets=None, min_confidence=None):
+        """ Get edges (synaptic connections) between neurons.
+
+        Parameters
+        ----------
+        sources,targets :   skeleton IDs | CatmaidNeuron/List, optional
+                            If not provided, will return all edges.
+        min_confidence :    int, optional
+                            Ignore links with lower confidence.
+
+        Returns
+        -------
+        pandas.DataFrame
+                ``source_skid``, ``target_skid``, ``weight``. Same format as
+                :func:`~pymaid.get_edges`.
+
+        """
+        if not isinstance(sources, type(None)):
+            sources = self._eval_skids(sources)
+        if not isinstance(targets, type(None)):
+            targets = self._eval_skids(targets)
+
+        pairs = self._pairs('presynaptic_to', 'postsynaptic_to',
+                            sources, targets, min_confidence=min_confidence)
+
+        edges = pairs.groupby(['skeleton_id1', 'skeleton_id2']).size()
+        edges = edges.reset_index(drop=False)
+        edges.columns = ['source_skid', 'target_skid', 'weight']
+
+        return edges
+
+    def get_partners(self, x, threshold=1, min_size=2, filt=[],
+                     min_confidence=1,
+                     directions=['incoming', 'outgoing',
+                                 'gapjunctions', 'attachments']):
+        """ Retrieve partners from snapshot.
+
+        See :func:`~pymaid.get_partners` for details.
+
+        Parameters
+        ----------
+        x :                 skeleton IDs | CatmaidNeuron/List
+                            Neurons for which to retrieve partners.
+        threshold :         int, optional
+                            Minimum # of links (synapses/gap-junctions/etc).
+        min_size :          int, optional
+                            Minimum node count of partner.
+        filt :              list of str, optional
+                            Filters partners for neuron names (must be exact)
+                            or skeleton_ids.
+        min_confidence :    int | None, optional
+                            Edges with lower confidence will be ignored.
+        directions :        'incoming' | 'outgoing' | 'gapjunctions' | 'attachments', optional
+                            Use to restrict to either up- or downstream
+                            partners.
+
+        Returns
+        -------
+        pandas.DataFrame
+                            Same format as :func:`~pymaid.get_partners`.
+
+        """
+        relations = {'incoming': 'upstream',
+                     'outgoing': 'downstream',
+                     'gapjunctions': 'gapjunction',
+                     'attachments': 'attachment'}
+
+        repl = {v: k for k, v in relations.items()}
+        directions = [repl.get(d, d) for d in utils._make_iterable(directions)]
+
+        wrong_dir = set(directions) - set(relations.keys())
+        if wrong_dir:
+            raise ValueError('Unknown direction "{}". Please use a combination '
+                             'of "{}"'.format(', '.join(wrong_dir),
+                                              ', '.join(relations.keys())))
+
+        skids = self._eval_skids(x)
+        self._check_complete(skids)
+        x = skids.astype(str)
+
+        tables = []
+        for d in relations:
+            if d not in directions:
+                continue
+            rel1, rel2 = DIRECTIONS[d]
+            pairs = self._pairs(rel1, rel2, skids1=skids,
+                                min_confidence=min_confidence)
+
+            if pairs.empty:
+                continue
+
+            # Count links per partner (rows) and query neuron (columns)
+            partners, p_ix = np.unique(pairs.skeleton_id2.values,
+                                       return_inverse=True)
+            q_ix = pd.Index(skids).get_indexer(pairs.skeleton_id1.values)
+            counts = np.zeros((partners.shape[0], skids.shape[0]), dtype=int)
+            np.add.at(counts, (p_ix, q_ix), 1)
+
+            this = pd.DataFrame(counts, columns=x)
+            this.insert(0, 'relation', relations[d])
+            this.insert(0, 'skeleton_id', partners.astype(str))
+            tables.append(this)
+
+        if tables:
+            df = pd.concat(tables, axis=0, ignore_index=True)
+        else:
+            df = pd.DataFrame([], columns=['skeleton_id', 'relation'] + list(x))
+
+        # Add names and node counts
+        neurons = self.neurons.set_index(self.neurons.skeleton_id.astype(str))
+        neurons = neurons.reindex(df.skeleton_id.values)
+        df.insert(0, 'neuron_name', neurons.neuron_name.fillna('').values)
+        df.insert(2, 'num_nodes', neurons.num_nodes.fillna(0).values.astype(int))
+
+        df['total'] = df[x].sum(axis=1).values
+
+        # Now filter for synapse threshold and size
+        df = df[(df.num_nodes >= min_size) & (df.total >= threshold)]
+
+        df.sort_values(['relation', 'total'], inplace=True, ascending=False)
+
+        if filt:
+            filt = [str(s) for s in utils._make_iterable(filt)]
+            df = df[df.skeleton_id.isin(filt) | df.neuron_name.isin(filt)]
+
+        df.datatype = 'connectivity_table'
+
+        df.reset_index(drop=True, inplace=True)
+
+        return df
+
+    def adjacency_matrix(self, sources, targets=None, source_grp={},
+                         target_grp={}, fractions=False, syn_threshold=None,
+                         syn_cutoff=None, use_connectors=False,
+                         volume_filter=None, sparse=False):
+        """ Generate adjacency matrix from snapshot.
+
+        See :func:`~pymaid.adjacency_matrix` for details.
+
+        Parameters
+        ----------
+        sources,targets :   skeleton IDs | CatmaidNeuron/List
+                            If ``targets=None``, will use
+                            ``targets=sources``.
+        source_grp,target_grp : dict, optional
+                            Use to collapse sources/targets into groups.
+        fractions :         bool, optional
+                            If True, will return connectivity as fraction of
+                            total number of postsynaptic links to target
+                            neuron.
+        syn_threshold :     int, optional
+                            If set, will ignore connections with LESS
+                            synapses.
+        syn_cutoff :        int, optional
+                            If set, will cut off connections ABOVE given
+                            value.
+        use_connectors :    bool, optional
+                            If True AND ``sources`` or ``targets`` are
+                            ``CatmaidNeuron/List``, restrict adjacency
+                            matrix to their connectors.
+        volume_filter :     Volume | list of Volumes, optional
+                            Volume(s) to restrict connections to. Must be
+                            ``pymaid.Volume``.
+        sparse :            bool, optional
+                            If True, will return a
+                            :class:`~pymaid.SparseConnectome`.
+
+        Returns
+        -------
+        pandas.DataFrame | SparseConnectome
+                            Same format as :func:`~pymaid.adjacency_matrix`.
+
+        """
+        source_skids = self._eval_skids(sources)
+        if isinstance(targets, type(None)):
+            targets = sources
+            target_skids = source_skids
+        else:
+            target_skids = self._eval_skids(targets)
+
+        self._check_complete(np.append(source_skids, target_skids))
+
+        pairs = self._pairs('presynaptic_to', 'postsynaptic_to',
+                            source_skids, target_skids)
+
+        if use_connectors:
+            for n in [sources, targets]:
+                if isinstance(n, (core.CatmaidNeuron, core.CatmaidNeuronList)):
+                    pairs = pairs[pairs.connector_id.isin(n.connectors.connector_id.values)]
+
+        if volume_filter:
+            for vol in utils._make_iterable(volume_filter):
+                if not isinstance(vol, core.Volume):
+                    raise TypeError('Expected pymaid.Volume, got '
+                                    '"{}"'.format(type(vol)))
+                in_vol = intersect.in_volume(pairs[['x1', 'y1', 'z1']].values,
+                                             vol)
+                pairs = pairs[in_vol]
+
+        matrix = core.SparseConnectome.from_edges(pairs.skeleton_id1.values,
+                                                  pairs.skeleton_id2.values,
+                                                  np.ones(pairs.shape[0]),
+                                                  sources=source_skids,
+                                                  targets=target_skids)
+
+        matrix = matrix.threshold(syn_threshold=syn_threshold,
+                                  syn_cutoff=syn_cutoff)
+
+        if fractions:
+            post = self.links[self.links.relation.values == 'postsynaptic_to']
+            post = post[post.connector_id.isin(self.links.loc[self.links.relation.values == 'presynaptic_to',
+                                                              'connector_id'].values)]
+            div = post.skeleton_id.value_counts().reindex(target_skids).fillna(0).values
+            with np.errstate(divide='ignore'):
+                scale = scipy.sparse.diags(np.where(div > 0, 1 / div, 0))
+            matrix.matrix = matrix.matrix.dot(scale).tocsr()
+
+        if source_grp or target_grp:
+            matrix = connectivity.group_matrix(matrix,
+                                               source_grp,
+                                               target_grp,
+                                               drop_ungrouped=False)
+
+        if sparse:
+            return matrix
+
+        return matrix.to_dataframe()
+
+    def get_connectors_between(self, a, b, directional=True):
+        """ Retrieve connectors between sets of neurons from snapshot.
+
+        See :func:`~pymaid.get_connectors_between` for details.
+
+        Parameters
+        ----------
+        a,b :           skeleton IDs | CatmaidNeuron/List
+                        Neurons for which to retrieve connectors.
+        directional :   bool, optional
+                        If True, only connectors a -> b are listed,
+                        otherwise it is a <-> b.
+
+        Returns
+        -------
+        pandas.DataFrame
+                        Same format as :func:`~pymaid.get_connectors_between`.
+
+        """
+        a = self._eval_skids(a)
+        b = self._eval_skids(b)
+
+        if len(a) == 0:
+            raise ValueError('No source neurons provided')
+
+        if len(b) == 0:
+            raise ValueError('No target neurons provided')
+
+        pairs = [self._pairs('presynaptic_to', 'postsynaptic_to', a, b)]
+        if not directional:
+            pairs.append(self._pairs('postsynaptic_to', 'presynaptic_to', a, b))
+        pairs = pd.concat(pairs, axis=0, ignore_index=True)
+
+        df = pd.DataFrame({'connector_id': pairs.connector_id.values,
+                           'connector_loc': list(pairs[['x1', 'y1', 'z1']].values),
+                           'treenode1_id': pairs.treenode_id1.values,
+                           'source_neuron': pairs.skeleton_id1.values,
+                           'confidence1': pairs.confidence1.values,
+                           'creator1': pairs.creator1.values,
+                           'treenode1_loc': list(pairs[['tn_x1', 'tn_y1', 'tn_z1']].values),
+                           'treenode2_id': pairs.treenode_id2.values,
+                           'target_neuron': pairs.skeleton_id2.values,
+                           'confidence2': pairs.confidence2.values,
+                           'creator2': pairs.creator2.values,
+                           'treenode2_loc': list(pairs[['tn_x2', 'tn_y2', 'tn_z2']].values)},
+                          columns=['connector_id', 'connector_loc',
+                                   'treenode1_id', 'source_neuron',
+                                   'confidence1', 'creator1', 'treenode1_loc',
+                                   'treenode2_id', 'target_neuron',
+                                   'confidence2', 'creator2', 'treenode2_loc'])
+
+        return df
+
+    def get_nth_partners(self, x, n_circles=1, min_pre=2, min_post=2):
+        """ Retrieve Nth partners from snapshot.
+
+        See :func:`~pymaid.get_nth_partners` for details.
+
+        Parameters
+        ----------
+        x :                 skeleton IDs | CatmaidNeuron/List
+                            Seed neurons for which to retrieve partners.
+        n_circles :         int, optional
+                            Number of circles around your seed neurons.
+        min_pre/min_post :  int, optional
+                            Synapse threshold. Set to -1 to not get any
+                            pre-/post synaptic partners.
+
+        Returns
+        -------
+        pandas.DataFrame
+                            Same format as :func:`~pymaid.get_nth_partners`.
+
+        """
+        edges = self.get_edges()
+
+        current = self._eval_skids(x)
+        seen = set(current)
+        for i in range(n_circles):
+            if not len(current):
+                break
+            self._check_complete(current)
+
+            next_circle = []
+            if min_pre != -1:
+                up = edges[np.isin(edges.target_skid.values, current)
+                           & (edges.weight.values >= min_pre)]
+                next_circle.append(up.source_skid.values)
+            if min_post != -1:
+                down = edges[np.isin(edges.source_skid.values, current)
+                             & (edges.weight.values >= min_post)]
+                next_circle.append(down.target_skid.values)
+
+            if next_circle:
+                next_circle = np.unique(np.concatenate(next_circle))
+            else:
+                next_circle = np.array([], dtype=np.int64)
+            current = next_circle[~np.isin(next_circle, list(seen))]
+            seen.update(current)
+
+        names = self.neurons.set_index('skeleton_id').neuron_name
+        df = pd.DataFrame({'skeleton_id': np.asarray(current).astype(str),
+                           'neuron_name': names.reindex(current).fillna('').values},
+                          columns=['skeleton_id', 'neuron_name'])
+
+        return df
+
+    def get_paths(self, sources, targets, n_hops=2, min_synapses=1,
+                  return_graph=False, remove_isolated=False):
+        """ Retrieve paths between two sets of neurons from snapshot.
+
+        See :func:`~pymaid.get_paths` for details.
+
+        Parameters
+        ----------
+        sources,targets :   skeleton IDs | CatmaidNeuron/List
+                            Source and target neurons.
+        n_hops :            int | list | range, optional
+                            Number of hops allowed between sources and
+                            targets. Direct connection would be 1 hop.
+        min_synapses :      int, optional
+                            Minimum number of synpases between source and
+                            target.
+        return_graph :      bool, optional
+                            If True, will return NetworkX Graph.
+        remove_isolated :   bool, optional
+                            Remove isolated nodes from NetworkX Graph. Only
+                            relevant if ``return_graph=True``.
+
+        Returns
+        -------
+        paths :     list
+                    List of skeleton IDs that constitute paths from
+                    sources to targets.
+        networkx.DiGraph
+                    Only if ``return_graph=True``.
+
+        """
+        sources = self._eval_skids(sources)
+        targets = self._eval_skids(targets)
+
+        n_hops = utils._make_iterable(n_hops)
+        if min(n_hops) <= 0:
+            raise ValueError('n_hops must not be <= 0')
+        max_hops = max(n_hops)
+
+        edges = self.get_edges()
+        edges = edges[edges.weight.values >= min_synapses]
+
+        # Find neurons that are within reach from both sources and targets
+        skids = np.unique(np.concatenate([edges.source_skid.values,
+                                          edges.target_skid.values,
+                                          sources, targets]))
+        ix = pd.Index(skids)
+        adj = scipy.sparse.csr_matrix((np.ones(edges.shape[0], dtype=bool),
+                                       (ix.get_indexer(edges.source_skid.values),
+                                        ix.get_indexer(edges.target_skid.values))),
+                                      shape=(skids.shape[0], skids.shape[0]))
+        d_src = _hops(adj.T.tocsr(), ix.get_indexer(sources), max_hops)
+        d_tgt = _hops(adj, ix.get_indexer(targets), max_hops)
+        keep = skids[(d_src + d_tgt) <= max_hops]
+
+        edges = edges[np.isin(edges.source_skid.values, keep)
+                      & np.isin(edges.target_skid.values, keep)]
+
+        names = self.neurons.set_index('skeleton_id').neuron_name
+        g = nx.DiGraph()
+        g.add_nodes_from([(str(s), {'neuron_name': names.get(s, str(s))})
+                          for s in np.unique(np.concatenate([keep, sources, targets]))])
+        g.add_edges_from([(str(s), str(t), {'weight': w})
+                          for s, t, w in edges[['source_skid', 'target_skid', 'weight']].values])
+
+        sources = sources.astype(str)
+        targets = targets.astype(str)
+
+        # Get all paths between sources and targets
+        all_paths = [p for s in sources for t in targets for p in
+                     nx.all_simple_paths(g, s, t,
+                                         cutoff=max_hops) if len(p) - 1 in n_hops]
+
+        if not return_graph:
+            return all_paths
+
+        # Turn into edges
+        edges_to_keep = set([e for l in all_paths for e in nx.utils.pairwise(l)])
+
+        # Remove edges
+        g.remove_edges_from([e for e in list(g.edges) if e not in edges_to_keep])
+
+        if remove_isolated:
+            # Remove isolated nodes
+            g.remove_nodes_from(list(nx.isolates(g)))
+
+        return all_paths, g
+
+
+def _hops(adj, start, max_hops):
+    """Number of hops from (or to) start nodes. Unreachable -> max_hops + 1."""
+    dist = np.full(adj.shape[0], max_hops + 1, dtype=int)
+    dist[start] = 0
+    front = np.zeros(adj.shape[0], dtype=bool)
+    front[start] = True
+    for h in range(1, max_hops + 1):
+        front = (adj.dot(front) > 0) & (dist > h)
+        if not any(front):
+            break
+        dist[front] = h
+    return dist
+
+
+def get_connectome_snapshot(x=None, with_partners=True, min_size=2,
+                            chunk_size=50, remote_instance=None):
+    """ Download connector links into a local snapshot.
+
+    Use the snapshot to answer connectivity queries (partners, adjacency
+    matrices, connectors between neurons, paths) without going back to the
+    server. Save to/load from disk via
+    :func:`~pymaid.ConnectomeSnapshot.save` and
+    :func:`~pymaid.ConnectomeSnapshot.load`.
+
+    Parameters
+    ----------
+    x
+                        Neurons to take snapshot of. If None, will take a
+                        snapshot of all neurons in the project. Can be:
+
+                        1. list of skeleton ID(s) (int or str)
+                        2. list of neuron name(s) (str, exact match)
+                        3. an annotation: e.g. 'annotation:PN right'
+                        4. CatmaidNeuron or CatmaidNeuronList object
+    with_partners :     bool, optional
+                        If True, will also fetch the synaptic partners' links
+                        on the connectors of above neurons. Required to
+                        answer e.g. :func:`~pymaid.ConnectomeSnapshot.get_partners`.
+                        Ignored if ``x=None``.
+    min_size :          int, optional
+                        Minimum node count of neurons to include if
+                        ``x=None``.
+    chunk_size :        int, optional
+                        Neurons are fetched in chunks of this size.
+    remote_instance :   CatmaidInstance, optional
+                        If not passed directly, will try using global.
+
+    Returns
+    -------
+    :class:`~pymaid.ConnectomeSnapshot`
+
+    Examples
+    --------
+    >>> snap = pymaid.get_connectome_snapshot('annotation:glomerulus DA1')
+    >>> snap.save('DA1_snapshot.npz')
+    >>> paths = snap.get_paths(snap.skeleton_ids[:5], snap.skeleton_ids[5:])
+
+    """
+    remote_instance = utils._eval_remote_instance(remote_instance)
+
+    if isinstance(x, type(None)):
+        url = remote_instance._get_list_skeletons_url()
+        url += '?%s' % urllib.parse.urlencode({'nodecount_gt': min_size - 1})
+        skids = [str(s) for s in remote_instance.fetch(url)]
+        with_partners = False
+    else:
+        skids = utils.eval_skids(x, remote_instance=remote_instance)
+
+    skids = list(set(skids))
+
+    # Fetch links of query neurons
+    links = fetch.get_connector_links(skids, chunk_size=chunk_size,
+                                      remote_instance=remote_instance)
+
+    # Fetch links of partners on the same connectors
+    if with_partners and not links.empty:
+        cn_ids = links.connector_id.unique()
+        details = fetch.get_connector_details(cn_ids,
+                                              remote_instance=remote_instance)
+        partners = set(details.presynaptic_to.dropna().values)
+        partners |= set([s for l in details.postsynaptic_to.values for s in l])
+        partners = list(set([str(int(p)) for p in partners]) - set(skids))
+
+        if partners:
+            p_links = fetch.get_connector_links(partners,
+                                                chunk_size=chunk_size,
+                                                remote_instance=remote_instance)
+            p_links = p_links[p_links.connector_id.isin(cn_ids)]
+            links = pd.concat([links, p_links], axis=0, ignore_index=True)
+
+    links = links.drop_duplicates(['connector_id', 'skeleton_id',
+                                   'treenode_id', 'relation'])
+    links = links.reset_index(drop=True)
+
+    # Fetch treenode locations in chunks
+    tn_ids = links.treenode_id.unique()
+    locs = [fetch.get_node_location(tn_ids[i:i + 10000], sort=False,
+                                    remote_instance=remote_instance)
+            for i in config.trange(0, len(tn_ids), 10000,
+                                   desc='Node locations',
+                                   disable=config.pbar_hide,
+                                   leave=config.pbar_leave)]
+    if locs:
+        locs = pd.concat(locs, axis=0).set_index('node_id')
+    else:
+        locs = pd.DataFrame([], columns=['x', 'y', 'z'])
+    locs = locs.reindex(links.treenode_id.values)
+    links['tn_x'] = locs.x.values
+    links['tn_y'] = locs.y.values
+    links['tn_z'] = locs.z.values
+
+    # Replace user IDs with logins
+    users = fetch.get_user_list(remote_instance=remote_instance).set_index('id')
+    links['creator'] = users.login.reindex(links.creator.values).fillna('').values
+
+    # Get names and node counts
+    all_skids = list(set(links.skeleton_id.astype(str).tolist() + skids))
+    review = fetch.get_review(all_skids, remote_instance=remote_instance)
+    neurons = pd.DataFrame({'skeleton_id': review.skeleton_id.values,
+                            'neuron_name': review.neuron_name.values,
+                            'num_nodes': review.total_node_count.values})
+
+    meta = {'server': remote_instance.server,
+            'project_id': remote_instance.project_id,
+            'date': datetime.datetime.now().isoformat()}
+
+    return ConnectomeSnapshot(links, neurons, skeleton_ids=skids, meta=meta)
@@ -53,6 +53,7 @@ import matplotlib.pyplot as plt
 
 import unittest
 import datetime
+import tempfile
 
 import pymaid
 import pandas as pd
@@ -103,7 +104,7 @@ class TestModules(unittest.TestCase):
     def test_imports(self):
         mods = ['morpho', 'core', 'plotting', 'graph', 'graph_utils', 'core',
                 'connectivity', 'user_stats', 'cluster', 'resample',
-                'intersect', 'fetch', 'scene3d']
+                'intersect', 'fetch', 'scene3d', 'nblast_funcs']
 
         for m in mods:
             _ = importlib.import_module('pymaid.{}'.format(m))
@@ -529,21 +530,86 @@ class TestMorpho(unittest.TestCase):
         nl2.downsample(4)
         self.assertLess(nl2.n_nodes.sum(), self.nl.n_nodes.sum())
 
+        # Simplified neuron must only consist of root, branch and end nodes
+        simple = self.nl[0].simple
+        self.assertFalse(any(simple.nodes.type == 'slab'))
+        self.assertEqual(simple.n_branch_nodes, self.nl[0].n_branch_nodes)
+
     @try_conditions
     def test_resampling(self):
         nl2 = self.nl.resample(10000, inplace=False)
         self.assertNotEqual(nl2.n_nodes.sum(), self.nl.n_nodes.sum())
 
+        # Batched resampling must give the same result as single neurons
+        n2 = pymaid.resample_neuron(self.nl[0], 10000, inplace=False)
+        self.assertEqual(n2.n_nodes, nl2[0].n_nodes)
+        self.assertTrue(all(n2.connectors.treenode_id.isin(n2.nodes.treenode_id)))
+
     @try_conditions
     def test_prune_by_strahler(self):
         nl2 = self.nl.prune_by_strahler(inplace=False, to_prune=1)
         self.assertLess(nl2.n_nodes.sum(), self.nl.n_nodes.sum())
 
+    @try_conditions
+    def test_prune_twigs(self):
+        nl2 = pymaid.prune_twigs(self.nl, 5, recursive=float('inf'),
+                                 inplace=False)
+        self.assertLess(nl2.n_nodes.sum(), self.nl.n_nodes.sum())
+
+        # Single bottom-up pass must match pruning round by round
+        n2 = self.nl[0].copy()
+        while True:
+            n_nodes = n2.n_nodes
+            pymaid.prune_twigs(n2, 5, inplace=True)
+            if n2.n_nodes == n_nodes:
+                break
+        self.assertEqual(n2.n_nodes, nl2[0].n_nodes)
+
+    @try_conditions
+    def test_strahler_index(self):
+        nl2 = pymaid.strahler_index(self.nl, inplace=False)
+        n2 = pymaid.strahler_index(self.nl[0], inplace=False)
+        self.assertTrue(all(n2.nodes.strahler_index.values == nl2[0].nodes.strahler_index.values))
+
+    @try_conditions
+    def test_analysis_cache(self):
+        with tempfile.TemporaryDirectory() as path:
+            store = pymaid.cache.setup_analysis_cache(path)
+            try:
+                m1 = pymaid.morphometrics(self.nl)
+                self.assertEqual(len(store), len(self.nl))
+                m2 = pymaid.morphometrics(self.nl)
+                self.assertTrue(m1.equals(m2))
+            finally:
+                pymaid.cache.disable_analysis_cache()
+
+    @try_conditions
+    def test_dotprops(self):
+        dps = pymaid.to_dotprops(self.nl, k=5)
+        self.assertIsInstance(dps[0], pymaid.CatmaidDotprops)
+        self.assertEqual(dps[0].points.shape, dps[0].vect.shape)
+
+    @try_conditions
+    def test_nblast(self):
+        res = pymaid.nblast_allbyall(self.nl[:3], n_cores=1)
+        self.assertIsInstance(res, pymaid.ClustResults)
+        self.assertTrue(np.allclose(res.sim_mat.values.diagonal(), 1, atol=1e-3))
+
     @try_conditions
     def test_axon_dendrite_split(self):
         self.assertIsInstance(pymaid.split_axon_dendrite(self.nl[0]),
                               pymaid.CatmaidNeuronList)
 
+    @try_conditions
+    def test_axon_dendrite_labels(self):
+        labels = pymaid.split_axon_dendrite(self.nl, label_only=True)
+        self.assertEqual(len(labels), len(self.nl))
+        split = {f.type: f for f in pymaid.split_axon_dendrite(self.nl[0])}
+        tn_ids = self.nl[0].nodes.treenode_id.values
+        for comp in ['axon', 'dendrite']:
+            self.assertTrue(set(split[comp].nodes.treenode_id.values) >=
+                            set(tn_ids[labels[0] == comp]))
+
     @try_conditions
     def test_segregation_index(self):
         self.assertIsInstance(pymaid.segregation_index(self.nl[0]),
@@ -559,6 +625,28 @@ class TestMorpho(unittest.TestCase):
         self.assertIsInstance(pymaid.flow_centrality(self.nl[0]),
                               type(None))
 
+    @try_conditions
+    def test_flow_centrality_list(self):
+        nl2 = self.nl.copy()
+        pymaid.flow_centrality(nl2)
+        n2 = self.nl[0].copy()
+        pymaid.flow_centrality(n2)
+        self.assertTrue(np.allclose(n2.nodes.flow_centrality.fillna(-1).values,
+                                    nl2[0].nodes.flow_centrality.fillna(-1).values))
+
+    @try_conditions
+    def test_flow_centrality_list_polypre(self):
+        # Neurons in the batch may be connected to each other: that must not
+        # change polyadic presynapse counts
+        for mode in ['centrifugal', 'centripetal']:
+            nl2 = self.nl.copy()
+            pymaid.flow_centrality(nl2, mode=mode, polypre=True)
+            for n in nl2[:3]:
+                n2 = self.nl.skid[n.skeleton_id].copy()
+                pymaid.flow_centrality(n2, mode=mode, polypre=True)
+                self.assertTrue(np.allclose(n2.nodes.flow_centrality.fillna(-1).values,
+                                            n.nodes.flow_centrality.fillna(-1).values))
+
     @try_conditions
     def test_stitching(self):
         self.assertIsInstance(pymaid.stitch_neurons(self.nl[:2],
@@ -568,11 +656,31 @@ class TestMorpho(unittest.TestCase):
                                                     method='LEAFS'),
                               pymaid.CatmaidNeuron)
 
+    @try_conditions
+    def test_heal_fragmented_neuron(self):
+        frag = pymaid.stitch_neurons(self.nl[:3], method='NONE')
+        self.assertEqual(frag.n_skeletons, 3)
+
+        healed = pymaid.heal_fragmented_neuron(frag, inplace=False)
+        self.assertEqual(healed.n_skeletons, 1)
+        self.assertEqual(healed.n_nodes, frag.n_nodes)
+
     @try_conditions
     def test_averaging(self):
         self.assertIsInstance(pymaid.average_neurons(self.nl[:2]),
                               pymaid.CatmaidNeuron)
 
+    @try_conditions
+    def test_union(self):
+        backbone = self.nl[0].prune_by_longest_neurite(inplace=False)
+        branches = self.nl[0].prune_by_longest_neurite(n=slice(1, None),
+                                                       inplace=False)
+        branches.skeleton_id = '1'
+        union = pymaid.union_neurons(backbone, branches, limit=2)
+        self.assertIsInstance(union, pymaid.CatmaidNeuron)
+        self.assertLessEqual(union.n_nodes,
+                             backbone.n_nodes + branches.n_nodes)
+
     @try_conditions
     def test_tortuosity(self):
         self.assertIsInstance(pymaid.tortuosity(self.nl[0]),
@@ -580,12 +688,32 @@ class TestMorpho(unittest.TestCase):
         self.assertIsInstance(pymaid.tortuosity(self.nl),
                               pd.DataFrame)
 
+        # Batched computation must match single neurons
+        t = pymaid.tortuosity(self.nl[:2], seg_length=[5, 10])
+        self.assertAlmostEqual(t.iloc[1, 0],
+                               pymaid.tortuosity(self.nl[0], seg_length=10))
+
+    @try_conditions
+    def test_morphometrics(self):
+        m = self.nl.morphometrics(['cable_length', 'n_branch_nodes',
+                                   'max_strahler'])
+        self.assertIsInstance(m, pd.DataFrame)
+        self.assertEqual(m.shape[0], len(self.nl))
+        self.assertTrue(np.allclose(m.cable_length.values,
+                                    self.nl.cable_length, rtol=.01))
+        self.assertTrue(np.array_equal(m.n_branch_nodes.values,
+                                       self.nl.n_branch_nodes))
+
     @try_conditions
     def test_arbor_confidence(self):
         self.assertIsInstance(pymaid.arbor_confidence(self.nl[0],
                                                       inplace=False),
                               pymaid.CatmaidNeuron)
 
+        nl = pymaid.arbor_confidence(self.nl[:2], inplace=False)
+        self.assertIsInstance(nl, pymaid.CatmaidNeuronList)
+        self.assertTrue(all(nl[0].nodes.arbor_confidence <= 1))
+
     @try_conditions
     def test_calc_cable(self):
         self.assertIsNotNone(pymaid.calc_cable(self.nl[0]))
@@ -612,6 +740,31 @@ class TestMorpho(unittest.TestCase):
                                                     inplace=False),
                               pymaid.CatmaidNeuron)
 
+    @try_conditions
+    def test_smooth_neuron(self):
+        sm = pymaid.smooth_neuron(self.nl[:2], window=5, inplace=False)
+        self.assertEqual(sm[0].n_nodes, self.nl[0].n_nodes)
+        self.assertTrue(np.allclose(
+            sm[0].nodes[['x', 'y', 'z']].values,
+            pymaid.smooth_neuron(self.nl[0], window=5).nodes[['x', 'y', 'z']].values))
+
+    @try_conditions
+    def test_time_machine(self):
+        snaps = pymaid.time_machine(self.nl[:2], ['2017-01-01', '2018-01-01'])
+        self.assertEqual(len(snaps), 2)
+        self.assertIsInstance(snaps[0], pymaid.CatmaidNeuronList)
+        self.assertTrue(all(snaps[0].n_nodes <= snaps[1].n_nodes))
+
+        # Skeleton ID as input
+        skid = self.nl[0].skeleton_id
+        snap = pymaid.time_machine(skid, '2018-01-01')
+        self.assertIsInstance(snap, pymaid.CatmaidNeuron)
+        snaps = pymaid.time_machine(skid, ['2017-01-01', '2018-01-01'])
+        self.assertEqual(len(snaps), 2)
+        self.assertIsNot(snaps[0], snaps[1])
+        self.assertEqual(snaps[1].n_nodes, snap.n_nodes)
+        self.assertTrue(snaps[0].n_nodes <= snaps[1].n_nodes)
+
     @try_conditions
     def test_guess_radius(self):
         self.assertIsInstance(pymaid.guess_radius(self.nl[0],
@@ -768,6 +921,29 @@ class TestConnectivity(unittest.TestCase):
                                      row_groups={n: 'group1' for n in self.adj.index.values})
         self.assertIsInstance(gr_adj, pd.DataFrame)
 
+    @try_conditions
+    def test_connectome_snapshot(self):
+        snap = pymaid.get_connectome_snapshot(config_test.test_skids[0],
+                                              remote_instance=self.rm)
+        with tempfile.TemporaryDirectory() as tmp:
+            fp = os.path.join(tmp, 'snapshot.npz')
+            snap.save(fp)
+            snap = pymaid.ConnectomeSnapshot.load(fp)
+        cn = snap.get_partners(config_test.test_skids[0])
+        self.assertIsInstance(cn, pd.DataFrame)
+        self.assertTrue(set(cn.relation) <= set(self.cn_table.relation))
+
+    @try_conditions
+    def test_sparse_connectome(self):
+        sp = pymaid.adjacency_matrix(self.adj.index.values, sparse=True)
+        self.assertIsInstance(sp, pymaid.SparseConnectome)
+        self.assertTrue(np.all(sp.to_dataframe().values == self.adj.values))
+        gr = pymaid.group_matrix(sp,
+                                 row_groups={n: 'group1' for n in sp.sources})
+        self.assertEqual(gr.shape, (1, self.adj.shape[1]))
+        self.assertIsInstance(pymaid.SparseConnectome.from_partners(self.cn_table),
+                              pymaid.SparseConnectome)
+
     @try_conditions
     def test_connectivity_filter(self):
         dist, prox = pymaid.cut_neuron(
@@ -801,6 +977,29 @@ class TestConnectivity(unittest.TestCase):
                                                           remote_instance=self.rm),
                               pd.DataFrame)
 
+    @try_conditions
+    def test_connection_density(self):
+        up = self.cn_table[self.cn_table.relation == 'upstream'].iloc[:5].skeleton_id.values
+        dens = pymaid.connection_density_matrix(up, self.n,
+                                                remote_instance=self.rm)
+        self.assertEqual(dens.shape, (len(up), 1))
+        d = pymaid.connection_density(up[0], self.n, remote_instance=self.rm)
+        if d is None:
+            self.assertTrue(np.isnan(dens.iloc[0, 0]))
+        else:
+            self.assertAlmostEqual(d, dens.iloc[0, 0])
+
+    @try_conditions
+    def test_pred_connectivity_threshold(self):
+        # Single target node at exactly ``dist`` from a presynapse: distances
+        # must be strictly smaller than ``dist`` to count
+        t = self.nB.copy()
+        t.nodes[['x', 'y', 'z']] = t.nodes[['x', 'y', 'z']].values + 10**9
+        pre = self.n.presynapses[['x', 'y', 'z']].values[0]
+        t.nodes.loc[t.nodes.index[0], ['x', 'y', 'z']] = pre + [300, 0, 0]
+        self.assertEqual(pymaid.predict_connectivity(self.n, t, dist=300).values.sum(), 0)
+        self.assertGreater(pymaid.predict_connectivity(self.n, t, dist=301).values.sum(), 0)
+
     @try_conditions
     def test_cn_table_from_connectors(self):
         self.assertIsInstance(pymaid.cn_table_from_connectors(self.n,
@@ -844,11 +1043,30 @@ class TestCluster(unittest.TestCase):
         self.assertIsInstance(pymaid.cluster_by_connectivity(config_test.test_skids),
                               pymaid.ClustResults)
 
+    @try_conditions
+    def test_connectivity_similarity(self):
+        for sim in ['matching_index', 'matching_index_synapses',
+                    'matching_index_weighted_synapses', 'vertex',
+                    'vertex_normalized']:
+            res = pymaid.cluster_by_connectivity(config_test.test_skids,
+                                                 similarity=sim)
+            self.assertEqual(res.sim_mat.shape[0], res.sim_mat.shape[1])
+
     @try_conditions
     def test_synapse_cluster(self):
         self.assertIsInstance(pymaid.cluster_by_synapse_placement(config_test.test_skids),
                               pymaid.ClustResults)
 
+    @try_conditions
+    def test_synapse_cluster_parallel(self):
+        nl = pymaid.get_neuron(config_test.test_skids,
+                               remote_instance=self.rm)
+        res1 = pymaid.cluster_by_synapse_placement(nl, parallel=False)
+        res2 = pymaid.cluster_by_synapse_placement(nl, parallel=True,
+                                                   n_cores=2)
+        self.assertTrue(np.allclose(res1.sim_mat.values,
+                                    res2.sim_mat.values))
+
     @try_conditions
     def test_clustresults(self):
         res = pymaid.cluster_by_connectivity(config_test.test_skids)
@@ -861,6 +1079,21 @@ class TestCluster(unittest.TestCase):
         self.assertIsInstance(res.get_colormap(k=2), dict)
         self.assertIsInstance(res.get_clusters(k=2), list)
 
+        # Condensed + float32 input
+        res2 = pymaid.ClustResults(res.condensed_dist_mat.astype(np.float32),
+                                   labels=res.labels)
+        self.assertEqual(res2.get_clusters(k=2), res.get_clusters(k=2))
+
+        # Condensed similarity input
+        S = np.array([[1, .9, .2], [.9, 1, .3], [.2, .3, 1]])
+        off_diag = ~np.eye(3, dtype=bool)
+        res3 = pymaid.ClustResults(S[np.triu_indices(3, 1)],
+                                   mat_type='similarity')
+        self.assertTrue(np.allclose(res3.sim_mat[off_diag], S[off_diag]))
+        # Condensed matrices have no diagonal -> inverted by max off-diagonal
+        self.assertTrue(np.allclose(res3.dist_mat[off_diag], .9 - S[off_diag]))
+        self.assertTrue(np.allclose(res3.dist_mat.diagonal(), 0))
+
 
 class TestPlot(unittest.TestCase):
     """Test pymaid.plotting """